@@ -0,0 +1,115 @@
+import json
+import os
+import random
+import re
+import string
+from itertools import accumulate
+
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATEGORIES = ['1', '2', '3', '4', '5', '6', '8']
+SUBCATEGORIES = ['', '', '', 'a', 'b']  # most files without a subcategory
+NON_ASCII = 'ąćęłńóśźżβ™—−'
+
+
+def parse_size(size: str) -> int:
+    match = re.fullmatch(r'(\d+(?:\.\d+)?)\s*([kKmMgG]?)[bB]?', size)
+    if match is None:
+        raise click.BadParameter(f'invalid size "{size}", use e.g. 500KB, 10MB or 1GB')
+    number, unit = match.groups()
+    return int(float(number) * {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}[unit.lower()])
+
+
+class CorpusGenerator:
+    """
+    Generator of synthetic elgold articles. The words, entity targets and classes follow Zipf-like distributions,
+    so the corpus has realistic numbers of unique targets and repeated titles.
+    """
+    def __init__(self, seed: int = 0, vocabulary_size: int = 20000, titles: int = 50000,
+                 entity_ratio: float = 0.08, no_target_ratio: float = 0.1) -> None:
+        self.random = random.Random(seed)
+        with open(os.path.join(ROOT, 'conf', 'ner_classes.json')) as fp:
+            self.classes = json.load(fp)
+        self.words = [self._word() for _ in range(vocabulary_size)]
+        self.titles = [' '.join(self._word().capitalize() for _ in range(self.random.randint(1, 3)))
+                       for _ in range(titles)]
+        # cumulative weights, so random.choices does not sum the weights on every call
+        self.word_weights = list(accumulate(1 / rank for rank in range(1, vocabulary_size + 1)))
+        self.title_weights = list(accumulate(1 / rank for rank in range(1, titles + 1)))
+        self.class_weights = list(accumulate(1 / rank for rank in range(1, len(self.classes) + 1)))
+        self.entity_ratio = entity_ratio
+        self.no_target_ratio = no_target_ratio
+
+    def _word(self) -> str:
+        word = ''.join(self.random.choices(string.ascii_lowercase, k=self.random.randint(2, 10)))
+        if self.random.random() < 0.05:
+            position = self.random.randrange(len(word))
+            word = word[:position] + self.random.choice(NON_ASCII) + word[position + 1:]
+        return word
+
+    def _entity(self) -> str:
+        title = self.random.choices(self.titles, cum_weights=self.title_weights)[0]
+        cls = self.random.choices(self.classes, cum_weights=self.class_weights)[0]
+        target = ''
+        if self.random.random() >= self.no_target_ratio:
+            target = title.replace(' ', '_') if self.random.random() < 0.1 else title  # some non-normalized targets
+        return '{{' + title + '|' + cls + '|' + target + '}}'
+
+    def line(self) -> str:
+        words = self.random.choices(self.words, cum_weights=self.word_weights, k=self.random.randint(5, 60))
+        for i in range(len(words)):
+            if self.random.random() < self.entity_ratio:
+                words[i] = self._entity()
+        line = ' '.join(words)
+        return line[:1].upper() + line[1:] + '.'
+
+    def article(self, size: int) -> str:
+        lines = []
+        length = 0
+        while length < size:
+            line = self.line() if self.random.random() > 0.05 else ''  # empty lines between paragraphs
+            lines.append(line + '\n')
+            length += len(line) + 1
+        return ''.join(lines)
+
+    def generate(self, target: str, size: int, article_size: int) -> int:
+        """
+        Write articles of about article_size characters to the target directory until the total size is reached.
+        Returns the number of generated files.
+        """
+        serials = {}
+        total = 0
+        files = 0
+        while total < size:
+            category = self.random.choice(CATEGORIES) + self.random.choice(SUBCATEGORIES)
+            serials[category] = serials.get(category, 0) + 1
+            article = self.article(int(self.random.uniform(0.2, 1.8) * article_size))
+            with open(os.path.join(target, f'{category}_{serials[category]}.txt'), 'w') as fp:
+                fp.write(article)
+            total += len(article.encode('utf-8'))
+            files += 1
+        return files
+
+
+@click.command()
+@click.option('--size', default='10MB', help='Total size of the corpus, e.g. 500KB, 10MB or 1GB.')
+@click.option('--article-size', default='4KB', help='Average size of a single article.')
+@click.option('--seed', type=int, default=0, help='Seed of the random generator.')
+@click.argument('target', type=click.Path(exists=False, file_okay=False), default='bench_data')
+def generate(size, article_size, seed, target):
+    """
+    Generate a synthetic elgold corpus in the target directory. The files follow the <category>_<serial>.txt layout
+    of the elgold dataset and contain {{text|CLASS|target}} annotations. The same seed always generates the same
+    corpus.
+    """
+    if not os.path.exists(target):
+        os.makedirs(target)
+    if os.listdir(target):
+        raise click.ClickException('target directory not empty')
+    files = CorpusGenerator(seed).generate(target, parse_size(size), parse_size(article_size))
+    print(f'generated {files} files')
+
+
+if __name__ == '__main__':
+    generate()
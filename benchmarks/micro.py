@@ -0,0 +1,108 @@
+import json
+import os
+import re
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.dataset import Dataset  # noqa: E402
+from utils.tokenizer import Span, parse_line as tokenizer_parse_line  # noqa: E402
+
+
+def _consume_files(dataset: Dataset) -> None:
+    for parsed_file in dataset.iterate_files():
+        for _ in parsed_file.iterate_lines():
+            pass
+
+
+def legacy_parse_line(line: str) -> tuple[str, tuple[Span, ...]]:
+    """
+    The re.split based Dataset.parse_line replaced by utils.tokenizer, kept as the baseline of the tokenizer.
+    """
+    split = re.split(r'({{[^{}]*}})', line)
+    spans = []
+    plain_text = ''
+    for i, raw_token in enumerate(split):
+        if i % 2 == 0:  # text
+            plain_text += raw_token
+        else:  # entity
+            text, cls, target = raw_token.lstrip('{').rstrip('}').split('|')
+            spans.append(Span(len(plain_text), len(plain_text) + len(text), sys.intern(cls), sys.intern(target)))
+            plain_text += text
+    return plain_text, tuple(spans)
+
+
+def _read_lines(data: str) -> list[str]:
+    lines = []
+    for f in Dataset(data, cache=False).files:
+        with open(os.path.join(data, f)) as fp:
+            lines.extend(line.rstrip('\n') for line in fp)
+    return lines
+
+
+def parse_line(data: str) -> float:
+    lines = _read_lines(data)
+    start = time.perf_counter()
+    for line in lines:
+        tokenizer_parse_line(line)
+    return time.perf_counter() - start
+
+
+def parse_line_legacy(data: str) -> float:
+    lines = _read_lines(data)
+    start = time.perf_counter()
+    for line in lines:
+        legacy_parse_line(line)
+    return time.perf_counter() - start
+
+
+def iterate_files_cold(data: str) -> float:
+    dataset = Dataset(data, cache=False)
+    start = time.perf_counter()
+    _consume_files(dataset)
+    return time.perf_counter() - start
+
+
+def iterate_files_warm(data: str) -> float:
+    dataset = Dataset(data)
+    _consume_files(dataset)  # fill the corpus cache
+    start = time.perf_counter()
+    _consume_files(dataset)
+    return time.perf_counter() - start
+
+
+def iterate_lines(data: str) -> float:
+    dataset = Dataset(data)
+    start = time.perf_counter()
+    for line in dataset.iterate_lines():
+        for _ in line.entities:
+            pass
+    return time.perf_counter() - start
+
+
+BENCHMARKS = {
+    'parse_line': parse_line,
+    'parse_line-legacy': parse_line_legacy,
+    'iterate_files-cold': iterate_files_cold,
+    'iterate_files-warm': iterate_files_warm,
+    'iterate_lines': iterate_lines,
+}
+
+
+@click.command()
+@click.option('--data', type=click.Path(exists=True, file_okay=False), default='bench_data',
+              help='Path to the elgold dataset.')
+@click.argument('name', type=click.Choice(list(BENCHMARKS)))
+def micro(data, name):
+    """
+    Run a single micro benchmark of the dataset module and print its time in seconds as JSON. Only the measured part
+    of the benchmark is timed, the setup (e.g. reading the lines for parse_line) is not.
+    """
+    print(json.dumps({'seconds': BENCHMARKS[name](data)}))
+
+
+if __name__ == '__main__':
+    micro()
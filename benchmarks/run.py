@@ -0,0 +1,229 @@
+import fnmatch
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import click
+
+from stub_wikipedia import StubWikipedia, write_dumps
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MICRO = os.path.join(ROOT, 'benchmarks', 'micro.py')
+
+# Benchmark name -> command line. The placeholders are replaced with: {data} - the dataset directory, {out} - a fresh
+# non-existent output path, {cache} - a fresh Wikipedia cache directory, {api} - the URI of the Wikipedia stub,
+# {dumps} - the directory with the page and redirect dumps of the stub, {index} - the title index built from the dumps,
+# {zip} and {tar} - the dataset in a .zip and a .tar.gz archive and {jobs} - the number of worker processes.
+BENCHMARKS = {
+    'startup/elgold': ['main.py', '--help'],
+    'startup/manage': ['main.py', 'manage', '--help'],
+    'startup/convert': ['main.py', 'convert', '--help'],
+    'startup/plot-histogram': ['main.py', 'plot', 'histogram', '--help'],
+    'micro/parse_line': [MICRO, '--data', '{data}', 'parse_line'],
+    'micro/parse_line-legacy': [MICRO, '--data', '{data}', 'parse_line-legacy'],
+    'micro/iterate_files-cold': [MICRO, '--data', '{data}', 'iterate_files-cold'],
+    'micro/iterate_files-warm': [MICRO, '--data', '{data}', 'iterate_files-warm'],
+    'micro/iterate_lines': [MICRO, '--data', '{data}', 'iterate_lines'],
+    'elgold/search-class': ['elgold.py', 'search', '--data', '{data}', '--class', 'PERSON'],
+    'elgold/search-target': ['elgold.py', 'search', '--data', '{data}', '--target', 'an'],
+    'elgold/search-no-index': ['elgold.py', 'search', '--data', '{data}', '--class', 'PERSON', '--no-index'],
+    'elgold/search-chars': ['elgold.py', 'search-chars', '--data', '{data}', 'ąę'],
+    'elgold/list-entities': ['elgold.py', 'list-entities', '--data', '{data}'],
+    'elgold/text-stat': ['elgold.py', 'text-stat', '--data', '{data}', '--jobs', '{jobs}'],
+    'elgold/text-stat-zip': ['elgold.py', 'text-stat', '--data', '{zip}', '--jobs', '{jobs}'],
+    'elgold/text-stat-tar': ['elgold.py', 'text-stat', '--data', '{tar}', '--jobs', '{jobs}'],
+    'elgold/filter': ['elgold.py', 'filter', '--data', '{data}', '--exclude', 'PERSON', '--jobs', '{jobs}', '{out}'],
+    'elgold/filter-zip': ['elgold.py', 'filter', '--data', '{data}', '--exclude', 'PERSON', '--jobs', '{jobs}',
+                          '{out}.zip'],
+    'elgold/replace-chars': ['elgold.py', 'replace-chars', '--data', '{data}', '--jobs', '{jobs}', 'ąę', 'ae',
+                             '{out}'],
+    'elgold/fix-targets': ['elgold.py', 'fix-targets', '--data', '{data}', '--remove-non-existent', '--normalize',
+                           '--redirect', '--cache-dir', '{cache}', '--wikipedia-api', '{api}', '{out}'],
+    'elgold/fix-targets-dump': ['elgold.py', 'fix-targets', '--data', '{data}', '--remove-non-existent', '--normalize',
+                                '--redirect', '--wiki-index', '{index}', '{out}'],
+    'elgold/wiki-index': ['elgold.py', 'wiki-index', '--page', '{dumps}/page.sql.gz', '--redirect',
+                          '{dumps}/redirect.sql.gz', '{out}'],
+    'elgold/rewrite': ['elgold.py', 'rewrite', '--data', '{data}', '--exclude', 'PERSON', '--replace', 'ąę', 'ae',
+                       '--normalize-targets', '--cache-dir', '{cache}', '--wikipedia-api', '{api}', '--jobs',
+                       '{jobs}', '{out}'],
+    'convert/spacy': ['convert.py', 'spacy', '--data', '{data}', '--jobs', '{jobs}', '{out}'],
+    'convert/blink': ['convert.py', 'blink', '--data', '{data}', '--cache-dir', '{cache}', '--wikipedia-api', '{api}',
+                      '--jobs', '{jobs}', '{out}'],
+    'convert/blink-dump': ['convert.py', 'blink', '--data', '{data}', '--wiki-index', '{index}', '--jobs', '{jobs}',
+                           '{out}'],
+    'convert/table': ['convert.py', 'table', '--data', '{data}', '--jobs', '{jobs}', '{out}.npz'],
+    'plot/histogram': ['plot.py', 'histogram', '--data', '{data}', '--jobs', '{jobs}', '--variant', 'absolute',
+                       '--variant', 'percentage', '--output', '{out}.png'],
+}
+
+
+def run_command(argv: list[str], tmp_dir: str) -> dict:
+    """
+    Run the command in a child process and measure its wall time and peak resident memory. If the command prints
+    a JSON object with "seconds" as the last line (the micro benchmarks), it is used instead of the wall time.
+    """
+    env = dict(os.environ, MPLBACKEND='Agg')  # no plot windows
+    with open(os.path.join(tmp_dir, 'stdout'), 'w+b') as stdout, open(os.path.join(tmp_dir, 'stderr'), 'w+b') as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen([sys.executable] + argv, cwd=ROOT, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=stdout, stderr=stderr)
+        _, status, rusage = os.wait4(process.pid, 0)  # wait4 instead of wait to get the resource usage of the child
+        seconds = time.perf_counter() - start
+        process.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        stderr.seek(0)
+        if process.returncode != 0:
+            raise click.ClickException(f'{" ".join(argv)} failed:\n{stderr.read().decode(errors="replace")}')
+        lines = stdout.read().decode(errors='replace').strip().splitlines()
+    if lines and lines[-1].startswith('{"seconds"'):
+        seconds = json.loads(lines[-1])['seconds']
+    return {'seconds': seconds, 'max_rss_kb': rusage.ru_maxrss}
+
+
+def corpus_meta(data: str) -> dict:
+    files = [f for f in os.listdir(data) if not f.startswith('.')]
+    return {'files': len(files), 'bytes': sum(os.path.getsize(os.path.join(data, f)) for f in files)}
+
+
+def git_meta() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(['git'] + list(args), cwd=ROOT, capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(git('status', '--porcelain', '--untracked-files=no'))}
+
+
+@click.group()
+def cli():
+    """
+    Run the elgold toolset benchmarks and compare their results. Use run.py [command] --help for detailed
+    information about available commands.
+    """
+    pass
+
+
+@cli.command()
+@click.option('--data', type=click.Path(exists=True, file_okay=False), default='bench_data',
+              help='Path to the benchmark dataset, see generate.py.')
+@click.option('--only', multiple=True, help='Run only the benchmarks matching the pattern, e.g. "elgold/*".')
+@click.option('--repeat', type=click.IntRange(min=1), default=3, help='Number of measured runs of each benchmark.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes passed to the commands that support it.')
+@click.option('--cold/--warm', default=False,
+              help='Remove the corpus cache of the dataset and its archives before each run (cold) or fill it with an '
+                   'unmeasured run first (warm, default).')
+@click.option('--output', type=click.Path(dir_okay=False), default=None,
+              help='JSON file to save the results to. Defaults to results-<commit>.json.')
+def run(data, only, repeat, jobs, cold, output):
+    """
+    Run the benchmarks and save their wall times and peak memory (the best of the repeated runs) to a JSON file.
+    Each run writes to a fresh output directory and a fresh Wikipedia cache; the Wikipedia API is served by a local
+    stub, so the benchmarks do not depend on the network.
+    """
+    data = os.path.abspath(data)
+    cache_dir = data + '.elgold'
+    benchmarks = {name: argv for name, argv in BENCHMARKS.items()
+                  if not only or any(fnmatch.fnmatch(name, pattern) for pattern in only)}
+    meta = {
+        'git': git_meta(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'date': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'corpus': corpus_meta(data),
+        'repeat': repeat,
+        'jobs': jobs,
+        'cold': cold,
+    }
+    results = {}
+    with StubWikipedia() as stub, tempfile.TemporaryDirectory(prefix='elgold-bench-wiki-') as dumps, \
+            tempfile.TemporaryDirectory(prefix='elgold-bench-archives-') as archives:
+        index = os.path.join(dumps, 'wikipedia.idx')
+        if any('{index}' in arg or '{dumps}' in arg for argv in benchmarks.values() for arg in argv):
+            page_dump, redirect_dump = write_dumps(data, dumps)
+            subprocess.run([sys.executable, 'elgold.py', 'wiki-index', '--page', page_dump, '--redirect', redirect_dump,
+                            index], cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        zip_path = os.path.join(archives, 'data.zip')
+        tar_path = os.path.join(archives, 'data.tar.gz')
+        for placeholder, archive in (('{zip}', zip_path), ('{tar}', tar_path)):
+            if any(placeholder in arg for argv in benchmarks.values() for arg in argv):
+                subprocess.run([sys.executable, 'elgold.py', 'filter', '--data', data, archive], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, check=True)  # filter without --exclude copies the dataset
+        for name, argv in benchmarks.items():
+            runs = []
+            for i in range(repeat + (0 if cold else 1)):
+                if cold:
+                    for path in (cache_dir, zip_path + '.elgold', tar_path + '.elgold'):
+                        shutil.rmtree(path, ignore_errors=True)
+                tmp_dir = tempfile.mkdtemp(prefix='elgold-bench-')
+                try:
+                    measured = run_command([arg.format(data=data, out=os.path.join(tmp_dir, 'out'),
+                                                       cache=os.path.join(tmp_dir, 'cache'), api=stub.uri,
+                                                       dumps=dumps, index=index, zip=zip_path, tar=tar_path,
+                                                       jobs=jobs)
+                                            for arg in argv], tmp_dir)
+                finally:
+                    shutil.rmtree(tmp_dir)
+                if cold or i > 0:
+                    runs.append(measured)
+            results[name] = {
+                'seconds': min(r['seconds'] for r in runs),
+                'max_rss_kb': min(r['max_rss_kb'] for r in runs),
+                'runs': [r['seconds'] for r in runs],
+            }
+            print(f'{name:30} {results[name]["seconds"]:10.3f} s {results[name]["max_rss_kb"] / 1024:10.1f} MB')
+
+    if output is None:
+        output = f'results-{(meta["git"]["commit"] or "unknown")[:10]}.json'
+    with open(output, 'w') as fp:
+        json.dump({'meta': meta, 'results': results}, fp, indent=2)
+    print(f'results saved to {output}')
+
+
+@cli.command()
+@click.option('--threshold', type=float, default=0.1,
+              help='Relative slowdown or memory growth reported as a regression.')
+@click.argument('old', type=click.Path(exists=True, dir_okay=False))
+@click.argument('new', type=click.Path(exists=True, dir_okay=False))
+def compare(threshold, old, new):
+    """
+    Compare two results files. The command exits with status 1 if any benchmark regressed by more than
+    the threshold in time or in peak memory.
+    """
+    with open(old) as fp:
+        old_results = json.load(fp)
+    with open(new) as fp:
+        new_results = json.load(fp)
+    for key in ('corpus', 'jobs', 'cold'):
+        if old_results['meta'][key] != new_results['meta'][key]:
+            print(f'warning: the results were measured with different {key} settings', file=sys.stderr)
+
+    regressions = []
+    print(f'{"benchmark":30} {"old [s]":>10} {"new [s]":>10} {"time":>8} {"memory":>8}')
+    for name in old_results['results']:
+        if name not in new_results['results']:
+            continue
+        old_result, new_result = old_results['results'][name], new_results['results'][name]
+        time_ratio = new_result['seconds'] / old_result['seconds']
+        memory_ratio = new_result['max_rss_kb'] / old_result['max_rss_kb']
+        regressed = time_ratio > 1 + threshold or memory_ratio > 1 + threshold
+        if regressed:
+            regressions.append(name)
+        print(f'{name:30} {old_result["seconds"]:10.3f} {new_result["seconds"]:10.3f} {time_ratio:7.2f}x '
+              f'{memory_ratio:7.2f}x' + (' REGRESSION' if regressed else ''))
+
+    if regressions:
+        print(f'{len(regressions)} regressions: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
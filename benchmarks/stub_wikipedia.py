@@ -0,0 +1,193 @@
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.cache import chunks  # noqa: E402
+from utils.dataset import Dataset  # noqa: E402
+
+PAGE_TABLE = '''CREATE TABLE `page` (
+  `page_id` int(8) unsigned NOT NULL AUTO_INCREMENT,
+  `page_namespace` int(11) NOT NULL DEFAULT 0,
+  `page_title` varbinary(255) NOT NULL DEFAULT '',
+  `page_is_redirect` tinyint(1) unsigned NOT NULL DEFAULT 0,
+  `page_is_new` tinyint(1) unsigned NOT NULL DEFAULT 0,
+  `page_random` double unsigned NOT NULL DEFAULT 0,
+  `page_touched` binary(14) NOT NULL,
+  `page_links_updated` varbinary(14) DEFAULT NULL,
+  `page_latest` int(8) unsigned NOT NULL DEFAULT 0,
+  `page_len` int(8) unsigned NOT NULL DEFAULT 0,
+  `page_content_model` varbinary(32) DEFAULT NULL,
+  `page_lang` varbinary(35) DEFAULT NULL,
+  PRIMARY KEY (`page_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+'''
+REDIRECT_TABLE = '''CREATE TABLE `redirect` (
+  `rd_from` int(8) unsigned NOT NULL DEFAULT 0,
+  `rd_namespace` int(11) NOT NULL DEFAULT 0,
+  `rd_title` varbinary(255) NOT NULL DEFAULT '',
+  `rd_interwiki` varbinary(32) DEFAULT NULL,
+  `rd_fragment` varbinary(255) DEFAULT NULL,
+  PRIMARY KEY (`rd_from`)
+) ENGINE=InnoDB DEFAULT CHARSET=binary;
+'''
+
+
+def normalize(title: str) -> str:
+    title = ' '.join(title.replace('_', ' ').split())
+    return title[:1].upper() + title[1:]
+
+
+def page(title: str) -> tuple[bool, str]:
+    """
+    Deterministic stub of the Wikipedia pages: about 10% of the titles do not exist and about 10% of the existing
+    titles redirect to the title without its last word. Returns (exists, redirect).
+    """
+    checksum = zlib.crc32(title.encode('utf-8'))
+    if checksum % 10 == 0:
+        return False, title
+    if checksum % 10 == 1 and ' ' in title:
+        return True, title.rsplit(' ', 1)[0]
+    return True, title
+
+
+def sql_string(value: str) -> str:
+    return "'" + value.replace('\\', '\\\\').replace("'", "\\'") + "'"
+
+
+def write_dump(path: str, table: str, create_table: str, rows: list[tuple]) -> None:
+    with gzip.open(path, 'wt', encoding='utf-8') as fp:
+        fp.write(create_table)
+        for chunk in chunks(rows, 1000):
+            values = ','.join('(' + ','.join(sql_string(value) if isinstance(value, str) else 'NULL' if value is None
+                                             else str(value) for value in row) + ')' for row in chunk)
+            fp.write(f'INSERT INTO `{table}` VALUES {values};\n')
+
+
+def write_dumps(data: str, directory: str) -> tuple[str, str]:
+    """
+    Write the page and redirect table dumps of the stub pages of the dataset targets (see utils.wikipedia_dump), so
+    the targets resolved from the dumps are the same as the targets resolved by the stub API. The pages of
+    the redirect destinations are written too. Returns the paths of the page and redirect dumps.
+    """
+    pages = {}  # title -> redirect or None
+    titles = [normalize(title) for title in Dataset(data, cache=False).get_targets()]
+    while titles:
+        title = titles.pop()
+        if not title or title in pages:
+            continue
+        exists, redirect = page(title)
+        if exists:
+            pages[title] = redirect if redirect != title else None
+            if redirect != title:
+                titles.append(redirect)
+    page_rows = []
+    redirect_rows = []
+    for title, redirect in sorted(pages.items()):
+        page_id = zlib.crc32(title.encode('utf-8'))
+        page_rows.append((page_id, 0, title.replace(' ', '_'), int(redirect is not None), 0, 0.5, '20240101000000',
+                          None, 1, 100, 'wikitext', None))
+        if redirect is not None:
+            redirect_rows.append((page_id, 0, redirect.replace(' ', '_'), '', ''))
+    page_dump = os.path.join(directory, 'page.sql.gz')
+    redirect_dump = os.path.join(directory, 'redirect.sql.gz')
+    write_dump(page_dump, 'page', PAGE_TABLE, page_rows)
+    write_dump(redirect_dump, 'redirect', REDIRECT_TABLE, redirect_rows)
+    return page_dump, redirect_dump
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the MediaWiki API queries used by utils.wikipedia.Wikipedia: the "titles" queries with the optional
+    "redirects" parameter.
+    """
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        params = {key: values[0] for key, values in parse_qs(urlparse(self.path).query).items()}
+        self.server.requests += 1
+        time.sleep(self.server.latency)
+        normalized = []
+        redirects = []
+        pages = {}
+        missing = -1
+        for title in params.get('titles', '').split('|'):
+            final = normalize(title)
+            if final != title:
+                normalized.append({'from': title, 'to': final})
+            exists, redirect = page(final)
+            if 'redirects' in params and redirect != final:
+                redirects.append({'from': final, 'to': redirect})
+                final = redirect
+                exists = page(final)[0]  # a single redirect is followed, the destination may not exist
+            if exists:
+                pages[str(zlib.crc32(final.encode('utf-8')))] = {'title': final}
+            else:
+                pages[str(missing)] = {'title': final, 'missing': ''}
+                missing -= 1
+        query = {'pages': pages}
+        if normalized:
+            query['normalized'] = normalized
+        if redirects:
+            query['redirects'] = redirects
+        body = json.dumps({'batchcomplete': '', 'query': query}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class StubWikipedia:
+    """
+    Local MediaWiki API stub running in a background thread. Use as a context manager and pass uri as the
+    --wikipedia-api option of the commands. Each response is delayed by latency seconds to simulate the network.
+    """
+    def __init__(self, port: int = 0, latency: float = 0) -> None:
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), StubHandler)
+        self.server.daemon_threads = True
+        self.server.requests = 0
+        self.server.latency = latency
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def uri(self) -> str:
+        return f'http://127.0.0.1:{self.server.server_port}/w/api.php'
+
+    @property
+    def requests(self) -> int:
+        return self.server.requests
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@click.command()
+@click.option('--port', type=int, default=8765)
+@click.option('--latency', type=float, default=0, help='Delay of each response in seconds.')
+def serve(port, latency):
+    """
+    Run the Wikipedia API stub in the foreground.
+    """
+    with StubWikipedia(port, latency) as stub:
+        print(f'serving {stub.uri}')
+        stub.thread.join()
+
+
+if __name__ == '__main__':
+    serve()
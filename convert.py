@@ -1,30 +1,99 @@
-import json
 import os
-from collections import defaultdict
+import re
+from bisect import bisect_left, bisect_right
+from functools import partial
 
 import click
 
+from utils.cache import TitleCache
 from utils.dataset import Dataset
-from utils.wikipedia import Wikipedia
+from utils.prefetch import TargetPrefetcher
+from utils.profiling import profile_command, profiler
+from utils.shards import Fragment, files_hash, merge_fragments
+from utils.wikipedia_dump import WikipediaDump
+from utils.writers import CategoryWriters, JsonArrayWriter, JsonLinesWriter
+
+TOKEN_PATTERN = re.compile(r'\S+')
+SHARD_PATTERN = re.compile(r'(\d+)/(\d+)')
 
 
 @click.group()
-def cli():
+@click.option('--stats/--no-stats', default=False,
+              help='Print the wall time of the processing phases, the number of processed files, lines and entities, '
+                   'the Wikipedia requests and the peak memory usage to stderr when the command finishes.')
+@click.option('--stats-json', type=click.Path(dir_okay=False), default=None,
+              help='Save the statistics (see --stats) to a JSON file.')
+@click.option('--profile', type=click.Path(dir_okay=False), default=None,
+              help='Run the command under cProfile and save the pstats dump to the file.')
+@click.pass_context
+def cli(ctx, stats, stats_json, profile):
     """
     Convert the elgold dataset to different formats. Use convert.py [command] --help for detailed information about
     available commands.
     """
-    pass
+    profile_command(ctx, stats, stats_json, profile)
+
+
+def _parse_shard(ctx, param, value):
+    if value is None:
+        return None
+    match = SHARD_PATTERN.fullmatch(value)
+    if match is None or int(match[1]) >= int(match[2]):
+        raise click.BadParameter('expected I/N with 0 <= I < N, e.g. 0/4')
+    return int(match[1]), int(match[2])
+
+
+def _check_target(target, split, shard):
+    """
+    Check the target of the converters. With --split or --shard, the target is a directory, created if it does not
+    exist, which must be empty.
+    """
+    if not split and shard is None:
+        if os.path.exists(target):
+            raise click.ClickException('target file exists')
+        return
+    if not os.path.exists(target):
+        os.makedirs(target)
+    if os.listdir(target):
+        raise click.ClickException('target directory not empty')
+
+
+def _target_writer(target, split, shard, extension, writer_class):
+    """
+    Open the writer of the converter output. With --shard, the output fragment is written to the target directory:
+    the category files with --split or the "0" file with all data otherwise.
+    """
+    if split:
+        return CategoryWriters(target, extension, writer_class)
+    return writer_class(os.path.join(target, f'0{extension}') if shard is not None else target)
+
+
+def _spacy_document(parsed_file):
+    output = {'text': '', 'entities': []}
+    for parsed_line in parsed_file['lines']:
+        for token in parsed_line['tokens']:
+            if token['type'] == 'entity':
+                start = len(output['text'])
+                end = start + len(token['text'])
+                output['entities'].append([start, end, token['class']])
+            output['text'] += token['text']
+        output['text'] += '\n'
+    return output
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--split/--no-split', default=False,
               help='Generate separate data files for each article category. 0 category contains all data.'
                    'If activated, the "target" must be a directory.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.option('--shard', callback=_parse_shard, default=None, metavar='I/N',
+              help='Convert only the I-th of N contiguous parts of the dataset files (0 <= I < N) and save the output '
+                   'fragment to the target directory. Merge the fragments of all shards with convert.py merge.')
 @click.argument('target', nargs=1, type=click.Path(exists=False, file_okay=True), default='spacy.json')
-def spacy(data, split, target):
+def spacy(data, split, jobs, shard, target):
     """
     Prepare dataset for spaCy NER evaluation. This command converts the dataset to a single JSON array. Each array
     element is a single text from the dataset. Each text is represented as a JSON object with keys "text" and
@@ -38,45 +107,108 @@ def spacy(data, split, target):
 
     """
     dataset = Dataset(data)
-    if not split and os.path.exists(target):
-        raise click.ClickException('target file exists')
-    if split and not os.path.exists(target):
-        os.makedirs(target)
-    if split and os.listdir(target):
-        raise click.ClickException('target directory not empty')
+    _check_target(target, split, shard)
+    if shard is not None:
+        fragment = Fragment(target, 'spacy', split, *shard, files_hash(dataset.files), {})
+        dataset.select_shard(*shard)
 
-    target_data = defaultdict(list)
-    for parsed_file in dataset.iterate_files():
-        output = {'text': '', 'entities': []}
-        for parsed_line in parsed_file['lines']:
-            for token in parsed_line['tokens']:
-                if token['type'] == 'entity':
-                    start = len(output['text'])
-                    end = start + len(token['text'])
-                    output['entities'].append([start, end, token['class']])
-                output['text'] += token['text']
-            output['text'] += '\n'
-        target_data['0'].append(output)
-        target_data[parsed_file['category'][0]].append(output)  # ignore subcategories
+    with _target_writer(target, split, shard, '.json', JsonArrayWriter) as writer:
+        for parsed_file, output in zip(dataset.iterate_files(),
+                                       profiler.iterate('documents', dataset.map_files(_spacy_document, jobs))):
+            with profiler.phase('write'):
+                if split:
+                    writer.write(parsed_file['category'][0], output)  # ignore subcategories
+                else:
+                    writer.write(output)
+    if shard is not None:
+        fragment.records = len(dataset.files)
+        fragment.save()
 
-    if split:
-        for category, files in target_data.items():
-            filepath = os.path.join(target, f'{category}.json')
-            with open(filepath, 'w') as fp:
-                json.dump(files, fp)
-    else:
-        with open(target, 'w') as fp:
-            json.dump(target_data['0'], fp)
+
+def _blink_mentions(page_ids, context_chars, context_tokens, parsed_file):
+    """
+    Return (label, label_id, context_left, mention, context_right) tuples of the linked mentions in the file.
+    The contexts are slices of the document text, optionally truncated to context_chars characters
+    and/or context_tokens whitespace-separated tokens.
+    """
+    with profiler.phase('parse'):
+        lines = []
+        spans = []
+        offset = 0
+        for parsed_line in parsed_file.iterate_lines():
+            for span in parsed_line.spans:
+                if span.target in page_ids:
+                    spans.append((offset + span.start, offset + span.end, span.target))
+            lines.append(parsed_line.plain_text + '\n')
+            offset += len(parsed_line.plain_text) + 1
+        document = ''.join(lines)
+
+    with profiler.phase('contexts'):
+        return _blink_contexts(page_ids, context_chars, context_tokens, document, spans)
+
+
+def _blink_contexts(page_ids, context_chars, context_tokens, document, spans):
+    if context_tokens is not None:
+        token_starts = []
+        token_ends = []
+        for match in TOKEN_PATTERN.finditer(document):
+            token_starts.append(match.start())
+            token_ends.append(match.end())
+
+    mentions = []
+    for start, end, target in spans:
+        left_start = 0
+        right_end = len(document)
+        if context_tokens is not None:
+            preceding_tokens = bisect_left(token_starts, start)
+            if preceding_tokens > context_tokens:
+                left_start = token_starts[preceding_tokens - context_tokens]
+            last_token = bisect_right(token_ends, end) + context_tokens - 1
+            if last_token < len(token_ends):
+                right_end = token_ends[last_token]
+        if context_chars is not None:
+            left_start = max(left_start, start - context_chars)
+            right_end = min(right_end, end + context_chars)
+        mentions.append((target, page_ids[target], document[left_start:start], document[start:end],
+                         document[end:right_end]))
+    return mentions
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--split/--no-split', default=False,
               help='Generate separate data files for each article category. 0 category contains all data.'
                    'If activated, the "target" must be a directory.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default='.cache',
+              help='Directory with the persistent cache of Wikipedia titles.')
+@click.option('--cache-ttl', type=float, default=30,
+              help='Number of days after which the cached Wikipedia titles expire.')
+@click.option('--offline/--online', default=False,
+              help='Resolve Wikipedia targets only from the cache, without accessing the network.')
+@click.option('--wikipedia-api', default=None,
+              help='URL of the MediaWiki API used to resolve the targets. Defaults to the English Wikipedia.')
+@click.option('--wiki-index', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Title index built by elgold.py wiki-index. If set, the targets are resolved offline from the index '
+                   'instead of the Wikipedia API and its cache.')
+@click.option('--prefetch', type=click.IntRange(min=0), default=256,
+              help='Maximum number of files read ahead to resolve their targets by the Wikipedia API while the '
+                   'previous files are processed. 0 resolves all targets before processing the dataset, as do '
+                   '--jobs above 1, --wiki-index and --offline.')
+@click.option('--context-chars', type=click.IntRange(min=0), default=None,
+              help='Maximum number of characters in the left and the right context. By default, the contexts contain '
+                   'the entire text.')
+@click.option('--context-tokens', type=click.IntRange(min=1), default=None,
+              help='Maximum number of whitespace-separated tokens in the left and the right context. By default, '
+                   'the contexts contain the entire text.')
+@click.option('--shard', callback=_parse_shard, default=None, metavar='I/N',
+              help='Convert only the I-th of N contiguous parts of the dataset files (0 <= I < N) and save the output '
+                   'fragment to the target directory. Merge the fragments of all shards with convert.py merge.')
 @click.argument('target', nargs=1, type=click.Path(exists=False, file_okay=True), default='blink.jsonl')
-def blink(data, split, target):
+def blink(data, split, jobs, cache_dir, cache_ttl, offline, wikipedia_api, wiki_index, prefetch, context_chars,
+          context_tokens, shard, target):
     """
     Prepare dataset for BLINK evaluation. This command converts the dataset to a jsonl format. Each line represents
     a single entity from the dataset. Each entity is represented by JSON object with the following fields:
@@ -90,58 +222,125 @@ def blink(data, split, target):
     This format drops the information about entity type and mentions without links to Wikipedia.
 
     This format was intended to be used for evaluating the elgold dataset with BLINK.
+
+    With --shard, the ids of each fragment start from 0 and convert.py merge shifts them, so the merged output is
+    the same as the output of a single run if the shards resolve the targets to the same page ids (e.g. with
+    --wiki-index or a shared cache).
     """
+    from utils.wikipedia import OfflineError, Wikipedia  # imports requests
+
     dataset = Dataset(data)
-    if not split and os.path.exists(target):
-        raise click.ClickException('target file exists')
-    if split and not os.path.exists(target):
-        os.makedirs(target)
-    if split and os.listdir(target):
-        raise click.ClickException('target directory not empty')
+    _check_target(target, split, shard)
+    if shard is not None:
+        fragment = Fragment(target, 'blink', split, *shard, files_hash(dataset.files),
+                            {'context_chars': context_chars, 'context_tokens': context_tokens})
+        dataset.select_shard(*shard)
+
+    if wiki_index is not None:
+        wikipedia = WikipediaDump(wiki_index)
+    else:
+        title_cache = TitleCache(cache_dir, ttl=cache_ttl * 24 * 3600, uri=wikipedia_api)
+        wikipedia = Wikipedia(cache=title_cache, offline=offline, uri=wikipedia_api)
+    files = None
+    if prefetch > 0 and wiki_index is None and not offline and jobs == 1:
+        # The workers of --jobs receive a copy of page_ids, so they need all the targets resolved upfront
+        prefetcher = TargetPrefetcher(wikipedia.get_ids, prefetch, wikipedia.max_workers, wikipedia.MAX_TITLES)
+        page_ids = prefetcher.resolved  # filled with the targets of each file before its mentions are collected
+        files = prefetcher.iterate(dataset.iterate_files())
+    else:
+        with profiler.phase('collect targets'):
+            targets = dataset.get_targets()
+        try:
+            with profiler.phase('wikipedia'):
+                page_ids = wikipedia.get_ids(targets)  # resolve all unique targets at once
+        except OfflineError as e:
+            raise click.ClickException(str(e))
 
-    wikipedia = Wikipedia()
-    records = defaultdict(list)
     id = 0
-    for parsed_file in dataset.iterate_files():
-        print(f'processing ' + parsed_file['file'])
-        targets = {entity['target'] for entity in parsed_file['entities'] if
-                   entity['target']}  # get only non-empty targes
-        page_ids = wikipedia.get_ids(targets)
-
-        left_context = []
-        right_context = []
-        for parsed_line in parsed_file['lines']:
-            right_context.extend(parsed_line['tokens'])
-            right_context.append({'type': 'text', 'text': '\n'})
-
-        while len(right_context) > 0:
-            token = right_context.pop(0)
-            if token['type'] == 'entity' and token['target'] in page_ids:
-                record = {
-                    'id': id,
-                    'label': token['target'],
-                    'label_id': page_ids[token['target']],
-                    'context_left': ''.join([token['text'] for token in left_context]),
-                    'mention': token['text'],
-                    'context_right': ''.join([token['text'] for token in right_context])
-                }
-                records['0'].append(record)
-                records[parsed_file['category'][0]].append(record)  # ignore subcategories
-                id += 1
-            left_context.append(token)
+    mentions_func = partial(_blink_mentions, page_ids, context_chars, context_tokens)
+    with _target_writer(target, split, shard, '.jsonl', JsonLinesWriter) as writer:
+        for parsed_file, mentions in zip(dataset.iterate_files(),
+                                         profiler.iterate('mentions', dataset.map_files(mentions_func, jobs, files))):
+            print(f'processing ' + parsed_file['file'])
+            with profiler.phase('write'):
+                for label, label_id, context_left, mention, context_right in mentions:
+                    record = {
+                        'id': id,
+                        'label': label,
+                        'label_id': label_id,
+                        'context_left': context_left,
+                        'mention': mention,
+                        'context_right': context_right
+                    }
+                    if split:
+                        writer.write(parsed_file['category'][0], record)  # ignore subcategories
+                    else:
+                        writer.write(record)
+                    id += 1
+    if shard is not None:
+        fragment.records = id
+        fragment.save()
 
-    if split:
-        for category, category_records in records.items():
-            filepath = os.path.join(target, f'{category}.jsonl')
-            with open(filepath, 'w') as fp:
-                for record in category_records:
-                    json.dump(record, fp)
-                    fp.write('\n')
-    else:
-        with open(target, 'w') as fp:
-            for record in records['0']:
-                json.dump(record, fp)
-                fp.write('\n')
+
+@cli.command()
+@click.argument('fragments', nargs=-1, required=True, type=click.Path(exists=True, file_okay=False))
+@click.argument('target', nargs=1, type=click.Path(exists=False))
+def merge(fragments, target):
+    """
+    Merge the output fragments of the spacy or blink command run with --shard I/N into the output of a single run.
+    The fragments of all N shards must be given, in any order. The target is a file or, if the fragments were created
+    with --split, a directory.
+
+    Example: python convert.py merge blink-0 blink-1 blink-2 blink.jsonl
+    """
+    try:
+        fragments = [Fragment.load(path) for path in fragments]
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    _check_target(target, fragments[0].split, None)
+    try:
+        with profiler.phase('merge'):
+            merge_fragments(fragments, target)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+
+@cli.command()
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.argument('target', nargs=1, type=click.Path(exists=False, dir_okay=False), required=False)
+def table(data, jobs, target):
+    """
+    Convert the dataset to a columnar table of entities for analytics. Each row of the table is a single entity with
+    the following columns:
+    'file', 'category': the dataset file and its category.
+    'line': the line number.
+    'start', 'end': the offsets of the mention in the plain text of the line.
+    'class', 'target': the entity class and the Wikipedia target.
+    'has_target': whether the entity has a target.
+    'tokens': the number of whitespace-separated tokens of the mention.
+
+    The file, category, class and target columns are dictionary encoded. The table additionally stores the number of
+    lines and tokens of each dataset file. The table is saved in Parquet if the target ends with .parquet (requires
+    pyarrow) or in the NumPy .npz format otherwise. The table can be used by the --table option of the text-stat and
+    histogram commands instead of parsing the dataset.
+
+    The default target is entities.parquet if pyarrow is installed or entities.npz otherwise.
+    """
+    from utils.table import DEFAULT_EXTENSION, EntityTable  # imports NumPy and pyarrow
+
+    if target is None:
+        target = 'entities' + DEFAULT_EXTENSION
+    dataset = Dataset(data)
+    if os.path.exists(target):
+        raise click.ClickException('target file exists')
+    entity_table = EntityTable.from_dataset(dataset, jobs)
+    try:
+        entity_table.save(target)
+    except RuntimeError as e:  # no pyarrow
+        raise click.ClickException(str(e))
 
 
 if __name__ == '__main__':
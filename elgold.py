@@ -1,11 +1,23 @@
 import os
+import re
+import sys
 from collections import Counter
-from statistics import mean, stdev
+from functools import partial
 
 import click
 
+from utils.cache import TitleCache
+from utils.client import ServerError, connect, query
 from utils.dataset import Dataset
-from utils.wikipedia import Wikipedia
+from utils.manifest import Manifest, hash_stream
+from utils.prefetch import TargetPrefetcher
+from utils.profiling import profile_command, profiler
+from utils.search_index import SearchIndex
+from utils.tokenizer import validate_line
+from utils.transforms import FilterClasses, FixTargets, ReplaceChars, rewrite_line
+from utils.wikipedia_dump import WikipediaDump
+
+NON_ASCII_PATTERN = re.compile(r'[^\x00-\x7f]')
 
 
 class Colors:
@@ -21,92 +33,247 @@ class Colors:
 
 
 @click.group()
-def cli():
+@click.option('--stats/--no-stats', default=False,
+              help='Print the wall time of the processing phases, the number of processed files, lines and entities, '
+                   'the Wikipedia requests and the peak memory usage to stderr when the command finishes.')
+@click.option('--stats-json', type=click.Path(dir_okay=False), default=None,
+              help='Save the statistics (see --stats) to a JSON file.')
+@click.option('--profile', type=click.Path(dir_okay=False), default=None,
+              help='Run the command under cProfile and save the pstats dump to the file.')
+@click.pass_context
+def cli(ctx, stats, stats_json, profile):
     """
     Manage the elgold dataset. Use elgold.py [command] --help for detailed information about
     available commands.
     """
-    pass
+    profile_command(ctx, stats, stats_json, profile)
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--class', 'search_classes', multiple=True, help='Entity classes we want to search for.')
 @click.option('--target', 'search_targets', multiple=True, help='Target links we want to search for.')
-def search(data, search_classes, search_targets):
+@click.option('--index/--no-index', default=True,
+              help='Use the persistent inverted index of entity classes and targets to find the matching lines.')
+@click.option('--server/--no-server', default=True,
+              help='Send the query to the elgold.py serve daemon of the dataset if it is running.')
+def search(data, search_classes, search_targets, index, server):
     """
     Search for selected entity classes and target links in the dataset. The command returns the lines from the dataset
     that contains required entities with file names and line numbers.
+
+    The index is stored next to the dataset and updated automatically for the modified files.
     """
-    dataset = Dataset(data)
-    for parsed_file in dataset.iterate_files():
-        for line in parsed_file['lines']:
-            entities = line['entities']
-            if len(search_classes) > 0:  # check if line contains specified classes if defined
-                entities = [entity for entity in entities if entity['class'] in search_classes]
-            if len(search_targets) > 0:
-                entities = [entity for entity in entities if any([t in entity['target'] for t in search_targets])]
-
-            if any(entities):
-                file = line['file']
-                line_nb = line['nb']
-                print(f'{Colors.MAGENTA}{file}{Colors.ENDC}:{Colors.BLUE}{line_nb}{Colors.ENDC}', end=':')
-                for token in line['tokens']:
-                    if token['type'] == 'entity':
-                        target = token['target']
-                        for t in search_targets:
-                            pos = target.find(t)
-                            if pos != -1:
-                                target = f'{target[:pos]}{Colors.RED}{target[pos:pos+len(t)]}{Colors.ENDC}{target[pos+len(t):]}'
-                                break  # highlight only the first occurrence for simpler code logic
-                        output = '{{' + token['text'] + '|' + token['class'] + '|' + target + '}}'
-                        if token['class'] in search_classes:
-                            output = f'{Colors.BOLD}{output}{Colors.ENDC}'
-                        print(output, end='')
-                    else:
-                        print(token['text'], end='')
-                print()
+    output = _query_server(data, server, 'search', search_classes=search_classes, search_targets=search_targets,
+                           index=index)
+    if output is None:
+        dataset = Dataset(data)
+        search_index = None
+        if index:
+            with profiler.phase('index'):
+                search_index = SearchIndex(dataset)
+        output = _search_output(dataset, search_index, search_classes, search_targets)
+    _print_output(output)
+
+
+def _search_output(dataset, search_index, search_classes, search_targets):
+    """
+    Yield the output lines of the search command. Without the search_index, all lines of the dataset are checked.
+    """
+    if search_index is not None:
+        lines = search_index.iterate_lines(search_classes, search_targets)
+    else:
+        lines = dataset.iterate_lines()
+    for line in profiler.iterate('read lines', lines):
+        entities = line['entities']
+        if len(search_classes) > 0:  # check if line contains specified classes if defined
+            entities = [entity for entity in entities if entity['class'] in search_classes]
+        if len(search_targets) > 0:
+            entities = [entity for entity in entities if any([t in entity['target'] for t in search_targets])]
+
+        if any(entities):
+            file = line['file']
+            line_nb = line['nb']
+            output_line = [f'{Colors.MAGENTA}{file}{Colors.ENDC}:{Colors.BLUE}{line_nb}{Colors.ENDC}:']
+            for token in line['tokens']:
+                if token['type'] == 'entity':
+                    target = token['target']
+                    for t in search_targets:
+                        pos = target.find(t)
+                        if pos != -1:
+                            target = f'{target[:pos]}{Colors.RED}{target[pos:pos+len(t)]}{Colors.ENDC}{target[pos+len(t):]}'
+                            break  # highlight only the first occurrence for simpler code logic
+                    output = '{{' + token['text'] + '|' + token['class'] + '|' + target + '}}'
+                    if token['class'] in search_classes:
+                        output = f'{Colors.BOLD}{output}{Colors.ENDC}'
+                    output_line.append(output)
+                else:
+                    output_line.append(token['text'])
+            yield ''.join(output_line)
+
+
+def _query_server(data, server, command, **args):
+    """
+    Send the command to the elgold.py serve daemon of the dataset. Returns the iterator over the output lines or None
+    if the server is disabled or not running.
+    """
+    if not server:
+        return None
+    sock = connect(data)
+    if sock is None:
+        return None
+    profiler.count(server_queries=1)
+    return profiler.iterate('server', query(sock, command, args))
+
+
+def _print_output(output):
+    try:
+        for line in output:
+            print(line)
+    except ServerError as e:
+        raise click.ClickException(f'server: {e}')
+
+
+def _check_output(data, out, incremental):
+    """
+    Check the output of the commands rewriting the dataset. The output is a directory, created if it does not exist,
+    or a new .zip, .tar.gz or .tar.zst archive.
+    """
+    from utils.archive import is_archive
+
+    if is_archive(out):
+        if incremental:
+            raise click.ClickException('incremental output must be a directory')
+        if os.path.exists(out):
+            raise click.ClickException('output archive exists')
+        return
+    if not os.path.exists(out):
+        os.makedirs(out)
+    if os.listdir(out) and not incremental:
+        raise click.ClickException('output directory not empty')
+    if incremental and os.path.samefile(data, out):
+        raise click.ClickException('output directory must differ from the dataset directory')
+
+
+def _rewrite_file(transforms, out, verbose, manifest, parsed_file):
+    """
+    Apply the transforms to the dataset file and save it in the output directory. Returns the statistics collected
+    by each transform for this file. In the incremental mode (with the manifest), the file is skipped if its output
+    is up to date and the lookups of the transforms did not change, and the manifest entry of the file is returned.
+    If out is None, the output is returned with the statistics, so the main process can write it to the output
+    archive.
+    """
+    if manifest is not None:
+        with parsed_file.open('rb') as fp:
+            input_hash = hash_stream(fp)
+        entry = manifest.get_current(parsed_file['file'], input_hash)
+        if entry is not None and len(entry.get('lookups', ())) == len(transforms) and \
+                all(transform.current(lookups) for transform, lookups in zip(transforms, entry['lookups'])):
+            return entry
+    if verbose:
+        print(f'processing ' + parsed_file['file'])
+    for transform in transforms:
+        transform.stats = Counter()
+        transform.lookups = {}
+    output = [rewrite_line(parsed_line, transforms) + '\n' for parsed_line in parsed_file.iterate_lines()]
+    stats = [transform.stats for transform in transforms]
+    if manifest is not None:
+        lookups = [transform.lookups for transform in transforms]
+        return manifest.write(parsed_file['file'], input_hash, output, stats, lookups)
+    if out is None:
+        return {'stats': stats, 'output': ''.join(output)}
+    with open(os.path.join(out, parsed_file['file']), 'w') as fp:
+        fp.writelines(output)
+    return {'stats': stats}
+
+
+def _rewrite_dataset(dataset, transforms, out, jobs=1, verbose=False, incremental=False, files=None):
+    """
+    Apply the transforms to all dataset files in a single pass and return the merged statistics of each transform.
+    In the incremental mode, only the files whose contents or transform options changed since the last run
+    are processed. The files can be passed explicitly, e.g. from TargetPrefetcher. If out is an archive, the files
+    are written to the archive in the order of the dataset.
+    """
+    from utils.archive import ArchiveWriter, is_archive  # imports zipfile, tarfile and zstandard
+
+    manifest = Manifest(out, [transform.options() for transform in transforms]) if incremental else None
+    archive = ArchiveWriter(out) if is_archive(out) else None
+    stats = [Counter() for _ in transforms]
+    rewrite_func = partial(_rewrite_file, transforms, out if archive is None else None, verbose, manifest)
+    entries = profiler.iterate('rewrite', dataset.map_files(rewrite_func, jobs, files))
+    try:
+        for parsed_file, entry in zip(dataset.iterate_files(), entries):
+            for transform_stats, transform_file_stats in zip(stats, entry['stats']):
+                transform_stats.update(transform_file_stats)
+            if manifest is not None:
+                manifest.files[parsed_file['file']] = entry
+            if archive is not None:
+                archive.write(parsed_file['file'], entry['output'])
+    except BaseException:
+        if archive is not None:
+            archive.discard()
+        raise
+    if archive is not None:
+        archive.close()
+    if manifest is not None:
+        manifest.remove_stale(dataset.files)
+        manifest.save()
+    return stats
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--exclude', multiple=True, help='Entity classes we want to exclude from the dataset.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.option('--incremental/--no-incremental', default=False,
+              help='Update the existing output: process only the files whose contents or the command options changed '
+                   'since the last run.')
 @click.argument('target', type=click.Path(exists=False, file_okay=False), default='out')
-def filter(data, exclude, target):
+def filter(data, exclude, jobs, incremental, target):
     """
     Filter out entities with the specified classes. The selected entities are replaced with their "mention texts".
-    The command creates a copy of the dataset and saves it to the target directory. The original dataset is not
-    touched.
+    The command creates a copy of the dataset and saves it to the target directory or archive (.zip, .tar.gz or
+    .tar.zst). The original dataset is not touched.
     """
     dataset = Dataset(data)
-    if not os.path.exists(target):
-        os.makedirs(target)
-    if os.listdir(target):
-        raise click.ClickException('output directory not empty')
+    _check_output(data, target, incremental)
 
-    for parsed_file in dataset.iterate_files():
-        output = []
-        for parsed_line in parsed_file['lines']:
-            output_line = ''
-            for token in parsed_line['tokens']:
-                if token['type'] == 'entity' and token['class'] not in exclude:
-                    output_line += token['raw']
-                else:
-                    output_line += token['text']
-            output.append(output_line + '\n')
-        with open(os.path.join(target, parsed_file['file']), 'w') as fp:
-            fp.writelines(output)
+    _rewrite_dataset(dataset, [FilterClasses(exclude)], target, jobs, incremental=incremental)
+
+
+class HighlightTable(dict):
+    """
+    str.translate table that highlights non-ASCII characters. The searched characters are additionally marked red.
+    The table entries are created on the first use of each character.
+    """
+    def __init__(self, chars: set) -> None:
+        super().__init__()
+        self.chars = chars
+
+    def __missing__(self, code: int) -> str:
+        ch = chr(code)
+        if code <= 127:  # ascii char
+            highlighted = ch
+        elif ch in self.chars:  # this is a char we are searching for
+            highlighted = f'{Colors.BOLD}{Colors.RED}{ch}{Colors.ENDC}'
+        else:
+            highlighted = f'{Colors.BOLD}{ch}{Colors.ENDC}'
+        self[code] = highlighted
+        return highlighted
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--exclude-targets/--include-targets', default=True,
               help='Exclude entity targets from searching for non-ASCII chars.')
+@click.option('--report-only/--no-report-only', default=False,
+              help='Print only the list of non-ASCII characters in the dataset, without the matching lines.')
 @click.argument('chars')  # Chars we want to search for
-def search_chars(data, exclude_targets, chars):
+def search_chars(data, exclude_targets, report_only, chars):
     """
     Search for non-ASCII characters in the dataset. The command returns the lines from the dataset
     that contain specified characters with file names and line numbers. At the end command always returns the list
@@ -118,65 +285,62 @@ def search_chars(data, exclude_targets, chars):
     """
     dataset = Dataset(data)
     chars = set(chars)
+    highlight = HighlightTable(chars)
     non_ascii = Counter()
-    for parsed_file in dataset.iterate_files():
-        for parsed_line in parsed_file['lines']:
-            file = parsed_line['file']
-            line_nb = parsed_line['nb']
-            output = f'{Colors.MAGENTA}{file}{Colors.ENDC}:{Colors.BLUE}{line_nb}{Colors.ENDC}:'
-            non_ascii_in_line = set()
-
-            def highlight(text):
-                output = ''
-                for ch in text:
-                    if 0 <= ord(ch) <= 127:  # ascii char
-                        output += ch
-                    else:
-                        non_ascii[ch] += 1
-                        non_ascii_in_line.add(ch)
-                        if ch in chars:  # this is a char we are searching for
-                            ch = Colors.RED + ch
-                        output += f'{Colors.BOLD}{ch}{Colors.ENDC}'
-                return output
-
-            for token in parsed_line['tokens']:
-                if exclude_targets and token['type'] == 'entity':
-                    output += '{{' + highlight(token['text']) + '|' + token['class'] + '|' + token['target'] + '}}'
-                else:
-                    output += highlight(token['text'])
-            if chars & non_ascii_in_line:  # we have non-ascii chars in line we are looking for
-                print(output)
+    for parsed_line in profiler.iterate('read lines', dataset.iterate_lines()):
+        non_ascii_in_line = NON_ASCII_PATTERN.findall(parsed_line.plain_text)
+        if not exclude_targets:
+            for span in parsed_line.spans:
+                non_ascii_in_line.extend(NON_ASCII_PATTERN.findall(span.target))
+        if not non_ascii_in_line:
+            continue
+        non_ascii.update(non_ascii_in_line)
+        if report_only or chars.isdisjoint(non_ascii_in_line):  # no non-ascii chars in line we are looking for
+            continue
+
+        file = parsed_line['file']
+        line_nb = parsed_line['nb']
+        output = f'{Colors.MAGENTA}{file}{Colors.ENDC}:{Colors.BLUE}{line_nb}{Colors.ENDC}:'
+        for token in parsed_line['tokens']:
+            if token['type'] == 'entity':
+                target = token['target'] if exclude_targets else token['target'].translate(highlight)
+                output += '{{' + token['text'].translate(highlight) + '|' + token['class'] + '|' + target + '}}'
+            else:
+                output += token['text'].translate(highlight)
+        print(output)
     print('Non-ascii chars in dataset:')
     for ch, count in non_ascii.most_common():
         print(f"'{ch}': {count}")
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--exclude-targets/--include-targets', default=True,
               help='Exclude entity targets from the replacements.')
-@click.option('--delete', help='Characters to remove.')
+@click.option('--delete', default='', help='Characters to remove.')
 @click.option('--unicode-escape/--no-unicode-escape', default=False,
               help='Interpret character lists as Python Unicode strings. '
                    'This allows to use of Unicode escape sequences e.g. \\u2002')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.option('--incremental/--no-incremental', default=False,
+              help='Update the existing output: process only the files whose contents or the command options changed '
+                   'since the last run.')
 @click.argument('search')  # chars we want to search for
 @click.argument('replace')  # chars we want to replace
 @click.argument('target', nargs=1, type=click.Path(exists=False, file_okay=False), default='out')
-def replace_chars(data, exclude_targets, delete, unicode_escape, search, replace, target):
+def replace_chars(data, exclude_targets, delete, unicode_escape, jobs, incremental, search, replace, target):
     """
     Replace and/or delete specified characters from the dataset. The search and replace lists must be 1:1 mapping,
     so the first character in the search list is replaced with the first in the replacement list.
-    The command creates a copy of the dataset and saves it to the target directory. The original dataset is not
-    touched.
+    The command creates a copy of the dataset and saves it to the target directory or archive (.zip, .tar.gz or
+    .tar.zst). The original dataset is not touched.
 
     Example: python elgold.py replace-chars --unicode-escape --delete "\\u2002" "\\u2014\\u2212" "--"
     """
     dataset = Dataset(data)
-    if not os.path.exists(target):
-        os.makedirs(target)
-    if os.listdir(target):
-        raise click.ClickException('output directory not empty')
+    _check_output(data, target, incremental)
 
     if unicode_escape:
         delete = bytes(delete, 'ascii').decode('unicode-escape')
@@ -187,33 +351,8 @@ def replace_chars(data, exclude_targets, delete, unicode_escape, search, replace
         raise click.ClickException('no 1:1 search replace mapping')
 
     char_map = dict(zip(search, replace))
-    replacements = Counter()
-
-    def replace(text):
-        output = ''
-        for ch in text:
-            if ch in delete:
-                replacements[ch] += 1
-                continue
-            elif ch in char_map:
-                output += char_map[ch]
-                replacements[ch] += 1
-            else:
-                output += ch
-        return output
-
-    for parsed_file in dataset.iterate_files():
-        output = []
-        for parsed_line in parsed_file['lines']:
-            output_line = ''
-            for token in parsed_line['tokens']:
-                if exclude_targets and token['type'] == 'entity':
-                    output_line += '{{' + replace(token['text']) + '|' + token['class'] + '|' + token['target'] + '}}'
-                else:
-                    output_line += replace(token['text'])
-            output.append(output_line + '\n')
-        with open(os.path.join(target, parsed_file['file']), 'w') as fp:
-            fp.writelines(output)
+    replacements, = _rewrite_dataset(dataset, [ReplaceChars(search, replace, delete, exclude_targets)], target, jobs,
+                                     incremental=incremental)
 
     print("replaced:")
     for search, replace in char_map.items():
@@ -225,8 +364,8 @@ def replace_chars(data, exclude_targets, delete, unicode_escape, search, replace
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--remove-non-existent/--keep-non-existent', default=False,
               help='Remove links to non-existing Wikipedia pages.')
 @click.option('--normalize/--no-normalize', default=False,
@@ -235,8 +374,27 @@ def replace_chars(data, exclude_targets, delete, unicode_escape, search, replace
               help='Replace Wikipedia targets that point to redirect pages with their destinations.')
 @click.option('--interactive/--no-interactive', default=False,
               help='Ask each time before performing target replacements.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default='.cache',
+              help='Directory with the persistent cache of Wikipedia titles.')
+@click.option('--cache-ttl', type=float, default=30,
+              help='Number of days after which the cached Wikipedia titles expire.')
+@click.option('--offline/--online', default=False,
+              help='Resolve Wikipedia targets only from the cache, without accessing the network.')
+@click.option('--wikipedia-api', default=None,
+              help='URL of the MediaWiki API used to resolve the targets. Defaults to the English Wikipedia.')
+@click.option('--wiki-index', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Title index built by elgold.py wiki-index. If set, the targets are resolved offline from the index '
+                   'instead of the Wikipedia API and its cache.')
+@click.option('--prefetch', type=click.IntRange(min=0), default=256,
+              help='Maximum number of files read ahead to resolve their targets by the Wikipedia API while the '
+                   'previous files are processed. 0 resolves all targets before processing the dataset, as do '
+                   '--wiki-index and --offline.')
+@click.option('--incremental/--no-incremental', default=False,
+              help='Update the existing output: process only the files whose contents or the command options changed '
+                   'since the last run.')
 @click.argument('out', nargs=1, type=click.Path(exists=False, file_okay=False), default='out')
-def fix_targets(data, remove_non_existent, normalize, redirect, interactive, out):
+def fix_targets(data, remove_non_existent, normalize, redirect, interactive, cache_dir, cache_ttl, offline,
+                wikipedia_api, wiki_index, prefetch, incremental, out):
     """
     Fix technical errors in Wikipedia targets. In the interactive mode, the command asks each time if a possible
     replacement exists. The user can decide whether to accept the decision [Y], not accept [n], or replace the
@@ -246,150 +404,330 @@ def fix_targets(data, remove_non_existent, normalize, redirect, interactive, out
     and does not normalize the new target, which can lead to creating non-normalized targets.
     You should run the command again to normalize the remaining targets.
 
-    The command creates a copy of the dataset and saves it to the target directory. The original dataset is not
-    touched.
+    The command creates a copy of the dataset and saves it to the target directory or archive (.zip, .tar.gz or
+    .tar.zst). The original dataset is not touched.
     """
+    from utils.wikipedia import OfflineError, Wikipedia  # imports requests
+
     dataset = Dataset(data)
-    if not os.path.exists(out):
-        os.makedirs(out)
-    if os.listdir(out):
-        raise click.ClickException('output directory not empty')
+    _check_output(data, out, incremental)
+    if incremental and interactive:
+        raise click.ClickException('the interactive output depends on the answers, it cannot be incremental')
+
+    if wiki_index is not None:
+        wikipedia = WikipediaDump(wiki_index)
+    else:
+        title_cache = TitleCache(cache_dir, ttl=cache_ttl * 24 * 3600, uri=wikipedia_api)
+        wikipedia = Wikipedia(cache=title_cache, offline=offline, uri=wikipedia_api)
+    files = None
+    if prefetch > 0 and wiki_index is None and not offline:
+        prefetcher = TargetPrefetcher(wikipedia.check_targets, prefetch, wikipedia.max_workers, wikipedia.MAX_TITLES)
+        targets = prefetcher.resolved  # filled with the targets of each file before the file is rewritten
+        files = prefetcher.iterate(dataset.iterate_files())
+    else:
+        with profiler.phase('collect targets'):
+            targets = dataset.get_targets()
+        try:
+            with profiler.phase('wikipedia'):
+                targets = wikipedia.check_targets(targets)  # resolve all unique targets at once
+        except OfflineError as e:
+            raise click.ClickException(str(e))
+
+    _rewrite_dataset(dataset, [FixTargets(targets, remove_non_existent, normalize, redirect, interactive)], out,
+                     verbose=True, incremental=incremental, files=files)
 
-    wikipedia = Wikipedia()
-    for parsed_file in dataset.iterate_files():
-        print(f'processing ' + parsed_file['file'])
-        targets = {entity['target'] for entity in parsed_file['entities'] if entity['target']}  # get only non-empty targes
-        targets = wikipedia.check_targets(targets)
-        output = []
-        for parsed_line in parsed_file['lines']:
-            output_line = ''
-            for token in parsed_line['tokens']:
-                if token['type'] == 'entity':
-                    target = token['target']
-                    if target:  # target not empty
-                        if remove_non_existent and not targets[target]['exists']:
-                            if interactive:
-                                while True:
-                                    user_input = input(f'remove non-existing "{target}" [Ynr]: ')
-                                    if user_input.lower() == 'y' or user_input.lower() == '':
-                                        print(f'removing "{target}"')
-                                        target = ''
-                                        break
-                                    elif user_input.lower() == 'n':
-                                        print(f'keeping "{target}"')
-                                        break
-                                    elif user_input.lower() == 'r':
-                                        replacement = input('replace with: ')
-                                        print(f'replacing with "{replacement}"')
-                                        target = replacement
-                                        break
-                            else:
-                                print(f'removing "{target}')
-                                target = ''
-
-                        # If the redirect exists we perform redirect replacement and not normalize.
-                        # In interactive mode this may lead to creating non-normalized targets, but we ignore it here
-                        # for simplicity. You can always run the command again to normalize remaining targets.
-                        elif redirect and targets[target]['normalized'] != targets[target]['redirect']:
-                            if interactive:
-                                while True:
-                                    user_input = input(f'replace "{target}" with redirect "'
-                                                       + targets[target]['redirect'] + '" [Ynr]: ')
-                                    if user_input.lower() == 'y' or user_input.lower() == '':
-                                        print(f'replacing "{target}" with redirect "' + targets[target]['redirect']
-                                              + '"')
-                                        target = targets[target]['redirect']
-                                        break
-                                    elif user_input.lower() == 'n':
-                                        print(f'keeping "{target}"')
-                                        break
-                                    elif user_input.lower() == 'r':
-                                        replacement = input('replace with: ')
-                                        print(f'replacing with "{replacement}"')
-                                        target = replacement
-                                        break
-                            else:
-                                print(f'replacing "{target}" with redirect "' + targets[target]['redirect']
-                                      + '"')
-                                target = targets[target]['redirect']
-                        elif normalize and target != targets[target]['normalized']:
-                            if interactive:
-                                while True:
-                                    user_input = input(f'replace "{target}" with "' + targets[target]['normalized'] +
-                                                       '" [Yn]: ')
-                                    if user_input.lower() == 'y' or user_input.lower() == '':
-                                        print(f'replacing "{target} with ' + targets[target]['normalized'])
-                                        target = targets[target]['normalized']
-                                        break
-                                    elif user_input.lower() == 'n':
-                                        print(f'keeping "{target}"')
-                                        break
-                            else:
-                                print(f'replacing "{target}" with ' + targets[target]['normalized'])
-                                target = targets[target]['normalized']
-                    output_line += '{{' + token['text'] + '|' + token['class'] + '|' + target + '}}'
-                else:
-                    output_line += token['text']
-            output.append(output_line + '\n')
-        with open(os.path.join(out, parsed_file['file']), 'w') as fp:
-            fp.writelines(output)
+
+@cli.command()
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
+@click.option('--exclude', multiple=True, help='Entity classes we want to exclude from the dataset.')
+@click.option('--replace', 'replacement', nargs=2, default=None, metavar='SEARCH REPLACE',
+              help='Characters to replace and their 1:1 replacements.')
+@click.option('--delete', default='', help='Characters to remove.')
+@click.option('--unicode-escape/--no-unicode-escape', default=False,
+              help='Interpret character lists as Python Unicode strings. '
+                   'This allows to use of Unicode escape sequences e.g. \\u2002')
+@click.option('--exclude-targets/--include-targets', default=True,
+              help='Exclude entity targets from the replacements.')
+@click.option('--remove-non-existent/--keep-non-existent', default=False,
+              help='Remove links to non-existing Wikipedia pages.')
+@click.option('--normalize-targets/--no-normalize-targets', default=False,
+              help='Normalize Wikipedia targets.')
+@click.option('--redirect-targets/--no-redirect-targets', default=False,
+              help='Replace Wikipedia targets that point to redirect pages with their destinations.')
+@click.option('--interactive/--no-interactive', default=False,
+              help='Ask each time before performing target replacements.')
+@click.option('--cache-dir', type=click.Path(file_okay=False), default='.cache',
+              help='Directory with the persistent cache of Wikipedia titles.')
+@click.option('--cache-ttl', type=float, default=30,
+              help='Number of days after which the cached Wikipedia titles expire.')
+@click.option('--offline/--online', default=False,
+              help='Resolve Wikipedia targets only from the cache, without accessing the network.')
+@click.option('--wikipedia-api', default=None,
+              help='URL of the MediaWiki API used to resolve the targets. Defaults to the English Wikipedia.')
+@click.option('--wiki-index', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Title index built by elgold.py wiki-index. If set, the targets are resolved offline from the index '
+                   'instead of the Wikipedia API and its cache.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.option('--incremental/--no-incremental', default=False,
+              help='Update the existing output: process only the files whose contents or the command options changed '
+                   'since the last run.')
+@click.argument('out', nargs=1, type=click.Path(exists=False, file_okay=False), default='out')
+def rewrite(data, exclude, replacement, delete, unicode_escape, exclude_targets, remove_non_existent,
+            normalize_targets, redirect_targets, interactive, cache_dir, cache_ttl, offline, wikipedia_api, wiki_index,
+            jobs, incremental, out):
+    """
+    Clean the dataset in a single pass. The command combines the filter, replace-chars and fix-targets commands:
+    the dataset is parsed and written only once and the selected transforms are applied to each entity in
+    the following order:
+
+    1. Entities with the --exclude classes are replaced with their mention texts.
+
+    2. The --replace characters are replaced and the --delete characters are removed.
+
+    3. Wikipedia targets are fixed (--remove-non-existent, --redirect-targets, --normalize-targets).
+
+    The command creates a copy of the dataset and saves it to the target directory or archive (.zip, .tar.gz or
+    .tar.zst). The original dataset is not touched.
+
+    Example: python elgold.py rewrite --exclude PRODUCT --replace "\\u2014" "-" --unicode-escape --normalize-targets
+    """
+    dataset = Dataset(data)
+    if interactive and jobs > 1:
+        raise click.ClickException('interactive mode requires a single job')
+    _check_output(data, out, incremental)
+    if incremental and interactive:
+        raise click.ClickException('the interactive output depends on the answers, it cannot be incremental')
+
+    search, replace = replacement if replacement is not None else ('', '')
+    if unicode_escape:
+        delete = bytes(delete, 'ascii').decode('unicode-escape')
+        search = bytes(search, 'ascii').decode('unicode-escape')
+        replace = bytes(replace, 'ascii').decode('unicode-escape')
+    if len(search) != len(replace):
+        raise click.ClickException('no 1:1 search replace mapping')
+
+    transforms = []
+    if exclude:
+        transforms.append(FilterClasses(exclude))
+    replace_transform = None
+    if search or delete:
+        replace_transform = ReplaceChars(search, replace, delete, exclude_targets)
+        transforms.append(replace_transform)
+    if remove_non_existent or normalize_targets or redirect_targets:
+        with profiler.phase('collect targets'):
+            targets = dataset.get_targets()
+        if replace_transform is not None and not exclude_targets:  # the targets are fixed after the replacements
+            targets = {replace_transform.translate(target) for target in targets} - {''}
+        from utils.wikipedia import OfflineError, Wikipedia  # imports requests
+
+        if wiki_index is not None:
+            wikipedia = WikipediaDump(wiki_index)
+        else:
+            title_cache = TitleCache(cache_dir, ttl=cache_ttl * 24 * 3600, uri=wikipedia_api)
+            wikipedia = Wikipedia(cache=title_cache, offline=offline, uri=wikipedia_api)
+        try:
+            with profiler.phase('wikipedia'):
+                targets = wikipedia.check_targets(targets)  # resolve all unique targets at once
+        except OfflineError as e:
+            raise click.ClickException(str(e))
+        transforms.append(FixTargets(targets, remove_non_existent, normalize_targets, redirect_targets, interactive))
+
+    stats = _rewrite_dataset(dataset, transforms, out, jobs, incremental=incremental)
+
+    if replace_transform is not None:
+        replacements = stats[transforms.index(replace_transform)]
+        print("replaced:")
+        for search_ch, replace_ch in dict(zip(search, replace)).items():
+            print(f'"{search_ch}" -> "{replace_ch}": ' + str(replacements[search_ch]))
+        print("deleted:")
+        for ch in delete:
+            print(f'"{ch}": ' + str(replacements[ch]))
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
 @click.option('--class', 'search_classes', multiple=True,
               help='Entity classes we want to search for.')
-def list_entities(data, search_classes):
+@click.option('--server/--no-server', default=True,
+              help='Send the query to the elgold.py serve daemon of the dataset if it is running.')
+def list_entities(data, search_classes, server):
     """
     List all entities (one per line) from the selected class. The entities are listed with file names and line numbers.
     """
-    dataset = Dataset(data)
-    for parsed_file in dataset.iterate_files():
-        for parsed_line in parsed_file['lines']:
-            for entity in parsed_line['entities']:
-                if len(search_classes) > 0 and entity['class'] in search_classes:
-                    file = parsed_line['file']
-                    line_nb = parsed_line['nb']
-                    entity_raw = entity['raw']
-                    print(f'{Colors.MAGENTA}{file}{Colors.ENDC}:{Colors.BLUE}{line_nb}{Colors.ENDC}:{entity_raw}')
+    output = _query_server(data, server, 'list_entities', search_classes=search_classes)
+    if output is None:
+        output = _list_entities_output(Dataset(data), search_classes)
+    _print_output(output)
+
+
+def _list_entities_output(dataset, search_classes):
+    for parsed_line in profiler.iterate('read lines', dataset.iterate_lines()):
+        for entity in parsed_line['entities']:
+            if len(search_classes) > 0 and entity['class'] in search_classes:
+                file = parsed_line['file']
+                line_nb = parsed_line['nb']
+                entity_raw = entity['raw']
+                yield f'{Colors.MAGENTA}{file}{Colors.ENDC}:{Colors.BLUE}{line_nb}{Colors.ENDC}:{entity_raw}'
 
 
 @cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
+@click.option('--data', type=click.Path(), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
+@click.option('--table', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Entity table created by convert.py table. If set, the statistics are calculated from the table '
+                   'instead of parsing the dataset.')
+@click.option('--quantile', 'quantiles', type=click.FloatRange(0, 1), multiple=True,
+              help='Additionally print the quantile of the text lengths, e.g. --quantile 0.5 for the median.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.option('--server/--no-server', default=True,
+              help='Send the query to the elgold.py serve daemon of the dataset if it is running. The daemon ignores '
+                   '--jobs.')
 @click.argument('categories', nargs=-1, type=click.Path(exists=False, file_okay=False))
-def text_stat(data, categories):
+def text_stat(data, table, quantiles, jobs, server, categories):
     """
     Calculate raw text statistics for the entire dataset or specified text categories. The statistics include
     the number of texts, minimal text length (number of words), maximum text length, average text length and
     text length standard deviation.
     """
-    dataset = Dataset(data)
     if len(categories) == 0:
         categories = ['']  # get all categories
 
-    files_lenghts = {category: [] for category in categories}
-
-    for parsed_file in dataset.iterate_files():
-        # get first matching category
-        current_category = None
-        for category in categories:
-            if category in parsed_file['category']:
-                current_category = category
-                break
-        if current_category is not None:
-            files_lenghts[current_category].append(
-                sum([len(line['plain_text_tokens']) for line in parsed_file['lines']]))
-
-    print('id\tcount\tmin\tmax\tavg\tstd')
-    for category, tokens_count in files_lenghts.items():
-        nb_of_texts = len(tokens_count)
-        cat_min = min(tokens_count)
-        cat_max = max(tokens_count)
-        cat_avg = mean(tokens_count)
-        cat_stdev = stdev(tokens_count)
-        print(f'{category}\t{nb_of_texts}\t{cat_min}\t{cat_max}\t{cat_avg:.0f}\t{cat_stdev:.0f}')
+    output = None
+    if table is None:
+        output = _query_server(data, server, 'text_stat', categories=categories, quantiles=quantiles)
+    if output is None:
+        from utils.stats import DatasetStats  # imports NumPy
+        from utils.table import EntityTable
+
+        if table is not None:
+            with profiler.phase('load table'):
+                stats = DatasetStats.from_table(EntityTable.load(table), categories)
+        else:
+            if not os.path.exists(data):
+                raise click.ClickException(f'dataset "{data}" does not exist')
+            with profiler.phase('count tokens'):
+                stats = DatasetStats.from_dataset(Dataset(data), categories, jobs=jobs)
+        output = _text_stat_output(stats, categories, quantiles)
+    _print_output(output)
+
+
+def _text_stat_output(stats, categories, quantiles):
+    yield 'id\tcount\tmin\tmax\tavg\tstd' + ''.join(f'\tq{quantile:g}' for quantile in quantiles)
+    for category, length_stats in zip(categories, stats.length_stats(quantiles)):
+        values = [length_stats['min'], length_stats['max'], length_stats['mean'], length_stats['std']]
+        values += length_stats['quantiles']
+        cells = ['-' if value is None else f'{value:.0f}' for value in values]
+        yield f'{category}\t{length_stats["count"]}\t' + '\t'.join(cells)
+
+
+def _validate_file(parsed_file):
+    errors = []
+    with parsed_file.open() as fp:
+        for nb, line in enumerate(fp, start=1):
+            for column, message in validate_line(line.rstrip('\n')):
+                errors.append((nb, column, message))
+    return errors
+
+
+@cli.command()
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to check the dataset files.')
+def validate(data, jobs):
+    """
+    Check the entity markup of the dataset. The command lists the entities without the text, class and target
+    fields, the entities with empty texts or classes and the unmatched "{{" and "}}" with file names, line numbers
+    and columns. Other commands stop at the first entity without the three fields.
+
+    The command exits with status 1 if any errors are found.
+    """
+    dataset = Dataset(data, cache=False)
+    errors = 0
+    files_errors = profiler.iterate('validate', dataset.map_files(_validate_file, jobs))
+    for parsed_file, file_errors in zip(dataset.iterate_files(), files_errors):
+        file = parsed_file['file']
+        for line_nb, column, message in file_errors:
+            print(f'{Colors.MAGENTA}{file}{Colors.ENDC}:{Colors.BLUE}{line_nb}{Colors.ENDC}:{column}: {message}')
+        errors += len(file_errors)
+    if errors:
+        raise click.ClickException(f'{errors} errors found')
+
+
+@cli.command()
+@click.option('--page', 'page_dump', type=click.Path(exists=True, dir_okay=False), required=True,
+              help='Dump of the MediaWiki page table, e.g. enwiki-latest-page.sql.gz.')
+@click.option('--redirect', 'redirect_dump', type=click.Path(exists=True, dir_okay=False), required=True,
+              help='Dump of the MediaWiki redirect table, e.g. enwiki-latest-redirect.sql.gz.')
+@click.option('--namespace', 'namespaces', type=int, multiple=True, default=[0],
+              help='Ids of the namespaces to index. Defaults to the main (article) namespace.')
+@click.argument('target', nargs=1, type=click.Path(exists=False, dir_okay=False), default='wikipedia.idx')
+def wiki_index(page_dump, redirect_dump, namespaces, target):
+    """
+    Build the title index used by the --wiki-index option of fix-targets, rewrite and convert.py blink from
+    the page and redirect SQL dumps of Wikipedia (https://dumps.wikimedia.org). With the index, the targets are
+    resolved locally without accessing the network.
+    """
+    if os.path.exists(target):
+        raise click.ClickException('target file exists')
+    titles = WikipediaDump.build(page_dump, redirect_dump, target, namespaces)
+    print(f'{titles} titles indexed')
+
+
+def _serve_search(corpus, search_classes, search_targets, index):
+    search_index = corpus.get_search_index() if index else None
+    return _search_output(corpus.dataset, search_index, search_classes, search_targets)
+
+
+def _serve_list_entities(corpus, search_classes):
+    return _list_entities_output(corpus.dataset, search_classes)
+
+
+def _serve_text_stat(corpus, categories, quantiles):
+    from utils.stats import DatasetStats  # imports NumPy
+
+    return _text_stat_output(DatasetStats.from_dataset(corpus.dataset, categories), categories, quantiles)
+
+
+@cli.command()
+@click.option('--data', type=click.Path(exists=True), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
+@click.option('--poll', type=click.FloatRange(min=0), default=2.0,
+              help='Interval in seconds of checking the dataset files for changes between the queries. 0 checks '
+                   'the files only when a query is received.')
+def serve(data, poll):
+    """
+    Run a daemon that parses the dataset once, keeps it in memory and answers the search, list-entities and
+    text-stat commands, which use the daemon automatically when it is running (see their --server option).
+    The modified files are parsed again when they change. The daemon listens on the serve.sock Unix socket in
+    the cache directory next to the dataset and stops on Ctrl+C or SIGTERM.
+    """
+    import signal
+
+    from utils.client import UNIX_SOCKETS, socket_path
+
+    if not UNIX_SOCKETS:
+        raise click.ClickException('serve requires Unix domain sockets')
+    sock = connect(data)
+    if sock is not None:
+        sock.close()
+        raise click.ClickException(f'the dataset is already served on {socket_path(data)}')
+    from utils.server import CorpusServer  # imports socketserver
+
+    handlers = {'search': _serve_search, 'list_entities': _serve_list_entities, 'text_stat': _serve_text_stat}
+    with profiler.phase('load'):
+        server = CorpusServer(data, handlers, poll=poll)
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))  # close the server and remove the socket
+    click.echo(f'serving {len(server.dataset.files)} files on {server.server_address}', err=True)
+    with server:
+        try:
+            server.serve_forever(poll_interval=min(poll, 0.5) if poll else 0.5)
+        except KeyboardInterrupt:
+            pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,44 @@
+import importlib
+
+import click
+
+
+class LazyGroup(click.Group):
+    """
+    Group of the command groups defined in other modules. A module is imported only when its group is invoked, so
+    e.g. elgold manage --help does not import NumPy or matplotlib of the plot commands. The short help of the groups
+    is stored here to list them without importing the modules.
+    """
+    def __init__(self, *args, lazy_commands: dict[str, tuple[str, str]], **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_commands = lazy_commands  # name -> ('module:attribute', short help)
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted(super().list_commands(ctx) + list(self.lazy_commands))
+
+    def get_command(self, ctx: click.Context, cmd_name: str) -> click.Command | None:
+        if cmd_name not in self.lazy_commands:
+            return super().get_command(ctx, cmd_name)
+        module_name, attribute = self.lazy_commands[cmd_name][0].split(':')
+        return getattr(importlib.import_module(module_name), attribute)
+
+    def format_commands(self, ctx: click.Context, formatter: click.HelpFormatter) -> None:
+        rows = [(name, self.lazy_commands[name][1]) for name in self.list_commands(ctx) if name in self.lazy_commands]
+        with formatter.section('Commands'):
+            formatter.write_dl(rows)
+
+
+@click.group(cls=LazyGroup, lazy_commands={
+    'manage': ('elgold:cli', 'Manage the dataset: search, filter, rewrite, fix targets and validate it.'),
+    'convert': ('convert:cli', 'Convert the dataset to different formats.'),
+    'plot': ('plot:cli', 'Plot various dataset statistics.'),
+})
+def cli():
+    """
+    The elgold toolset. The commands of elgold.py, convert.py and plot.py are available as elgold manage, elgold
+    convert and elgold plot. Use elgold [group] --help for detailed information about available commands.
+    """
+
+
+if __name__ == '__main__':
+    cli()
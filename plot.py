@@ -1,88 +1,67 @@
 import json
-from collections import Counter, defaultdict
+import os
 
 import click
-import matplotlib.pyplot as plt
 
 from utils.dataset import Dataset
+from utils.profiling import profile_command, profiler
 
 
 @click.group()
-def cli():
+@click.option('--stats/--no-stats', default=False,
+              help='Print the wall time of the processing phases, the number of processed files, lines and entities, '
+                   'the Wikipedia requests and the peak memory usage to stderr when the command finishes.')
+@click.option('--stats-json', type=click.Path(dir_okay=False), default=None,
+              help='Save the statistics (see --stats) to a JSON file.')
+@click.option('--profile', type=click.Path(dir_okay=False), default=None,
+              help='Run the command under cProfile and save the pstats dump to the file.')
+@click.pass_context
+def cli(ctx, stats, stats_json, profile):
     """
     Plot various dataset statistics. Use plot.py [command] --help for detailed information about
     available commands.
     """
-    pass
+    profile_command(ctx, stats, stats_json, profile)
 
 
-@cli.command()
-@click.option('--data', type=click.Path(exists=True, file_okay=False), default='data',
-              help='Path to the elgold dataset.')
-@click.option('--percentage/--absolute', default=False,
-              help='Should we display the absolute number of entities in each class (default) or percentage?')
-@click.option('--labels', type=click.Path(), default='conf/plot_labels.json',
-              help='JSON dictionary with mappings between text categories numbers and their labels.')
-@click.option('--ner-classes', type=click.Path(), default='conf/ner_classes.json',
-              help='JSON array of NER classes that are used in the dataset.')
-@click.argument('categories', nargs=-1)
-def histogram(data, percentage, labels, ner_classes, categories):
+VARIANTS = ('absolute', 'percentage')
+
+
+def _output_path(output: str, variant: str, variants: list[str]) -> str:
     """
-    Summarize the number of entities in each class in the dataset. The histogram can be plotted separately for
-    each texts category (categories argument) or for the entire dataset at once (when we provide no categories).
-    Histogram shows the number of entities with and without links.
+    Return the path of the figure of the variant. If more than one variant is rendered, the variant name is appended
+    to the file name (e.g. hist.png -> hist-percentage.png).
     """
-    dataset = Dataset(data)
-    with open(labels) as fp:
-        labels = json.load(fp)
-    with open(ner_classes) as fp:
-        ner_classes = json.load(fp)
+    if len(variants) == 1:
+        return output
+    root, extension = os.path.splitext(output)
+    return f'{root}-{variant}{extension}'
 
-    if len(categories) == 0:
-        categories = ['']  # get all categories in one plot
-    classes = {category: defaultdict(Counter) for category in categories}
+
+def _plot_histogram(fig, stats, categories: list[str], percentage: bool, labels: dict, ner_classes: list[str]) -> tuple:
+    """
+    Draw the histograms of the categories on the figure. Returns the plotted target, no target and total arrays.
+    """
     nrows = len(categories) // 2 + len(categories) % 2
     ncols = min(len(categories), 2)
-    fig, axs = plt.subplots(nrows, ncols, squeeze=False)
+    axs = fig.subplots(nrows, ncols, squeeze=False)
     if len(categories) > 1 and len(categories) % 2 != 0:
         fig.delaxes(axs[nrows-1, ncols-1])  # The indexing is zero-based here
     # if len(categories) > 1:
     fig.set_figwidth(ncols * 5)
     fig.set_figheight(nrows * 4)
 
-    for parsed_file in dataset.iterate_files():
-        # get first matching category
-        counter_category = None
-        for category in categories:
-            if category in parsed_file['category']:
-                counter_category = category
-                break
-        if counter_category is not None:
-            for entity in parsed_file['entities']:
-                classes[counter_category][entity['class']]['total'] += 1
-                if entity['target'] == '':
-                    classes[counter_category][entity['class']]['no-target'] += 1
-                else:
-                    classes[counter_category][entity['class']]['target'] += 1
-
     if percentage:
-        classes_percentage = {}
-        for counter_category in categories:
-            target_links = sum([x['target'] for x in classes[counter_category].values()])
-            no_target_links = sum([x['no-target'] for x in classes[counter_category].values()])
-            total_links = sum([x['total'] for x in classes[counter_category].values()])
-            classes_percentage[counter_category] = defaultdict(Counter)
-            for ner_class, class_count in classes[counter_category].items():
-                classes_percentage[counter_category][ner_class]['target'] = class_count['target'] / total_links * 100
-                classes_percentage[counter_category][ner_class]['no-target'] = class_count['no-target'] / total_links * 100
-                classes_percentage[counter_category][ner_class]['total'] = class_count['total']/total_links * 100
-        classes = classes_percentage
+        targets, no_targets, totals = stats.percentages()
+    else:
+        targets, no_targets, totals = stats.target, stats.no_target, stats.total
 
+    n_classes = len(ner_classes)  # the classes outside ner_classes are counted in the totals, but not plotted
     for i, counter_category in enumerate(categories):
         row = i // 2
         col = i % 2
-        target = [classes[counter_category][class_]['target'] for class_ in ner_classes]
-        no_target = [classes[counter_category][class_]['no-target'] for class_ in ner_classes]
+        target = targets[i, :n_classes].tolist()
+        no_target = no_targets[i, :n_classes].tolist()
         bars = axs[row,col].barh(ner_classes, target)
         bars = axs[row, col].barh(ner_classes, no_target, left=target)
         if percentage:
@@ -92,22 +71,91 @@ def histogram(data, percentage, labels, ner_classes, categories):
         if counter_category in labels:
             axs[row, col].set_title(labels[counter_category])
 
-    max_x = max([x['total'] for category_coutner in classes.values() for x in category_coutner.values()])
-    if percentage:
-        plt.setp(axs, xlim=(0, max_x + 5))  # + 3 for single histogram
-    else:
-        plt.setp(axs, xlim=(0, max_x + 60))  # + 150 for single histogram
+    max_x = totals.max(initial=0)
+    for ax in axs.flat:
+        if percentage:
+            ax.set_xlim(0, max_x + 5)  # + 3 for single histogram
+        else:
+            ax.set_xlim(0, max_x + 60)  # + 150 for single histogram
     # plt.xlabel('Nb of entities')
     fig.set_tight_layout(True)
-    plt.show()
-
-    print(classes)
-    target = sum([x['target'] for category_coutner in classes.values() for x in category_coutner.values()])
-    no_target = sum([x['no-target'] for category_coutner in classes.values() for x in category_coutner.values()])
-    total = sum([x['total'] for category_coutner in classes.values() for x in category_coutner.values()])
-    print('target:', target)
-    print('no target:', no_target)
-    print('total links:', total)
+    return targets, no_targets, totals
+
+
+@cli.command()
+@click.option('--data', type=click.Path(), default='data',
+              help='Path to the elgold dataset: a directory or a .zip, .tar.gz or .tar.zst archive.')
+@click.option('--table', type=click.Path(exists=True, dir_okay=False), default=None,
+              help='Entity table created by convert.py table. If set, the entities are counted from the table '
+                   'instead of parsing the dataset.')
+@click.option('--percentage/--absolute', default=False,
+              help='Should we display the absolute number of entities in each class (default) or percentage?')
+@click.option('--variant', type=click.Choice(VARIANTS), multiple=True,
+              help='Render the histogram in the variant (absolute or percentage). Can be given multiple times to '
+                   'render several variants from the same counts. Overrides --percentage/--absolute.')
+@click.option('--output', type=click.Path(dir_okay=False), multiple=True,
+              help='Save the histogram to the file (the format follows the extension, e.g. .png, .svg or .pdf) '
+                   'instead of showing it in a window. Can be given multiple times. If more than one variant is '
+                   'rendered, the variant name is appended to the file name.')
+@click.option('--labels', type=click.Path(), default='conf/plot_labels.json',
+              help='JSON dictionary with mappings between text categories numbers and their labels.')
+@click.option('--ner-classes', type=click.Path(), default='conf/ner_classes.json',
+              help='JSON array of NER classes that are used in the dataset.')
+@click.option('--jobs', type=click.IntRange(min=1), default=1,
+              help='Number of worker processes used to parse and process the dataset files.')
+@click.argument('categories', nargs=-1)
+def histogram(data, table, percentage, variant, output, labels, ner_classes, jobs, categories):
+    """
+    Summarize the number of entities in each class in the dataset. The histogram can be plotted separately for
+    each texts category (categories argument) or for the entire dataset at once (when we provide no categories).
+    Histogram shows the number of entities with and without links.
+    """
+    from utils.stats import DatasetStats  # imports NumPy
+    from utils.table import EntityTable
+
+    with open(labels) as fp:
+        labels = json.load(fp)
+    with open(ner_classes) as fp:
+        ner_classes = json.load(fp)
+
+    if len(categories) == 0:
+        categories = ['']  # get all categories in one plot
+    variants = list(dict.fromkeys(variant)) or ['percentage' if percentage else 'absolute']
+
+    if table is not None:
+        with profiler.phase('load table'):
+            stats = DatasetStats.from_table(EntityTable.load(table), categories, ner_classes)
+    else:
+        if not os.path.exists(data):
+            raise click.ClickException(f'dataset "{data}" does not exist')
+        with profiler.phase('count classes'):
+            stats = DatasetStats.from_dataset(Dataset(data), categories, ner_classes, jobs)
+
+    # matplotlib is imported only here, so --help and the argument errors do not pay for its import. The saved
+    # figures are rendered by the Agg canvas of the Figure, without pyplot and its interactive backend.
+    if output:
+        from matplotlib.figure import Figure
+    else:
+        import matplotlib.pyplot as plt
+
+    for name in variants:
+        with profiler.phase('plot'):
+            fig = Figure() if output else plt.figure()
+            targets, no_targets, totals = _plot_histogram(fig, stats, categories, name == 'percentage', labels,
+                                                          ner_classes)
+            for path in output:
+                fig.savefig(_output_path(path, name, variants))
+
+        print({category: {cls: {'target': targets[i, j].item(), 'no-target': no_targets[i, j].item(),
+                                'total': totals[i, j].item()}
+                          for j, cls in enumerate(stats.classes) if stats.total[i, j] > 0}
+               for i, category in enumerate(categories)})
+        print('target:', targets.sum().item())
+        print('no target:', no_targets.sum().item())
+        print('total links:', totals.sum().item())
+
+    if not output:
+        plt.show()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,19 @@
+import pytest
+
+TITLES = [f'Title {i} of the {word}' for i, word in enumerate(['city', 'river', 'band', 'novel', 'album'] * 24)]
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    """
+    Small elgold dataset with the TITLES as the entity targets, written as they appear in the texts (with underscores
+    and lowercase first letters), so the titles need to be normalized.
+    """
+    data = tmp_path / 'data'
+    data.mkdir()
+    for i in range(0, len(TITLES), 10):
+        with open(data / f'1_{i // 10 + 1}.txt', 'w') as fp:
+            for title in TITLES[i:i + 10]:
+                target = title[0].lower() + title[1:].replace(' ', '_')
+                fp.write(f'Some text about {{{{{title}|LOC|{target}}}}} and more.\n')
+    return str(data)
@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+import stub_wikipedia
+from click.testing import CliRunner
+from stub_wikipedia import StubWikipedia
+
+import elgold
+from utils.manifest import Manifest
+
+
+def processed(result):
+    return sorted(line.removeprefix('processing ') for line in result.output.splitlines()
+                  if line.startswith('processing '))
+
+
+def fix_targets(data, out, stub, cache_dir, *options):
+    result = CliRunner().invoke(elgold.cli, ['fix-targets', '--data', data, '--redirect', '--incremental',
+                                             '--cache-dir', cache_dir, '--cache-ttl', '0',
+                                             '--wikipedia-api', stub.uri, *options, out])
+    assert result.exit_code == 0, result.output
+    return result
+
+
+@pytest.mark.parametrize('prefetch', ['256', '0'])
+def test_fix_targets_redirect_change(dataset, tmp_path, monkeypatch, prefetch):
+    out = str(tmp_path / 'out')
+    cache_dir = str(tmp_path / 'cache')
+    with StubWikipedia() as stub:
+        first = fix_targets(dataset, out, stub, cache_dir, '--prefetch', prefetch)
+        assert processed(first) == sorted(os.listdir(dataset))
+        assert processed(fix_targets(dataset, out, stub, cache_dir, '--prefetch', prefetch)) == []
+
+        page = stub_wikipedia.page
+        monkeypatch.setattr(stub_wikipedia, 'page',
+                            lambda title: (True, 'Moved') if title == 'Title 0 of the city' else page(title))
+        assert processed(fix_targets(dataset, out, stub, cache_dir, '--prefetch', prefetch)) == ['1_1.txt']
+    with open(os.path.join(out, '1_1.txt')) as fp:
+        assert '{{Title 0 of the city|LOC|Moved}}' in fp.read()
+
+
+def test_interactive_is_not_incremental(dataset, tmp_path):
+    result = CliRunner().invoke(elgold.cli, ['fix-targets', '--data', dataset, '--interactive', '--incremental',
+                                             str(tmp_path / 'out')])
+    assert result.exit_code != 0
+
+
+def test_remove_stale_after_options_change(dataset, tmp_path):
+    out = str(tmp_path / 'out')
+    runner = CliRunner()
+    assert runner.invoke(elgold.cli, ['filter', '--data', dataset, '--exclude', 'LOC', '--incremental', out]) \
+        .exit_code == 0
+    os.remove(os.path.join(dataset, '1_2.txt'))
+    assert runner.invoke(elgold.cli, ['filter', '--data', dataset, '--exclude', 'ORG', '--incremental', out]) \
+        .exit_code == 0
+    assert sorted(os.listdir(dataset)) == sorted(f for f in os.listdir(out) if f != Manifest.FILE)
+    with open(os.path.join(out, Manifest.FILE)) as fp:
+        assert set(json.load(fp)['files']) == set(os.listdir(dataset))
+
+
+def test_output_permissions(dataset, tmp_path):
+    umask = os.umask(0o022)
+    try:
+        for options in (['--incremental'], []):
+            out = tmp_path / f'out{len(options)}'
+            assert CliRunner().invoke(elgold.cli, ['filter', '--data', dataset, '--exclude', 'LOC', *options,
+                                                   str(out)]).exit_code == 0
+            assert {oct(path.stat().st_mode & 0o777) for path in out.iterdir()} == {oct(0o644)}
+    finally:
+        os.umask(umask)
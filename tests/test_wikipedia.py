@@ -0,0 +1,72 @@
+import pytest
+from stub_wikipedia import StubWikipedia, normalize, page
+
+from utils.cache import TitleCache
+from utils.dataset import Dataset
+from utils.wikipedia import OfflineError, Wikipedia
+
+
+@pytest.fixture
+def stub():
+    with StubWikipedia() as stub:
+        yield stub
+
+
+@pytest.fixture
+def targets(dataset):
+    return Dataset(dataset, cache=False).get_targets()
+
+
+def expected_target(title):
+    normalized = normalize(title)
+    exists, redirect = page(normalized)
+    if redirect != normalized:
+        exists = page(redirect)[0]
+    return {'normalized': normalized, 'redirect': redirect, 'exists': exists}
+
+
+def test_check_targets(stub, targets):
+    wikipedia = Wikipedia(uri=stub.uri)
+    resolved = wikipedia.check_targets(targets)
+    assert resolved == {title: expected_target(title) for title in targets}
+    assert stub.requests == -(-len(targets) // Wikipedia.MAX_TITLES)  # batches of MAX_TITLES titles
+    # the stub pages cover all the cases
+    assert {(target['normalized'] != target['redirect'], target['exists']) for target in resolved.values()} >= \
+        {(False, True), (False, False), (True, True)}
+
+
+def test_get_ids(stub, targets):
+    ids = Wikipedia(uri=stub.uri).get_ids(targets)
+    assert set(ids) == {normalize(title) for title in targets}
+    for title, page_id in ids.items():
+        assert (int(page_id) > 0) == page(title)[0]
+
+
+def test_cache(stub, targets, tmp_path):
+    resolved = Wikipedia(cache=TitleCache(str(tmp_path / 'cache'), uri=stub.uri), uri=stub.uri).check_targets(targets)
+    ids = Wikipedia(cache=TitleCache(str(tmp_path / 'cache'), uri=stub.uri), uri=stub.uri).get_ids(targets)
+    requests = stub.requests
+    offline = Wikipedia(cache=TitleCache(str(tmp_path / 'cache'), uri=stub.uri), offline=True, uri=stub.uri)
+    assert offline.check_targets(targets) == resolved
+    assert offline.get_ids(targets) == ids
+    assert stub.requests == requests
+    with pytest.raises(OfflineError):
+        offline.check_targets(targets | {'Not cached'})
+
+
+def test_cache_per_endpoint(stub, targets, tmp_path):
+    Wikipedia(cache=TitleCache(str(tmp_path / 'cache'), uri=stub.uri), uri=stub.uri).check_targets(targets)
+    offline = Wikipedia(cache=TitleCache(str(tmp_path / 'cache')), offline=True)
+    with pytest.raises(OfflineError):  # the stub lookups are not Wikipedia lookups
+        offline.check_targets(targets)
+    with pytest.raises(ValueError):
+        Wikipedia(cache=TitleCache(str(tmp_path / 'cache')), uri=stub.uri)
+
+
+def test_cache_titles_without_pages(tmp_path):
+    wikipedia = Wikipedia(cache=TitleCache(str(tmp_path / 'cache')))
+    wikipedia._query = lambda params: {'pages': {'5': {'title': 'Foo'}}, 'normalized': [{'from': 'foo', 'to': 'Foo'}],
+                                       'redirects': []}  # no page of the interwiki title
+    assert wikipedia.get_ids({'foo', 'fr:Bar'}) == {'Foo': '5'}
+    offline = Wikipedia(cache=TitleCache(str(tmp_path / 'cache')), offline=True)
+    assert offline.get_ids({'foo', 'fr:Bar'}) == {'Foo': '5'}
@@ -0,0 +1,34 @@
+import pytest
+from stub_wikipedia import StubWikipedia, write_dumps
+
+from utils.dataset import Dataset
+from utils.wikipedia import Wikipedia
+from utils.wikipedia_dump import WikipediaDump
+
+
+@pytest.fixture
+def stub():
+    with StubWikipedia() as stub:
+        yield stub
+
+
+@pytest.fixture
+def targets(dataset):
+    return Dataset(dataset, cache=False).get_targets()
+
+
+@pytest.fixture
+def wikipedia_dump(dataset, tmp_path):
+    page_dump, redirect_dump = write_dumps(dataset, str(tmp_path))
+    WikipediaDump.build(page_dump, redirect_dump, str(tmp_path / 'titles.idx'))
+    return WikipediaDump(str(tmp_path / 'titles.idx'))
+
+
+def test_check_targets(stub, targets, wikipedia_dump):
+    assert wikipedia_dump.check_targets(targets) == Wikipedia(uri=stub.uri).check_targets(targets)
+
+
+def test_get_ids(stub, targets, wikipedia_dump):
+    ids = Wikipedia(uri=stub.uri).get_ids(targets)
+    # the dump has its own page ids and no ids of the missing pages, the API returns negative ids for them
+    assert set(wikipedia_dump.get_ids(targets)) == {title for title, page_id in ids.items() if int(page_id) > 0}
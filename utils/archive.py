@@ -0,0 +1,328 @@
+import io
+import json
+import mmap
+import os
+import struct
+import tarfile
+import time
+import zipfile
+from typing import IO, NamedTuple
+
+from utils.dataset import natural_keys
+from utils.files import atomic_write, temp_file
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, it is required only by the .tar.zst archives
+    zstandard = None
+
+ZIP_EXTENSIONS = ('.zip',)
+TAR_GZ_EXTENSIONS = ('.tar.gz', '.tgz')
+TAR_ZST_EXTENSIONS = ('.tar.zst', '.tzst')
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + TAR_GZ_EXTENSIONS + TAR_ZST_EXTENSIONS
+
+
+def is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+
+class MemberStat(NamedTuple):
+    """
+    Modification time and size of an archive member, compatible with the os.stat_result fields used by the corpus
+    cache and the search index. The modification time is the time of the archive, so all caches of the members are
+    invalidated when the archive is replaced.
+    """
+    st_mtime_ns: int
+    st_size: int
+
+
+def dataset_members(names: list[str]) -> dict[str, str]:
+    """
+    Map the dataset file names to the names of the archive members. The dataset files are the regular files in
+    the root of the archive or, if all files are in a single top-level directory (e.g. data/), in that directory.
+    Hidden files and the __MACOSX metadata directory are skipped.
+    """
+    names = [name.removeprefix('./') for name in names if not name.startswith(('__MACOSX/', './__MACOSX/'))]
+    top_dirs = {name.split('/', 1)[0] if '/' in name else None for name in names}
+    root = f'{top_dirs.pop()}/' if len(top_dirs) == 1 and None not in top_dirs else ''
+    members = {}
+    for name in names:
+        file = name.removeprefix(root)
+        if name.startswith(root) and '/' not in file and not file.startswith('.'):
+            members[file] = name
+    return members
+
+
+def _text(data, mode: str) -> IO:
+    if mode == 'rb':
+        return io.BytesIO(data)
+    return io.StringIO(str(data, 'utf-8'), newline=None)  # universal newlines, like open(path)
+
+
+class _MemberReader(io.RawIOBase):
+    """
+    Read-only binary file of a member stored in the memory-mapped archive. The member is not copied: read and
+    readline copy only the returned bytes, and getbuffer returns a read-only view of the mapping (like
+    io.BytesIO.getbuffer, so hashlib.file_digest hashes the member directly from the mapping).
+    """
+    def __init__(self, mm: mmap.mmap, start: int, end: int) -> None:
+        super().__init__()
+        self.mm = mm
+        self.start = start
+        self.end = end
+        self.pos = start
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.pos - self.start
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: self.start, io.SEEK_CUR: self.pos, io.SEEK_END: self.end}[whence]
+        self.pos = max(base + offset, self.start)
+        return self.tell()
+
+    def getbuffer(self) -> memoryview:
+        return memoryview(self.mm)[self.start:self.end].toreadonly()
+
+    def readinto(self, buffer) -> int:
+        size = max(min(len(buffer), self.end - self.pos), 0)
+        with memoryview(buffer) as view, memoryview(self.mm) as mm:
+            view[:size] = mm[self.pos:self.pos + size]
+        self.pos += size
+        return size
+
+    def read(self, size: int = -1) -> bytes:
+        end = self.end if size is None or size < 0 else min(self.pos + size, self.end)
+        data = self.mm[self.pos:end] if end > self.pos else b''
+        self.pos += len(data)
+        return data
+
+    def readall(self) -> bytes:
+        return self.read()
+
+    def readline(self, size: int = -1) -> bytes:
+        end = self.mm.find(b'\n', self.pos, self.end) + 1 or self.end
+        return self.read(end - self.pos if size is None or size < 0 else min(end - self.pos, size))
+
+
+class ZipArchive:
+    """
+    Dataset stored in a zip archive. The archive is memory-mapped and the members stored without compression are
+    decoded directly from the mapping, without reading them into intermediate buffers, or opened in the binary mode
+    as read-only readers of the mapping (see _MemberReader). The compressed members are streamed by zipfile.
+    """
+    LOCAL_HEADER = struct.Struct('<4s22xHH')  # signature, ..., file name length, extra field length
+    LOCAL_HEADER_SIGNATURE = b'PK\x03\x04'
+
+    def __init__(self, path: str, cache_dir: str | None = None) -> None:
+        self.path = path
+        self.cache_dir = cache_dir
+        self.zip = zipfile.ZipFile(path)
+        with open(path, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        infos = {info.filename: info for info in self.zip.infolist() if not info.is_dir()}
+        self.members = {file: infos[name] for file, name in dataset_members(list(infos)).items()}
+
+    def __reduce__(self):
+        return open_archive, (self.path, self.cache_dir)  # reopened once per worker process
+
+    def stat(self, file: str) -> MemberStat:
+        return MemberStat(self.mtime_ns, self.members[file].file_size)
+
+    def open(self, file: str, mode: str = 'r') -> IO:
+        info = self.members[file]
+        if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:  # compressed or encrypted
+            fp = self.zip.open(info)
+            return fp if mode == 'rb' else io.TextIOWrapper(fp, encoding='utf-8')
+        signature, name_length, extra_length = self.LOCAL_HEADER.unpack_from(self.mm, info.header_offset)
+        if signature != self.LOCAL_HEADER_SIGNATURE:
+            raise zipfile.BadZipFile(f'bad local header of {info.filename} in {self.path}')
+        start = info.header_offset + self.LOCAL_HEADER.size + name_length + extra_length
+        if mode == 'rb':
+            return _MemberReader(self.mm, start, start + info.compress_size)
+        with memoryview(self.mm)[start:start + info.compress_size] as data:
+            return _text(data, mode)
+
+
+class TarArchive:
+    """
+    Dataset stored in a .tar.gz or .tar.zst archive. The compressed tar can only be read sequentially, so
+    the members are read from a single stream that moves forward: the members passed on the way to the requested one
+    are kept in memory only if they come later in the natural-key order (the order of Dataset.files), the earlier
+    ones are dropped. Reading the files in the natural-key order decompresses the archive once and keeps in memory
+    only the members stored out of order. A request for a member that was already passed restarts the stream.
+
+    Listing the members requires decompressing the whole archive, so the list is saved in the cache directory.
+    """
+    MEMBERS_FILE = 'archive-members.json'
+
+    def __init__(self, path: str, cache_dir: str | None = None) -> None:
+        if path.lower().endswith(TAR_ZST_EXTENSIONS) and zstandard is None:
+            raise RuntimeError('reading .tar.zst archives requires zstandard')
+        self.path = path
+        self.cache_dir = cache_dir
+        stat = os.stat(path)
+        self.mtime_ns = stat.st_mtime_ns
+        self.version = [stat.st_mtime_ns, stat.st_size]
+        sizes = self._load_members()
+        if sizes is None:
+            tar, fp = self._open_stream()
+            with fp, tar:
+                sizes = {tarinfo.name.removeprefix('./'): tarinfo.size for tarinfo in tar if tarinfo.isfile()}
+            self._save_members(sizes)
+        self.members = dataset_members(list(sizes))
+        self.sizes = {file: sizes[name] for file, name in self.members.items()}
+        self.order = {name: natural_keys(file) for file, name in self.members.items()}
+        self.stream = None
+        self.stream_fp = None
+        self.passed = set()  # members passed by the current stream
+        self.buffered = {}  # member -> contents
+
+    def __reduce__(self):
+        return open_archive, (self.path, self.cache_dir)  # reopened once per worker process
+
+    def _load_members(self) -> dict | None:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, self.MEMBERS_FILE)) as fp:
+                cached = json.load(fp)
+        except (OSError, ValueError):
+            return None
+        return cached['members'] if cached.get('archive') == self.version else None
+
+    def _save_members(self, sizes: dict) -> None:
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with atomic_write(os.path.join(self.cache_dir, self.MEMBERS_FILE), 'w') as fp:
+                json.dump({'archive': self.version, 'members': sizes}, fp)
+        except OSError:
+            pass
+
+    def _open_stream(self) -> tuple[tarfile.TarFile, IO]:
+        """
+        Open the tar stream of the archive. Returns the stream and the archive file, which must be closed separately.
+        """
+        fp = open(self.path, 'rb')
+        if self.path.lower().endswith(TAR_GZ_EXTENSIONS):
+            return tarfile.open(fileobj=fp, mode='r|gz'), fp
+        return tarfile.open(fileobj=zstandard.ZstdDecompressor().stream_reader(fp), mode='r|'), fp
+
+    def _close_stream(self) -> None:
+        if self.stream is not None:
+            self.stream.close()
+            self.stream_fp.close()
+        self.stream = self.stream_fp = None
+
+    def _read(self, name: str) -> bytes:
+        key = self.order[name]
+        self.buffered = {member: data for member, data in self.buffered.items() if self.order[member] >= key}
+        if name in self.buffered:
+            return self.buffered.pop(name)
+        if self.stream is None or name in self.passed:
+            self._close_stream()
+            self.stream, self.stream_fp = self._open_stream()
+            self.passed = set()
+            self.buffered = {}
+        while (tarinfo := self.stream.next()) is not None:  # iter(self.stream) would start from the first member
+            member = tarinfo.name.removeprefix('./')
+            if not tarinfo.isfile() or member not in self.order:
+                continue
+            self.passed.add(member)
+            if member == name:
+                return self.stream.extractfile(tarinfo).read()
+            if self.order[member] > key:
+                self.buffered[member] = self.stream.extractfile(tarinfo).read()
+        self._close_stream()
+        raise KeyError(f'{name} not found in {self.path}')
+
+    def stat(self, file: str) -> MemberStat:
+        return MemberStat(self.mtime_ns, self.sizes[file])
+
+    def open(self, file: str, mode: str = 'r') -> IO:
+        return _text(self._read(self.members[file]), mode)
+
+
+_archives = {}  # (path, cache dir) -> archive opened by this process
+
+
+def open_archive(path: str, cache_dir: str | None = None) -> ZipArchive | TarArchive:
+    """
+    Open the dataset archive (.zip, .tar.gz or .tar.zst). Each process opens the archive once, also when it is
+    passed to the worker processes of Dataset.map_files, and again only if the archive was modified.
+    """
+    key = (os.path.abspath(path), cache_dir)
+    if key not in _archives or _archives[key].mtime_ns != os.stat(path).st_mtime_ns:
+        if path.lower().endswith(ZIP_EXTENSIONS):
+            _archives[key] = ZipArchive(path, cache_dir)
+        elif path.lower().endswith(TAR_GZ_EXTENSIONS + TAR_ZST_EXTENSIONS):
+            _archives[key] = TarArchive(path, cache_dir)
+        else:
+            raise ValueError(f'{path} is not a .zip, .tar.gz or .tar.zst archive')
+    return _archives[key]
+
+
+class ArchiveWriter:
+    """
+    Write the output dataset files straight into a compressed archive (.zip, .tar.gz or .tar.zst). The archive is
+    written to a temporary file and moved to the path when it is closed, so an interrupted command does not leave
+    a partial archive. The files are stored in the root of the archive.
+    """
+    def __init__(self, path: str) -> None:
+        if not is_archive(path):
+            raise ValueError(f'{path} is not a .zip, .tar.gz or .tar.zst archive')
+        if path.lower().endswith(TAR_ZST_EXTENSIONS) and zstandard is None:
+            raise RuntimeError('writing .tar.zst archives requires zstandard')
+        self.path = path
+        self.fp, self.tmp_path = temp_file(os.path.dirname(os.path.abspath(path)))
+        self.mtime = int(time.time())
+        self.zip = self.tar = self.compressor = None
+        if path.lower().endswith(ZIP_EXTENSIONS):
+            self.zip = zipfile.ZipFile(self.fp, 'w', compression=zipfile.ZIP_DEFLATED)
+        elif path.lower().endswith(TAR_GZ_EXTENSIONS):
+            self.tar = tarfile.open(fileobj=self.fp, mode='w|gz')
+        else:
+            self.compressor = zstandard.ZstdCompressor().stream_writer(self.fp, closefd=False)
+            self.tar = tarfile.open(fileobj=self.compressor, mode='w|')
+
+    def write(self, file: str, text: str) -> None:
+        data = text.encode('utf-8')
+        if self.zip is not None:
+            self.zip.writestr(file, data)
+            return
+        tarinfo = tarfile.TarInfo(file)
+        tarinfo.size = len(data)
+        tarinfo.mtime = self.mtime
+        tarinfo.mode = 0o644
+        self.tar.addfile(tarinfo, io.BytesIO(data))
+
+    def close(self) -> None:
+        if self.zip is not None:
+            self.zip.close()
+        else:
+            self.tar.close()
+            if self.compressor is not None:
+                self.compressor.close()
+        self.fp.close()
+        os.replace(self.tmp_path, self.path)
+
+    def discard(self) -> None:
+        self.fp.close()
+        os.unlink(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from collections.abc import Iterable, Iterator
+
+
+def chunks(items: list, size: int) -> Iterator[list]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+class TitleCache:
+    """
+    Persistent SQLite cache of Wikipedia title lookups. The cache stores the results of
+    Wikipedia.check_targets (normalized title, redirect and existence) and Wikipedia.get_ids (normalized title and
+    page id) separately for each title. Entries older than ttl seconds are treated as missing. When the cache grows
+    over max_entries rows, the least recently used entries are evicted.
+
+    The lookups of other API endpoints than the Wikipedia API of the language (uri, e.g. a mirror or the benchmark
+    stub) are kept in a separate database file for each endpoint, so they are never returned as Wikipedia lookups.
+
+    The cache can be used from multiple threads (see TargetPrefetcher), the queries are serialized by a lock.
+    """
+    SQL_CHUNK = 500  # stay below the SQLite limit of host parameters in a single query
+
+    def __init__(self, cache_dir: str = '.cache', language: str = 'en', ttl: float = 30 * 24 * 3600,
+                 max_entries: int = 1_000_000, uri: str | None = None) -> None:
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self.language = language
+        self.uri = uri if uri is not None else f'https://{language}.wikipedia.org/w/api.php'
+        if self.uri == f'https://{language}.wikipedia.org/w/api.php':
+            db_file = 'wikipedia.sqlite'
+        else:
+            db_file = f'wikipedia-{hashlib.sha256(self.uri.encode("utf-8")).hexdigest()[:16]}.sqlite'
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, db_file), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS targets (
+                language TEXT NOT NULL,
+                title TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                redirect TEXT NOT NULL,
+                "exists" INTEGER NOT NULL,
+                updated REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (language, title)
+            );
+            CREATE INDEX IF NOT EXISTS targets_accessed ON targets (accessed);
+            CREATE TABLE IF NOT EXISTS ids (
+                language TEXT NOT NULL,
+                title TEXT NOT NULL,
+                normalized TEXT NOT NULL,
+                page_id TEXT NOT NULL,
+                updated REAL NOT NULL,
+                accessed REAL NOT NULL,
+                PRIMARY KEY (language, title)
+            );
+            CREATE INDEX IF NOT EXISTS ids_accessed ON ids (accessed);
+        ''')
+
+    def close(self) -> None:
+        self.db.close()
+
+    def _select(self, table: str, columns: str, titles: Iterable[str]) -> list[tuple]:
+        with self.lock:
+            return list(self._select_rows(table, columns, titles))
+
+    def _select_rows(self, table: str, columns: str, titles: Iterable[str]) -> Iterator[tuple]:
+        now = time.time()
+        titles = list(titles)
+        for chunk in chunks(titles, self.SQL_CHUNK):
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.db.execute(f'SELECT title, {columns} FROM {table} '
+                                   f'WHERE language = ? AND updated >= ? AND title IN ({placeholders})',
+                                   [self.language, now - self.ttl, *chunk]).fetchall()
+            self.db.executemany(f'UPDATE {table} SET accessed = ? WHERE language = ? AND title = ?',
+                                [(now, self.language, row[0]) for row in rows])
+            yield from rows
+        self.db.commit()
+
+    def _evict(self, table: str) -> None:
+        count, = self.db.execute(f'SELECT COUNT(*) FROM {table}').fetchone()
+        if count > self.max_entries:
+            self.db.execute(f'DELETE FROM {table} WHERE rowid IN '
+                            f'(SELECT rowid FROM {table} ORDER BY accessed LIMIT ?)', (count - self.max_entries,))
+
+    def get_targets(self, titles: Iterable[str]) -> dict:
+        return {title: {'normalized': normalized, 'redirect': redirect, 'exists': bool(exists)}
+                for title, normalized, redirect, exists in self._select('targets', 'normalized, redirect, "exists"',
+                                                                        titles)}
+
+    def put_targets(self, targets: dict) -> None:
+        now = time.time()
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO targets VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                [(self.language, title, target['normalized'], target['redirect'], target['exists'],
+                                  now, now) for title, target in targets.items()])
+            self._evict('targets')
+            self.db.commit()
+
+    def get_ids(self, titles: Iterable[str]) -> dict:
+        """
+        Returns a dictionary title -> (normalized title, page id) for cached titles. The page id is None for the titles
+        without pages, stored as an empty string.
+        """
+        return {title: (normalized, page_id or None)
+                for title, normalized, page_id in self._select('ids', 'normalized, page_id', titles)}
+
+    def put_ids(self, ids: dict) -> None:
+        now = time.time()
+        with self.lock:
+            self.db.executemany('INSERT OR REPLACE INTO ids VALUES (?, ?, ?, ?, ?, ?)',
+                                [(self.language, title, normalized, page_id or '', now, now)
+                                 for title, (normalized, page_id) in ids.items()])
+            self._evict('ids')
+            self.db.commit()
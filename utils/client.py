@@ -0,0 +1,52 @@
+import json
+import os
+import socket
+from collections.abc import Iterator
+
+from utils.dataset import cache_dir
+
+SOCKET_FILE = 'serve.sock'
+PROTOCOL_VERSION = 1
+UNIX_SOCKETS = hasattr(socket, 'AF_UNIX')  # not available on Windows
+
+
+class ServerError(Exception):
+    pass
+
+
+def socket_path(data_dir: str) -> str:
+    return os.path.join(cache_dir(data_dir), SOCKET_FILE)
+
+
+def connect(data_dir: str) -> socket.socket | None:
+    """
+    Connect to the serve daemon of the dataset. Returns None if no daemon is running.
+    """
+    if not UNIX_SOCKETS:
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path(data_dir))
+    except OSError:  # no socket or the socket left by a killed daemon
+        sock.close()
+        return None
+    return sock
+
+
+def query(sock: socket.socket, command: str, args: dict) -> Iterator[str]:
+    """
+    Send the command to the daemon and stream the lines of its output. The request and the response messages are
+    JSON objects, one per line: the daemon answers with {"line": ...} messages followed by {"done": true} or
+    {"error": ...}.
+    """
+    with sock, sock.makefile('rwb') as fp:
+        fp.write(json.dumps({'version': PROTOCOL_VERSION, 'command': command, 'args': args}).encode('utf-8') + b'\n')
+        fp.flush()
+        for message in fp:
+            message = json.loads(message)
+            if 'error' in message:
+                raise ServerError(message['error'])
+            if message.get('done'):
+                return
+            yield message['line']
+    raise ServerError('connection closed by the server')
@@ -0,0 +1,226 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from collections.abc import Iterator
+
+from utils.dataset import Line, Span
+from utils.files import temp_file
+from utils.profiling import profiler
+
+
+class CorpusCache:
+    """
+    Binary cache of the parsed dataset files. The cache is stored in the cache directory next to the dataset
+    (<data_dir>.elgold), with one file per dataset file. Each cache file contains the columns of the parsed file:
+
+    * the plain text of all lines (UTF-8), followed by the line end offsets,
+    * the entity spans (start, end, class id, target id) with the number of spans in each line,
+    * the table of class and target strings.
+
+    The plain text comes first, so it is written while the file is parsed (see CorpusCacheWriter).
+
+    The cache files are memory-mapped when loaded and invalidated when the modification time or the size of the
+    dataset file changes.
+    """
+    MAGIC = b'ELGC'
+    VERSION = 2
+    HEADER = struct.Struct('=4sHqqIIIQ')  # magic, version, mtime_ns, size, lines, spans, strings, text bytes
+    COLUMN = 'I'  # unsigned 32-bit integers
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+
+    def _cache_path(self, file: str) -> str:
+        return os.path.join(self.cache_dir, file + '.bin')
+
+    def load(self, file: str, stat: os.stat_result) -> Iterator[Line] | None:
+        """
+        Return the iterator over the cached lines of the dataset file or None if the file is not cached or the cache
+        is out of date. The stat is the current stat of the dataset file (see ParsedFile.stat).
+        """
+        try:
+            with open(self._cache_path(file), 'rb') as fp:
+                mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # no cache file or empty file that cannot be mapped
+            return None
+        if len(mm) < self.HEADER.size:
+            mm.close()
+            return None
+        magic, version, mtime_ns, size, n_lines, n_spans, n_strings, text_bytes = self.HEADER.unpack_from(mm)
+        if (magic, version, mtime_ns, size) != (self.MAGIC, self.VERSION, stat.st_mtime_ns, stat.st_size):
+            mm.close()
+            return None
+        profiler.count(files=1, lines=n_lines, entities=n_spans, corpus_cache_hits=1)
+        return self._iterate_lines(file, mm, n_lines, n_spans, n_strings, text_bytes)
+
+    def _iterate_lines(self, file: str, mm: mmap.mmap, n_lines: int, n_spans: int, n_strings: int,
+                       text_bytes: int) -> Iterator[Line]:
+        buffer = memoryview(mm)
+        offset = self.HEADER.size
+        text = str(buffer[offset:offset + text_bytes], 'utf-8')
+        offset += text_bytes
+        columns = []
+        for length in (n_lines, n_lines, n_spans, n_spans, n_spans, n_spans, n_strings + 1):
+            nbytes = length * array(self.COLUMN).itemsize
+            columns.append(buffer[offset:offset + nbytes].cast(self.COLUMN))
+            offset += nbytes
+        line_ends, line_spans, starts, ends, classes, targets, string_ends = columns
+        strings_start = offset
+        strings = [sys.intern(str(buffer[strings_start + string_ends[i]:strings_start + string_ends[i + 1]],
+                                  'utf-8')) for i in range(n_strings)]
+
+        try:
+            line_start = 0
+            span = 0
+            for nb in range(n_lines):
+                spans = tuple(Span(starts[i], ends[i], strings[classes[i]], strings[targets[i]])
+                              for i in range(span, line_spans[nb]))
+                yield Line(file, nb + 1, text[line_start:line_ends[nb]], spans)
+                line_start = line_ends[nb]
+                span = line_spans[nb]
+        finally:
+            for column in columns:
+                column.release()
+            buffer.release()
+            mm.close()
+
+    def writer(self, file: str, stat: os.stat_result) -> 'CorpusCacheWriter':
+        """
+        Open the writer of the cache of the dataset file. The stat must be taken before the file is read, so
+        the changes made while parsing invalidate the cache.
+        """
+        return CorpusCacheWriter(self, file, stat)
+
+
+class CorpusCacheWriter:
+    """
+    Writer of a cache file of CorpusCache, fed with the lines while the dataset file is parsed. The plain text of
+    each line is written straight to a temporary file, only the integer columns and the table of class and target
+    strings are kept in memory. The temporary file is moved to the cache when the writer is closed and removed if
+    it is discarded (e.g. when the parsing stops early). The errors are ignored, e.g. when the dataset is read-only,
+    and the file is not cached then.
+    """
+    def __init__(self, cache: CorpusCache, file: str, stat: os.stat_result) -> None:
+        self.cache = cache
+        self.path = cache._cache_path(file)
+        self.stat = stat
+        self.line_ends, self.line_spans, self.starts, self.ends, self.classes, self.targets = \
+            (array(cache.COLUMN) for _ in range(6))
+        self.string_ids = {}
+        self.text_length = 0  # in characters, the offsets of the lines in the decoded text
+        self.text_bytes = 0
+        self.fp = self.tmp_path = None
+        try:
+            os.makedirs(cache.cache_dir, exist_ok=True)
+            self.fp, self.tmp_path = temp_file(cache.cache_dir)
+            self.fp.write(bytes(cache.HEADER.size))  # written when the counts are known
+        except OSError:
+            self.discard()
+
+    def add(self, plain_text: str, spans: tuple[Span, ...]) -> None:
+        if self.fp is None:
+            return
+        try:
+            self.text_bytes += self.fp.write(plain_text.encode('utf-8'))
+        except OSError:
+            self.discard()
+            return
+        self.text_length += len(plain_text)
+        self.line_ends.append(self.text_length)
+        for span in spans:
+            self.starts.append(span.start)
+            self.ends.append(span.end)
+            self.classes.append(self.string_ids.setdefault(span.cls, len(self.string_ids)))
+            self.targets.append(self.string_ids.setdefault(span.target, len(self.string_ids)))
+        self.line_spans.append(len(self.starts))
+
+    def close(self) -> None:
+        if self.fp is None:
+            return
+        encoded_strings = [string.encode('utf-8') for string in self.string_ids]
+        string_ends = array(self.cache.COLUMN, [0])
+        for encoded in encoded_strings:
+            string_ends.append(string_ends[-1] + len(encoded))
+        try:
+            for column in (self.line_ends, self.line_spans, self.starts, self.ends, self.classes, self.targets,
+                           string_ends):
+                column.tofile(self.fp)
+            self.fp.writelines(encoded_strings)
+            self.fp.seek(0)
+            self.fp.write(self.cache.HEADER.pack(self.cache.MAGIC, self.cache.VERSION, self.stat.st_mtime_ns,
+                                                 self.stat.st_size, len(self.line_ends), len(self.starts),
+                                                 len(self.string_ids), self.text_bytes))
+            self.fp.close()
+            self.fp = None
+            os.replace(self.tmp_path, self.path)
+        except OSError:
+            self.discard()
+
+    def discard(self) -> None:
+        try:
+            if self.fp is not None:
+                self.fp.close()
+            if self.tmp_path is not None:
+                os.unlink(self.tmp_path)
+        except OSError:
+            pass
+        self.fp = self.tmp_path = None
+
+
+class MemoryCorpusCache:
+    """
+    Corpus cache keeping the parsed lines of the dataset files in memory, used by the elgold.py serve daemon to
+    answer the repeated queries without parsing the files again. The files missing in memory or modified since they
+    were loaded are loaded from the binary cache (see CorpusCache) or parsed and stored in both caches.
+    """
+    def __init__(self, cache: CorpusCache) -> None:
+        self.cache = cache
+        self.files = {}  # file -> ((mtime_ns, size), [Line])
+
+    def is_current(self, file: str, stat: os.stat_result) -> bool:
+        return file in self.files and self.files[file][0] == (stat.st_mtime_ns, stat.st_size)
+
+    def load(self, file: str, stat: os.stat_result) -> Iterator[Line] | None:
+        if self.is_current(file, stat):
+            return iter(self.files[file][1])
+        lines = self.cache.load(file, stat)
+        if lines is None:
+            return None
+        lines = list(lines)
+        self.files[file] = ((stat.st_mtime_ns, stat.st_size), lines)
+        return iter(lines)
+
+    def writer(self, file: str, stat: os.stat_result) -> '_MemoryCacheWriter':
+        return _MemoryCacheWriter(self, file, stat)
+
+    def retain(self, files: list[str]) -> None:
+        """
+        Drop the files removed from the dataset.
+        """
+        for file in set(self.files) - set(files):
+            del self.files[file]
+
+
+class _MemoryCacheWriter:
+    """
+    Writer of MemoryCorpusCache: the lines are written to the binary cache and kept in memory.
+    """
+    def __init__(self, cache: MemoryCorpusCache, file: str, stat: os.stat_result) -> None:
+        self.cache = cache
+        self.file = file
+        self.stat = stat
+        self.writer = cache.cache.writer(file, stat)
+        self.lines = []
+
+    def add(self, plain_text: str, spans: tuple[Span, ...]) -> None:
+        self.writer.add(plain_text, spans)
+        self.lines.append(Line(self.file, len(self.lines) + 1, plain_text, spans))
+
+    def close(self) -> None:
+        self.writer.close()
+        self.cache.files[self.file] = ((self.stat.st_mtime_ns, self.stat.st_size), self.lines)
+
+    def discard(self) -> None:
+        self.writer.discard()
@@ -1,6 +1,14 @@
 import os
 import re
-from collections.abc import Iterator
+import warnings
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from itertools import islice
+from typing import IO, Any
+
+from utils.profiling import call_with_stats, profiler
+from utils.shards import shard_slice
+from utils.tokenizer import MarkupError, Span, parse_line
 
 
 def atoi(text):
@@ -16,47 +24,293 @@ def natural_keys(text):
     return [atoi(c) for c in re.split(r'(\d+)', text)]
 
 
+def cache_dir(data_dir: str) -> str:
+    """
+    Return the cache directory of the dataset (<data_dir>.elgold) with the corpus cache, the search index and
+    the socket of the serve daemon.
+    """
+    return os.path.abspath(data_dir) + '.elgold'
+
+
+class DictView:
+    """
+    Dictionary-style read access (e.g. line['tokens']) to the attributes of slotted classes. FIELDS maps keys to
+    attribute names.
+    """
+    __slots__ = ()
+    FIELDS = {}
+
+    def __getitem__(self, key: str):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, self.FIELDS[key])
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.FIELDS
+
+    def get(self, key: str, default=None):
+        return getattr(self, self.FIELDS[key]) if key in self.FIELDS else default
+
+    def keys(self):
+        return self.FIELDS.keys()
+
+
+class Token(DictView):
+    """
+    Text or entity token of a line. Tokens are not stored in the dataset, they are lightweight views created
+    on demand from the plain text and the entity spans of the line.
+    """
+    __slots__ = ('plain_text', 'start', 'end', 'cls', 'target')
+    FIELDS = {'type': 'type', 'raw': 'raw', 'text': 'text', 'class': 'cls', 'target': 'target'}
+
+    def __init__(self, plain_text: str, start: int, end: int, cls: str | None = None, target: str | None = None):
+        self.plain_text = plain_text
+        self.start = start
+        self.end = end
+        self.cls = cls
+        self.target = target
+
+    @property
+    def type(self) -> str:
+        return 'text' if self.cls is None else 'entity'
+
+    @property
+    def text(self) -> str:
+        return self.plain_text[self.start:self.end]
+
+    @property
+    def raw(self) -> str:
+        if self.cls is None:
+            return self.text
+        return '{{' + self.text + '|' + self.cls + '|' + self.target + '}}'
+
+
+class Line(DictView):
+    __slots__ = ('file', 'nb', 'plain_text', 'spans')
+    FIELDS = {'file': 'file', 'nb': 'nb', 'raw': 'raw', 'plain_text': 'plain_text',
+              'plain_text_tokens': 'plain_text_tokens', 'tokens': 'tokens', 'entities': 'entities'}
+
+    def __init__(self, file: str, nb: int, plain_text: str, spans: tuple[Span, ...]) -> None:
+        self.file = file
+        self.nb = nb
+        self.plain_text = plain_text
+        self.spans = spans
+
+    @property
+    def tokens(self) -> list[Token]:
+        """
+        Text and entity tokens of the line. The tokens always start and end with the (possibly empty) text token
+        and text tokens alternate with entity tokens.
+        """
+        tokens = []
+        pos = 0
+        for span in self.spans:
+            tokens.append(Token(self.plain_text, pos, span.start))
+            tokens.append(Token(self.plain_text, *span))
+            pos = span.end
+        tokens.append(Token(self.plain_text, pos, len(self.plain_text)))
+        return tokens
+
+    @property
+    def entities(self) -> list[Token]:
+        return [Token(self.plain_text, *span) for span in self.spans]
+
+    @property
+    def raw(self) -> str:
+        return ''.join([token.raw for token in self.tokens])
+
+    @property
+    def plain_text_tokens(self) -> list[str]:
+        return self.plain_text.split()
+
+
+class ParsedFile(DictView):
+    """
+    Lazily parsed dataset file. The lines are parsed on the first access to ParsedFile.lines and kept in memory.
+    ParsedFile.iterate_lines streams the lines straight from the disk (or from the corpus cache) instead, so only
+    one line is kept in memory at a time. The files of the archived datasets are read from the archive (see
+    utils.archive), their path is the path of the archive joined with the file name.
+    """
+    __slots__ = ('file', 'category', 'serial', 'path', 'cache', 'archive', '_lines')
+    FIELDS = {'file': 'file', 'category': 'category', 'serial': 'serial', 'lines': 'lines', 'entities': 'entities'}
+
+    def __init__(self, file: str, category: str, serial: str, path: str, cache=None, archive=None) -> None:
+        self.file = file
+        self.category = category
+        self.serial = serial
+        self.path = path
+        self.cache = cache
+        self.archive = archive
+        self._lines = None
+
+    def open(self, mode: str = 'r') -> IO:
+        """
+        Open the file in the text ('r') or binary ('rb') mode.
+        """
+        if self.archive is not None:
+            return self.archive.open(self.file, mode)
+        return open(self.path, mode)
+
+    def stat(self) -> os.stat_result:
+        """
+        Return the modification time (st_mtime_ns) and the size (st_size) of the file.
+        """
+        if self.archive is not None:
+            return self.archive.stat(self.file)
+        return os.stat(self.path)
+
+    def iterate_lines(self) -> Iterator[Line]:
+        if self._lines is not None:
+            yield from self._lines
+            return
+        writer = None
+        if self.cache is not None:
+            stat = self.stat()
+            cached_lines = self.cache.load(self.file, stat)
+            if cached_lines is not None:
+                yield from cached_lines
+                return
+            writer = self.cache.writer(self.file, stat)  # each line is written to the cache when it is parsed
+        nb = entities = 0
+        completed = False
+        try:
+            with self.open() as fp:
+                for nb, line in enumerate(fp, start=1):
+                    plain_text, spans = parse_line(line.rstrip('\n'))
+                    entities += len(spans)
+                    if writer is not None:
+                        writer.add(plain_text, spans)
+                    yield Line(self.file, nb, plain_text, spans)
+            completed = True
+        except MarkupError as e:
+            raise MarkupError(f'{self.file}:{nb}: {e}') from None
+        finally:
+            profiler.count(files=1, lines=nb, entities=entities)
+            if writer is not None:
+                if completed:
+                    writer.close()
+                else:  # a markup error or the consumer stopped early
+                    writer.discard()
+
+    @property
+    def lines(self) -> list[Line]:
+        if self._lines is None:
+            self._lines = list(self.iterate_lines())
+        return self._lines
+
+    @property
+    def entities(self) -> list[Token]:
+        return [entity for line in self.iterate_lines() for entity in line.entities]
+
+
+def _map_chunk(func: Callable[[ParsedFile], Any], files: list[ParsedFile]) -> list:
+    return [func(parsed_file) for parsed_file in files]
+
+
 class Dataset:
-    def __init__(self, data_dir: str = 'data') -> None:
+    MAP_CHUNK = 16  # maximum number of files sent to a worker process at once, see Dataset.map_files
+    MAP_WINDOW = 4  # number of chunks submitted ahead for each worker process
+
+    def __init__(self, data_dir: str = 'data', cache: bool = True) -> None:
+        """
+        The data_dir is the dataset directory or a .zip, .tar.gz or .tar.zst archive of the dataset, which is read
+        without unpacking (see utils.archive).
+
+        If cache is True, the parsed files are stored in the binary corpus cache next to the dataset
+        (see CorpusCache) and loaded from it when the files are not modified.
+        """
+        from utils.corpus_cache import CorpusCache  # imported here to avoid the circular import
+
         self.data_dir = data_dir
-        self.files = sorted([f for f in os.listdir(data_dir) if os.path.isfile(os.path.join(data_dir, f))],
-                            key=natural_keys)
+        self.cache_dir = cache_dir(data_dir)
+        self.cache = CorpusCache(self.cache_dir) if cache else None
+        if os.path.isdir(data_dir):
+            self.archive = None
+            files = [f for f in os.listdir(data_dir)  # skip hidden files, e.g. manifests of incremental outputs
+                     if not f.startswith('.') and os.path.isfile(os.path.join(data_dir, f))]
+        else:
+            from utils.archive import open_archive  # imports zipfile, tarfile and zstandard only for the archives
+
+            self.archive = open_archive(data_dir, self.cache_dir)
+            files = list(self.archive.members)
+        self.files = sorted(files, key=natural_keys)
 
     @staticmethod
     def parse_line(line: str) -> dict:
-        split = re.split(r'({{[^{}]*}})', line)
+        """
+        Parse the line into the dictionary of the 'tokens', 'entities' and 'plain_text', as in the earlier versions of
+        the toolset. Deprecated: use utils.tokenizer.parse_line, which returns the plain text and the entity spans.
+        """
+        warnings.warn('Dataset.parse_line is deprecated, use utils.tokenizer.parse_line', DeprecationWarning,
+                      stacklevel=2)
+        plain_text, spans = parse_line(line)
         tokens = []
-        entities = []
-        plain_text = ''
-        for i, raw_token in enumerate(split):
-            if i % 2 == 0:  # text
-                tokens.append({'type': 'text', 'text': raw_token})
-                plain_text += raw_token
-            else:  # entity
-                text, cls, target = raw_token.lstrip('{').rstrip('}').split('|')
-                entity = {'type': 'entity', 'raw': raw_token, 'text': text, 'class': cls, 'target': target}
-                tokens.append(entity)
-                entities.append(entity)
-                plain_text += text
-
+        for token in Line('', 0, plain_text, spans).tokens:
+            if token.type == 'text':
+                tokens.append({'type': 'text', 'text': token.text})
+            else:
+                tokens.append({'type': 'entity', 'raw': token.raw, 'text': token.text, 'class': token.cls,
+                               'target': token.target})
+        entities = [token for token in tokens if token['type'] == 'entity']
         return {'tokens': tokens, 'entities': entities, 'plain_text': plain_text}
 
-    def iterate_files(self) -> Iterator[dict]:
+    def select_shard(self, shard: int, shards: int) -> None:
+        """
+        Restrict the dataset to the files of the shard (0 <= shard < shards), a contiguous part of the files
+        in the natural-key order (see utils.shards).
+        """
+        self.files = self.files[shard_slice(len(self.files), shard, shards)]
+
+    def get_file(self, f: str) -> ParsedFile:
+        category, serial = f.removesuffix('.txt').split('_')
+        return ParsedFile(f, category, serial, os.path.join(self.data_dir, f), self.cache, self.archive)
+
+    def iterate_files(self) -> Iterator[ParsedFile]:
         for f in self.files:
-            category, serial = f.removesuffix('.txt').split('_')
-            parsed_file = {'file': f, 'category': category, 'serial': serial, 'lines': [], 'entities': []}
-            with open(os.path.join(self.data_dir, f)) as fp:
-                for nb, line in enumerate(fp, start=1):
-                    line = line.rstrip('\n')
-                    parsed_line = self.parse_line(line)
-                    parsed_file['lines'].append({
-                        'file': f,
-                        'nb': nb,
-                        'raw': line,
-                        'plain_text': parsed_line['plain_text'],
-                        'plain_text_tokens': parsed_line['plain_text'].split(),
-                        'tokens': parsed_line['tokens'],
-                        'entities': parsed_line['entities'],
-                    })
-                    parsed_file['entities'].extend(parsed_line['entities'])
-            yield parsed_file
+            yield self.get_file(f)
+
+    def map_files(self, func: Callable[[ParsedFile], Any], jobs: int = 1,
+                  files: Iterable[ParsedFile] | None = None) -> Iterator[Any]:
+        """
+        Apply func to every dataset file and yield the results in the natural-key order of the files. If jobs > 1,
+        the files are parsed and processed by a pool of worker processes, so func must be picklable (a module-level
+        function or functools.partial of it). The files can be passed explicitly, e.g. from TargetPrefetcher.
+
+        The files are sent to the workers in chunks and only MAP_WINDOW chunks per worker are submitted ahead of
+        the consumer, so the memory use does not grow with the dataset when the consumer is slower than the workers.
+        """
+        if files is None:
+            files = self.iterate_files()
+        if jobs == 1:
+            yield from map(func, files)
+            return
+        from concurrent.futures import ProcessPoolExecutor  # imported only when the workers are used
+
+        files = iter(files)
+        chunksize = max(1, min(len(self.files) // (jobs * 4), self.MAP_CHUNK))
+        window = deque()  # futures of the submitted chunks in the order of the files
+        with ProcessPoolExecutor(jobs) as executor:
+            while True:
+                while len(window) < jobs * self.MAP_WINDOW:
+                    chunk = list(islice(files, chunksize))
+                    if not chunk:
+                        break
+                    window.append(executor.submit(call_with_stats, _map_chunk, func, chunk))
+                if not window:
+                    return
+                results, stats = window.popleft().result()
+                profiler.merge(stats)  # the statistics collected by the worker process
+                yield from results
+
+    def iterate_lines(self) -> Iterator[Line]:
+        """
+        Stream the lines of all dataset files. Only the current line is kept in memory.
+        """
+        for parsed_file in self.iterate_files():
+            yield from parsed_file.iterate_lines()
+
+    def get_targets(self) -> set:
+        """
+        Collect the set of unique non-empty entity targets in the entire dataset.
+        """
+        return {span.target for line in self.iterate_lines() for span in line.spans if span.target}
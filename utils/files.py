@@ -0,0 +1,46 @@
+import os
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import IO
+
+
+def _umask() -> int:
+    umask = os.umask(0)  # the umask can only be read by setting it
+    os.umask(umask)
+    return umask
+
+
+def temp_file(directory: str, mode: str = 'wb') -> tuple[IO, str]:
+    """
+    Create a hidden temporary file in the directory, to be moved to its final path by os.replace. Unlike
+    tempfile.mkstemp (0600), the file gets the permissions of the files created by open (0666 without the bits of
+    the umask), which are kept by os.replace. Returns the open file and its path.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+    try:
+        os.chmod(tmp_path, 0o666 & ~_umask())
+        return os.fdopen(fd, mode), tmp_path
+    except BaseException:
+        os.close(fd)
+        os.unlink(tmp_path)
+        raise
+
+
+@contextmanager
+def atomic_write(path: str, mode: str = 'wb') -> Iterator[IO]:
+    """
+    Write the file atomically: the block writes to a temporary file in the directory of the path (see temp_file),
+    which replaces the file when the block completes. If the block fails, the temporary file is removed.
+    """
+    fp, tmp_path = temp_file(os.path.dirname(os.path.abspath(path)), mode)
+    try:
+        with fp:
+            yield fp
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
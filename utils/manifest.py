@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from typing import BinaryIO
+
+from utils.files import atomic_write
+
+
+def hash_file(path: str) -> str:
+    with open(path, 'rb') as fp:
+        return hash_stream(fp)
+
+
+def hash_stream(fp: BinaryIO) -> str:
+    return hashlib.file_digest(fp, 'sha256').hexdigest()
+
+
+class Manifest:
+    """
+    Manifest of the incremental output directory. For each output file, the manifest records the hash of its input
+    file, the hash of the output file, the statistics and the lookups of the transforms (see Transform.lookups).
+    The entries are valid only for the same options: when the hash of the options changes, all files are processed
+    again, but the file list of the previous run is kept to remove the outputs of the removed input files.
+    """
+    FILE = '.elgold-manifest.json'  # hidden files are skipped by Dataset
+
+    def __init__(self, out: str, options) -> None:
+        self.out = out
+        self.path = os.path.join(out, self.FILE)
+        self.options_hash = hashlib.sha256(json.dumps(options, sort_keys=True).encode('utf-8')).hexdigest()
+        self.files = {}
+        self.previous_files = set()  # files of the previous run with different options
+        try:
+            with open(self.path) as fp:
+                manifest = json.load(fp)
+        except (OSError, ValueError):
+            return
+        if manifest.get('options') == self.options_hash:
+            self.files = manifest['files']
+        else:
+            self.previous_files = set(manifest.get('files', ()))
+
+    def get_current(self, file: str, input_hash: str) -> dict | None:
+        """
+        Return the manifest entry of the file if the output file is up to date.
+        """
+        entry = self.files.get(file)
+        if entry is None or entry['input'] != input_hash:
+            return None
+        output_path = os.path.join(self.out, file)
+        if not os.path.exists(output_path) or hash_file(output_path) != entry['output']:
+            return None
+        return entry
+
+    def write(self, file: str, input_hash: str, output: list[str], stats: list, lookups: list) -> dict:
+        """
+        Atomically write the output file and return its manifest entry.
+        """
+        output_path = os.path.join(self.out, file)
+        with atomic_write(output_path, 'w') as fp:
+            fp.writelines(output)
+        return {'input': input_hash, 'output': hash_file(output_path), 'stats': stats, 'lookups': lookups}
+
+    def remove_stale(self, files: list[str]) -> None:
+        """
+        Remove the output files whose input files no longer exist in the dataset.
+        """
+        for file in (set(self.files) | self.previous_files) - set(files):
+            output_path = os.path.join(self.out, file)
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            self.files.pop(file, None)
+        self.previous_files = set()
+
+    def save(self) -> None:
+        with atomic_write(self.path, 'w') as fp:
+            json.dump({'options': self.options_hash, 'files': self.files}, fp)
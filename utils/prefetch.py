@@ -0,0 +1,77 @@
+from collections import deque
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.dataset import ParsedFile
+from utils.profiling import profiler
+
+
+def file_targets(parsed_file: ParsedFile) -> set:
+    """
+    Collect the unique non-empty targets of the file. The lines are not kept in memory, the file is parsed again
+    (usually from the corpus cache) when it is processed.
+    """
+    return {span.target for line in parsed_file.iterate_lines() for span in line.spans if span.target}
+
+
+class TargetPrefetcher:
+    """
+    Pipeline resolving the Wikipedia targets of the dataset files ahead of their processing. While a file is
+    processed (e.g. rewritten and written), the targets of the next files are collected and resolved on a pool
+    of threads, so the network requests overlap with the parsing and the writing. The files are read ahead until
+    two batches per thread are waiting or in progress, but at most depth files ahead.
+
+    Each title is resolved only once: the titles already requested for the previous files are skipped. The new titles
+    of the consecutive files are grouped into batches of batch_size titles (a single API request), a smaller batch is
+    sent only when the file waiting for it is next to be processed. The results are merged into the resolved
+    dictionary in the main thread, so the transforms can hold a reference to it. The files are yielded in their
+    original order, after all their targets are resolved.
+    """
+    def __init__(self, resolve: Callable[[set], dict], depth: int = 256, max_workers: int = 4,
+                 batch_size: int = 50) -> None:
+        self.resolve = resolve  # e.g. Wikipedia.check_targets or Wikipedia.get_ids
+        self.depth = depth
+        self.max_workers = max_workers
+        self.batch_size = batch_size
+        self.resolved = {}
+        self.requested = set()
+
+    def iterate(self, files: Iterable[ParsedFile]) -> Iterator[ParsedFile]:
+        files = iter(files)
+        window = deque()  # (parsed file, number of the titles requested up to the file)
+        futures = deque()  # (future, number of the titles requested up to the batch) in the order of submission
+        pending = []  # new titles not submitted yet
+        submitted = 0
+        merged = 0
+        lookahead = 2 * self.max_workers * self.batch_size  # titles waiting or in progress
+        with ThreadPoolExecutor(self.max_workers) as executor:
+
+            def submit(titles: list) -> None:
+                nonlocal submitted
+                submitted += len(titles)
+                futures.append((executor.submit(self.resolve, set(titles)), submitted))
+
+            while True:
+                while len(window) < self.depth and len(self.requested) - merged < lookahead:
+                    parsed_file = next(files, None)
+                    if parsed_file is None:
+                        break
+                    with profiler.phase('collect targets'):
+                        titles = file_targets(parsed_file) - self.requested
+                    self.requested.update(titles)
+                    pending.extend(sorted(titles))
+                    window.append((parsed_file, len(self.requested)))
+                    while len(pending) >= self.batch_size:
+                        submit(pending[:self.batch_size])
+                        del pending[:self.batch_size]
+                if not window:
+                    return
+                parsed_file, required = window.popleft()
+                if required > submitted:  # the last titles of the file are in the incomplete batch
+                    submit(pending)
+                    pending = []
+                with profiler.phase('wikipedia'):
+                    while merged < required:
+                        future, merged = futures.popleft()
+                        self.resolved.update(future.result())
+                yield parsed_file
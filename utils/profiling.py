@@ -0,0 +1,153 @@
+import cProfile
+import json
+import sys
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from contextlib import contextmanager
+from statistics import quantiles
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class Profiler:
+    """
+    Statistics of a command run: the wall time of its phases, the counters of the processed items (files, lines,
+    entities, ...) and the latencies of the Wikipedia API requests. The statistics are always collected - the cost
+    is a few operations per file - and reported only with the --stats and --stats-json options.
+
+    The phase times and the counters collected in the worker processes of Dataset.map_files are merged into
+    the profiler of the main process, so the phases executed by the workers may take longer than the wall time.
+    """
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.times = Counter()  # phase -> seconds, in the order of the first occurrence
+        self.counters = Counter()
+        self.latencies = []
+        self.lock = threading.Lock()  # the Wikipedia requests and lookups run in multiple threads
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] += time.perf_counter() - start
+
+    def iterate(self, name: str, iterable: Iterable) -> Iterator:
+        """
+        Yield the items of the iterable and add the time spent waiting for them to the phase. This separates
+        the time of producing the items (e.g. in the worker processes) from the time of consuming them.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.times[name] += time.perf_counter() - start
+                return
+            self.times[name] += time.perf_counter() - start
+            yield item
+
+    def count(self, **counts: int) -> None:
+        with self.lock:
+            self.counters.update(counts)
+
+    def request(self, seconds: float) -> None:
+        with self.lock:
+            self.latencies.append(seconds)
+
+    def snapshot(self) -> tuple[Counter, Counter]:
+        return Counter(self.times), Counter(self.counters)
+
+    def merge(self, delta: tuple[Counter, Counter]) -> None:
+        times, counters = delta
+        self.times.update(times)
+        self.counters.update(counters)
+
+    def summary(self, command: str | None = None) -> dict:
+        wall = time.perf_counter() - self.started
+        summary = {
+            'command': command,
+            'wall_seconds': wall,
+            'phases': dict(self.times),
+            'counters': dict(self.counters),
+            'rates': {f'{name}/s': self.counters[name] / wall for name in ('files', 'lines', 'entities')
+                      if name in self.counters},
+            'http': {'requests': len(self.latencies), 'seconds': sum(self.latencies)},
+            'peak_rss_kb': None,
+        }
+        if self.latencies:
+            latencies = sorted(self.latencies)
+            percentiles = quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+            summary['http'].update({'mean': sum(latencies) / len(latencies), 'p50': percentiles[49],
+                                    'p95': percentiles[94], 'max': latencies[-1]})
+        if resource is not None:  # ru_maxrss is in kilobytes on Linux
+            summary['peak_rss_kb'] = {'main': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                      'workers': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss}
+        return summary
+
+    @staticmethod
+    def format(summary: dict) -> str:
+        lines = [f'{"phase":30}{"seconds":>12}']
+        for name, seconds in summary['phases'].items():
+            lines.append(f'{name:30}{seconds:12.3f}')
+        lines.append(f'{"total":30}{summary["wall_seconds"]:12.3f}')
+        for name, count in summary['counters'].items():
+            rate = summary['rates'].get(f'{name}/s')
+            lines.append(f'{name:30}{count:12}' + (f' ({rate:.1f}/s)' if rate is not None else ''))
+        http = summary['http']
+        if http['requests']:
+            lines.append(f'{"wikipedia requests":30}{http["requests"]:12} (mean {http["mean"]:.3f} s, '
+                         f'p50 {http["p50"]:.3f} s, p95 {http["p95"]:.3f} s, max {http["max"]:.3f} s)')
+        if summary['peak_rss_kb'] is not None:
+            lines.append(f'{"peak RSS [MB]":30}{summary["peak_rss_kb"]["main"] / 1024:12.1f} '
+                         f'(workers {summary["peak_rss_kb"]["workers"] / 1024:.1f})')
+        return '\n'.join(lines)
+
+
+profiler = Profiler()
+
+
+def call_with_stats(func: Callable, *args) -> tuple:
+    """
+    Call the function in a worker process and return its result with the statistics collected during the call.
+    """
+    before_times, before_counters = profiler.snapshot()
+    result = func(*args)
+    times, counters = profiler.snapshot()
+    times.subtract(before_times)
+    counters.subtract(before_counters)
+    return result, (times, counters)
+
+
+def profile_command(ctx, stats: bool, stats_json: str | None, profile: str | None) -> None:
+    """
+    Set up the --stats, --stats-json and --profile options of the cli group. The statistics are reported and
+    the cProfile dump is saved when the command finishes.
+    """
+    if not stats and stats_json is None and profile is None:
+        return
+    profiler.started = time.perf_counter()
+    cprofile = None
+    if profile is not None:
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+
+    def finish():
+        if cprofile is not None:
+            cprofile.disable()
+            cprofile.dump_stats(profile)  # read with python -m pstats
+        summary = profiler.summary(ctx.invoked_subcommand)
+        if stats:
+            print(Profiler.format(summary), file=sys.stderr)
+        if stats_json is not None:
+            with open(stats_json, 'w') as fp:
+                json.dump(summary, fp, indent=2)
+
+    ctx.call_on_close(finish)
@@ -0,0 +1,157 @@
+import os
+import pickle
+from collections import defaultdict
+from collections.abc import Iterable, Iterator
+
+from utils.dataset import Dataset, Line, natural_keys
+from utils.files import atomic_write
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    Persistent inverted index of the dataset entities, stored in the cache directory next to the dataset. The index
+    maps entity classes and targets to the lines (file, line number) that contain them. Targets are additionally
+    indexed by their trigrams, so the substring search does not scan all the targets.
+
+    The index is updated incrementally: only the files whose modification time or size changed are re-indexed.
+    """
+    VERSION = 1
+
+    def __init__(self, dataset: Dataset) -> None:
+        self.dataset = dataset
+        self.path = os.path.join(dataset.cache_dir, 'search.pickle')
+        self.files = {}  # file -> (mtime_ns, size, {class: [line]}, {target: [line]})
+        self.classes = defaultdict(dict)  # class -> {file: [line]}
+        self.targets = defaultdict(dict)  # target -> {file: [line]}
+        self.trigrams = defaultdict(set)  # trigram -> {target}
+        self.load()
+        if self.update():
+            self.save()
+
+    def load(self) -> None:
+        try:
+            with open(self.path, 'rb') as fp:
+                version, files, classes, targets, trigrams = pickle.load(fp)
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return
+        if version == self.VERSION:
+            self.files, self.classes, self.targets, self.trigrams = files, classes, targets, trigrams
+
+    def save(self) -> None:
+        try:
+            os.makedirs(self.dataset.cache_dir, exist_ok=True)
+            with atomic_write(self.path) as fp:
+                pickle.dump((self.VERSION, self.files, self.classes, self.targets, self.trigrams), fp,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+        except OSError:
+            pass
+
+    def update(self) -> bool:
+        """
+        Re-index the modified files and drop the removed ones. Returns True if the index has changed.
+        """
+        changed = False
+        for f in set(self.files) - set(self.dataset.files):
+            self._remove(f)
+            changed = True
+        for f in self.dataset.files:
+            stat = self.dataset.get_file(f).stat()
+            if f in self.files and self.files[f][:2] == (stat.st_mtime_ns, stat.st_size):
+                continue
+            if f in self.files:
+                self._remove(f)
+            self._add(f, stat)
+            changed = True
+        return changed
+
+    def _add(self, f: str, stat: os.stat_result) -> None:
+        file_classes = defaultdict(list)
+        file_targets = defaultdict(list)
+        for line in self.dataset.get_file(f).iterate_lines():
+            for span in line.spans:
+                if not file_classes[span.cls] or file_classes[span.cls][-1] != line.nb:
+                    file_classes[span.cls].append(line.nb)
+                if not file_targets[span.target] or file_targets[span.target][-1] != line.nb:
+                    file_targets[span.target].append(line.nb)
+        self.files[f] = (stat.st_mtime_ns, stat.st_size, dict(file_classes), dict(file_targets))
+        for cls, lines in file_classes.items():
+            self.classes[cls][f] = lines
+        for target, lines in file_targets.items():
+            if target not in self.targets:
+                for trigram in trigrams(target):
+                    self.trigrams[trigram].add(target)
+            self.targets[target][f] = lines
+
+    def _remove(self, f: str) -> None:
+        _, _, file_classes, file_targets = self.files.pop(f)
+        for cls in file_classes:
+            del self.classes[cls][f]
+            if not self.classes[cls]:
+                del self.classes[cls]
+        for target in file_targets:
+            del self.targets[target][f]
+            if not self.targets[target]:
+                del self.targets[target]
+                for trigram in trigrams(target):
+                    self.trigrams[trigram].discard(target)
+                    if not self.trigrams[trigram]:
+                        del self.trigrams[trigram]
+
+    def find_targets(self, text: str) -> set:
+        """
+        Find the indexed targets that contain the text.
+        """
+        if len(text) < 3:
+            return {target for target in self.targets if text in target}
+        text_trigrams = sorted(trigrams(text), key=lambda trigram: len(self.trigrams.get(trigram, ())))
+        candidates = set(self.trigrams.get(text_trigrams[0], ()))
+        for trigram in text_trigrams[1:]:
+            candidates &= self.trigrams.get(trigram, set())
+        return {target for target in candidates if text in target}
+
+    @staticmethod
+    def _postings(index: dict, keys: Iterable[str]) -> dict:
+        lines = defaultdict(set)
+        for key in keys:
+            for f, file_lines in index.get(key, {}).items():
+                lines[f].update(file_lines)
+        return lines
+
+    def search(self, classes: Iterable[str] = (), targets: Iterable[str] = ()) -> dict:
+        """
+        Return the candidate lines ({file: sorted line numbers} in the natural-key order of the files) that contain
+        entities of any of the classes and entities with targets containing any of the texts. If both classes and
+        targets are empty, return all lines with entities. The lines are candidates, because a line may contain
+        the class and the target in different entities.
+        """
+        if not classes and not targets:
+            lines = self._postings(self.classes, self.classes)
+        else:
+            lines = None
+            if classes:
+                lines = self._postings(self.classes, classes)
+            if targets:
+                matching_targets = set().union(*[self.find_targets(text) for text in targets])
+                target_lines = self._postings(self.targets, matching_targets)
+                if lines is None:
+                    lines = target_lines
+                else:
+                    lines = {f: lines[f] & target_lines[f] for f in lines if f in target_lines}
+        return {f: sorted(lines[f]) for f in sorted(lines, key=natural_keys) if lines[f]}
+
+    def iterate_lines(self, classes: Iterable[str] = (), targets: Iterable[str] = ()) -> Iterator[Line]:
+        """
+        Stream the candidate lines found by SearchIndex.search. Only the files with candidate lines are read.
+        """
+        for f, nbs in self.search(classes, targets).items():
+            nbs = set(nbs)
+            last_nb = max(nbs)
+            for line in self.dataset.get_file(f).iterate_lines():
+                if line.nb in nbs:
+                    yield line
+                if line.nb >= last_nb:
+                    break
@@ -0,0 +1,108 @@
+import json
+import os
+import socketserver
+import sys
+import time
+from collections.abc import Callable, Iterator
+
+from utils.client import PROTOCOL_VERSION, ServerError, socket_path
+from utils.corpus_cache import CorpusCache, MemoryCorpusCache
+from utils.dataset import Dataset, cache_dir
+from utils.search_index import SearchIndex
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def send(self, message: dict) -> None:
+        self.wfile.write(json.dumps(message).encode('utf-8') + b'\n')
+
+    def handle(self) -> None:
+        try:
+            request = self.rfile.readline()
+            if not request:  # connection closed without a query, e.g. by the serve command checking the socket
+                return
+            try:
+                request = json.loads(request)
+                if not isinstance(request, dict):
+                    raise ServerError('malformed request')
+                if request.get('version') != PROTOCOL_VERSION:
+                    raise ServerError('the server runs a different version of the toolset, restart elgold.py serve')
+                if request.get('command') not in self.server.handlers:
+                    raise ServerError(f'unknown command {request.get("command")}')
+                self.server.refresh()
+                for line in self.server.handlers[request['command']](self.server, **request.get('args', {})):
+                    self.send({'line': line})
+            except Exception as e:  # reported to the client, the server keeps running
+                self.send({'error': str(e) if isinstance(e, ServerError) else f'{type(e).__name__}: {e}'})
+            else:
+                self.send({'done': True})
+        except (BrokenPipeError, ConnectionResetError):  # the client has quit, e.g. piped to head
+            pass
+
+
+class CorpusServer(socketserver.UnixStreamServer):
+    """
+    Daemon keeping the parsed dataset in memory (see MemoryCorpusCache) and answering the queries of the elgold.py
+    commands on the Unix socket in the cache directory of the dataset. The handlers map the command names to
+    the functions called with the server (its dataset and search index) and the command arguments, which yield
+    the lines of the command output.
+
+    The dataset files are checked for changes (modification time and size) before each query and every poll
+    seconds between the queries, so only the added and modified files are parsed again. The queries are answered
+    one at a time.
+    """
+    def __init__(self, data_dir: str, handlers: dict[str, Callable[..., Iterator[str]]], poll: float = 2.0) -> None:
+        self.data_dir = data_dir
+        self.handlers = handlers
+        self.poll = poll
+        self.cache = MemoryCorpusCache(CorpusCache(cache_dir(data_dir)))
+        self.dataset = None
+        self.search_index = None
+        self.refreshed = 0.0
+        self.refresh_error = None
+        self.refresh()
+        path = socket_path(data_dir)
+        if os.path.exists(path):
+            os.unlink(path)  # left by a killed daemon, see connect
+        super().__init__(path, _RequestHandler)
+
+    def refresh(self) -> None:
+        """
+        Load the added and modified dataset files into memory and drop the removed ones.
+        """
+        dataset = Dataset(self.data_dir, cache=False)
+        dataset.cache = self.cache
+        self.cache.retain(dataset.files)
+        for parsed_file in dataset.iterate_files():
+            if not self.cache.is_current(parsed_file.file, parsed_file.stat()):
+                for _ in parsed_file.iterate_lines():
+                    pass
+        self.dataset = dataset
+        if self.search_index is not None:
+            self.search_index.dataset = dataset
+            if self.search_index.update():
+                self.search_index.save()
+        self.refreshed = time.monotonic()
+
+    def get_search_index(self) -> SearchIndex:
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.dataset)
+        return self.search_index
+
+    def service_actions(self) -> None:
+        if self.poll and time.monotonic() - self.refreshed >= self.poll:
+            try:
+                self.refresh()
+                self.refresh_error = None
+            except Exception as e:  # e.g. a file saved with broken markup, reported again by the next query
+                error = f'{type(e).__name__}: {e}'
+                if error != self.refresh_error:
+                    print(f'refreshing the dataset failed: {error}', file=sys.stderr)
+                self.refresh_error = error
+                self.refreshed = time.monotonic()
+
+    def server_close(self) -> None:
+        super().server_close()
+        try:
+            os.unlink(self.server_address)
+        except OSError:
+            pass
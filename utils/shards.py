@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+from typing import BinaryIO
+
+ID_PATTERN = re.compile(rb'^\{"id": (\d+)')  # the BLINK records start with the id, see convert.py blink
+COPY_CHUNK = 1 << 20
+
+
+def shard_slice(files: int, shard: int, shards: int) -> slice:
+    """
+    Return the slice of the files (in the natural-key order) that belong to the shard (0 <= shard < shards). The shards
+    are contiguous and their sizes differ by at most one file, so the concatenated outputs of the shards follow
+    the order of a single run.
+    """
+    return slice(shard * files // shards, (shard + 1) * files // shards)
+
+
+def files_hash(files: list[str]) -> str:
+    return hashlib.sha256('\n'.join(files).encode('utf-8')).hexdigest()
+
+
+class Fragment:
+    """
+    Output of a converter for a single shard of the dataset. The fragment is a directory with the output files (the
+    "0" file with all data and, with --split, the files of the categories) and the fragment.json metadata: the format,
+    the shard, the hash of the dataset files, the converter options and the number of records. The metadata is saved
+    last, so the fragments of the interrupted runs are incomplete.
+
+    The records of each fragment are numbered from 0, merge_fragments shifts the ids by the number of records of
+    the previous shards.
+    """
+    FILE = 'fragment.json'
+
+    def __init__(self, path: str, format: str, split: bool, shard: int, shards: int, files_hash: str, options: dict,
+                 records: int = 0) -> None:
+        self.path = path
+        self.format = format
+        self.split = split
+        self.shard = shard
+        self.shards = shards
+        self.files_hash = files_hash
+        self.options = options
+        self.records = records
+
+    def save(self) -> None:
+        with open(os.path.join(self.path, self.FILE), 'w') as fp:
+            json.dump({'format': self.format, 'split': self.split, 'shard': self.shard, 'shards': self.shards,
+                       'files_hash': self.files_hash, 'options': self.options, 'records': self.records}, fp)
+
+    @classmethod
+    def load(cls, path: str) -> 'Fragment':
+        try:
+            with open(os.path.join(path, cls.FILE)) as fp:
+                return cls(path, **json.load(fp))
+        except (OSError, ValueError, TypeError):
+            raise ValueError(f'{path} is not a complete output fragment') from None
+
+    def output_files(self) -> list[str]:
+        return sorted(f for f in os.listdir(self.path) if f != self.FILE)
+
+
+def _copy_json_array(src: str, dst: BinaryIO, empty: bool) -> bool:
+    """
+    Append the items of the JSON array written by JsonArrayWriter to the dst array. Returns whether the dst array
+    is still empty.
+    """
+    with open(src, 'rb') as fp:
+        size = fp.seek(0, os.SEEK_END)
+        if size <= 2:  # []
+            return empty
+        if not empty:
+            dst.write(b', ')
+        fp.seek(1)
+        remaining = size - 2  # without [ and ]
+        while remaining > 0:
+            chunk = fp.read(min(COPY_CHUNK, remaining))
+            dst.write(chunk)
+            remaining -= len(chunk)
+    return False
+
+
+def _copy_json_lines(src: str, dst: BinaryIO, id_offset: int) -> None:
+    with open(src, 'rb') as fp:
+        if id_offset == 0:
+            shutil.copyfileobj(fp, dst)
+            return
+        for line in fp:
+            dst.write(ID_PATTERN.sub(lambda match: b'{"id": %d' % (int(match[1]) + id_offset), line, count=1))
+
+
+def merge_fragments(fragments: list[Fragment], target: str) -> None:
+    """
+    Merge the fragments of all shards into the output of a single run: the file (or the directory with --split)
+    identical to the one written without --shard. The fragments must come from the same dataset and options.
+    """
+    fragments = sorted(fragments, key=lambda fragment: fragment.shard)
+    first = fragments[0]
+    for fragment in fragments:
+        if (fragment.format, fragment.split, fragment.shards, fragment.files_hash, fragment.options) != \
+                (first.format, first.split, first.shards, first.files_hash, first.options):
+            raise ValueError(f'{fragment.path} does not match {first.path}: different format, options or dataset')
+    shards = [fragment.shard for fragment in fragments]
+    if shards != list(range(first.shards)):
+        missing = sorted(set(range(first.shards)) - set(shards))
+        raise ValueError(f'expected one fragment of each of {first.shards} shards, missing {missing}'
+                         if missing else 'duplicate shards')
+
+    fragment_outputs = [set(fragment.output_files()) for fragment in fragments]
+    for output in sorted(set().union(*fragment_outputs)):
+        with open(os.path.join(target, output) if first.split else target, 'wb') as dst:
+            if first.format == 'spacy':
+                dst.write(b'[')
+                empty = True
+                for fragment, outputs in zip(fragments, fragment_outputs):
+                    if output in outputs:
+                        empty = _copy_json_array(os.path.join(fragment.path, output), dst, empty)
+                dst.write(b']')
+            else:
+                id_offset = 0
+                for fragment, outputs in zip(fragments, fragment_outputs):
+                    if output in outputs:
+                        _copy_json_lines(os.path.join(fragment.path, output), dst, id_offset)
+                    id_offset += fragment.records
@@ -0,0 +1,129 @@
+from array import array
+from collections.abc import Iterable
+
+import numpy as np
+
+from utils.dataset import Dataset, ParsedFile
+from utils.table import EntityTable
+
+
+def _file_stats(parsed_file: ParsedFile) -> tuple[str, int, dict]:
+    """
+    Count the tokens of the file and the entities of each class with targets. Returns the category of the file,
+    the number of tokens and the {class: [entities, entities with targets]} dictionary.
+    """
+    tokens = 0
+    classes = {}
+    for line in parsed_file.iterate_lines():
+        tokens += len(line.plain_text.split())
+        for span in line.spans:
+            counts = classes.get(span.cls)
+            if counts is None:
+                counts = classes[span.cls] = [0, 0]
+            counts[0] += 1
+            if span.target:
+                counts[1] += 1
+    return parsed_file.category, tokens, classes
+
+
+class DatasetStats:
+    """
+    Statistics of the text categories accumulated in NumPy arrays: the numbers of entities and entities with
+    targets indexed by the category and the class id, and the lengths (numbers of tokens) of the texts of each
+    category. Each text is counted in the first category that is a substring of its category.
+
+    The class ids follow the order of the classes list (e.g. conf/ner_classes.json). The classes that are not on
+    the list are appended when they are first seen, so they are still counted in the totals.
+    """
+    def __init__(self, categories: Iterable[str], classes: Iterable[str] = ()) -> None:
+        self.categories = list(categories)
+        self.classes = list(classes)
+        self.class_ids = {cls: i for i, cls in enumerate(self.classes)}
+        self.total = np.zeros((len(self.categories), len(self.classes)), dtype=np.int64)
+        self.target = np.zeros((len(self.categories), len(self.classes)), dtype=np.int64)
+        self.lengths = [array('q') for _ in self.categories]
+        self.category_ids = {}  # file category -> index of the matching category or -1
+
+    def category_id(self, file_category: str) -> int:
+        if file_category not in self.category_ids:
+            self.category_ids[file_category] = next((i for i, category in enumerate(self.categories)
+                                                     if category in file_category), -1)
+        return self.category_ids[file_category]
+
+    def class_id(self, cls: str) -> int:
+        if cls not in self.class_ids:
+            self.class_ids[cls] = len(self.classes)
+            self.classes.append(cls)
+            padding = ((0, 0), (0, 1))
+            self.total = np.pad(self.total, padding)
+            self.target = np.pad(self.target, padding)
+        return self.class_ids[cls]
+
+    def add_file(self, file_category: str, tokens: int, classes: dict) -> None:
+        i = self.category_id(file_category)
+        if i < 0:
+            return
+        self.lengths[i].append(tokens)
+        for cls, (total, target) in classes.items():
+            j = self.class_id(cls)
+            self.total[i, j] += total
+            self.target[i, j] += target
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset, categories: Iterable[str], classes: Iterable[str] = (),
+                     jobs: int = 1) -> 'DatasetStats':
+        stats = cls(categories, classes)
+        for file_category, tokens, file_classes in dataset.map_files(_file_stats, jobs):
+            stats.add_file(file_category, tokens, file_classes)
+        return stats
+
+    @classmethod
+    def from_table(cls, table: EntityTable, categories: Iterable[str], classes: Iterable[str] = ()) -> 'DatasetStats':
+        stats = cls(categories, classes)
+        for i, lengths in enumerate(table.file_tokens_by_category(stats.categories)):
+            stats.lengths[i].extend(lengths.tolist())
+        total, target = table.class_counts(stats.categories)
+        ids = [stats.class_id(table_class) for table_class in table.classes]  # unique, the table classes are unique
+        stats.total[:, ids] += total
+        stats.target[:, ids] += target
+        return stats
+
+    @property
+    def no_target(self) -> np.ndarray:
+        return self.total - self.target
+
+    def percentages(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Return the percentages of the entities with targets, without targets and all entities of each class in
+        all entities of the category. The percentages of the categories without entities are zeros.
+        """
+        category_totals = self.total.sum(axis=1, keepdims=True)
+
+        def percentage(counts: np.ndarray) -> np.ndarray:
+            shares = np.divide(counts, category_totals, out=np.zeros(counts.shape), where=category_totals > 0)
+            return shares * 100
+
+        return percentage(self.target), percentage(self.no_target), percentage(self.total)
+
+    def length_stats(self, quantiles: Iterable[float] = ()) -> list[dict]:
+        """
+        Return the number of texts, the minimal, maximal and average length, the standard deviation and
+        the quantiles of the text lengths of each category.
+        """
+        quantiles = list(quantiles)
+        results = []
+        for lengths in self.lengths:
+            if len(lengths) == 0:
+                results.append({'count': 0, 'min': None, 'max': None, 'mean': None, 'std': None,
+                                'quantiles': [None] * len(quantiles)})
+                continue
+            lengths = np.frombuffer(lengths, dtype=np.int64)
+            results.append({
+                'count': len(lengths),
+                'min': int(lengths.min()),
+                'max': int(lengths.max()),
+                'mean': int(lengths.sum()) / len(lengths),
+                'std': float(lengths.std(ddof=1)) if len(lengths) > 1 else None,
+                'quantiles': np.quantile(lengths, quantiles).tolist() if quantiles else [],
+            })
+        return results
@@ -0,0 +1,217 @@
+import json
+from array import array
+from collections.abc import Iterable
+
+import numpy as np
+
+from utils.dataset import Dataset, ParsedFile
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow is optional, the table is saved in the NumPy .npz format without it
+    pa = None
+    pq = None
+
+DEFAULT_EXTENSION = '.parquet' if pa is not None else '.npz'
+
+
+def _file_rows(parsed_file: ParsedFile) -> tuple:
+    """
+    Collect the entity rows of the file: the columns of the entities and the numbers of lines and tokens of the file.
+    """
+    lines = array('i')
+    starts = array('i')
+    ends = array('i')
+    tokens = array('i')
+    classes = []
+    targets = []
+    n_lines = 0
+    n_tokens = 0
+    for line in parsed_file.iterate_lines():
+        n_lines += 1
+        n_tokens += len(line.plain_text.split())
+        for span in line.spans:
+            lines.append(line.nb)
+            starts.append(span.start)
+            ends.append(span.end)
+            tokens.append(len(line.plain_text[span.start:span.end].split()))
+            classes.append(span.cls)
+            targets.append(span.target)
+    return parsed_file.category, n_lines, n_tokens, lines, starts, ends, tokens, classes, targets
+
+
+class EntityTable:
+    """
+    Columnar table of the dataset entities. The string columns (file, category, class and target) are dictionary
+    encoded: the table stores integer codes and the dictionaries of their values. The file table stores
+    the category and the numbers of lines and tokens of each dataset file, including the files without entities.
+
+    The table is saved in Parquet if pyarrow is installed (the file table is stored in the metadata of the Parquet
+    file) or in the NumPy .npz format otherwise.
+    """
+    VERSION = 1
+    ENTITY_COLUMNS = ('file', 'line', 'start', 'end', 'class', 'target', 'has_target', 'tokens')
+
+    def __init__(self, files: list[str], categories: list[str], classes: list[str], targets: list[str],
+                 file_categories: np.ndarray, file_lines: np.ndarray, file_tokens: np.ndarray,
+                 columns: dict[str, np.ndarray]) -> None:
+        self.files = files
+        self.categories = categories
+        self.classes = classes
+        self.targets = targets
+        self.file_categories = file_categories  # category code of each file
+        self.file_lines = file_lines
+        self.file_tokens = file_tokens
+        self.columns = columns  # entity column -> array, the string columns are codes
+
+    def __len__(self) -> int:
+        return len(self.columns['file'])
+
+    @property
+    def category(self) -> np.ndarray:
+        """
+        Category codes of the entities.
+        """
+        return self.file_categories[self.columns['file']]
+
+    @classmethod
+    def from_dataset(cls, dataset: Dataset, jobs: int = 1) -> 'EntityTable':
+        categories = {}
+        classes = {}
+        targets = {'': 0}
+        file_categories = []
+        file_lines = []
+        file_tokens = []
+        columns = {name: array('i') for name in ('file', 'line', 'start', 'end', 'class', 'target', 'tokens')}
+        for file_code, rows in enumerate(dataset.map_files(_file_rows, jobs)):
+            category, n_lines, n_tokens, lines, starts, ends, tokens, file_classes, file_targets = rows
+            file_categories.append(categories.setdefault(category, len(categories)))
+            file_lines.append(n_lines)
+            file_tokens.append(n_tokens)
+            columns['file'].extend([file_code] * len(lines))
+            columns['line'].extend(lines)
+            columns['start'].extend(starts)
+            columns['end'].extend(ends)
+            columns['tokens'].extend(tokens)
+            columns['class'].extend([classes.setdefault(c, len(classes)) for c in file_classes])
+            columns['target'].extend([targets.setdefault(t, len(targets)) for t in file_targets])
+
+        columns = {name: np.frombuffer(column, dtype=np.int32) for name, column in columns.items()}
+        columns['has_target'] = columns['target'] != 0  # the empty target has code 0
+        return cls(list(dataset.files), list(categories), list(classes), list(targets),
+                   np.array(file_categories, dtype=np.int32), np.array(file_lines, dtype=np.int64),
+                   np.array(file_tokens, dtype=np.int64), {name: columns[name] for name in cls.ENTITY_COLUMNS})
+
+    def save(self, path: str) -> None:
+        """
+        Save the table in Parquet (.parquet) or in the NumPy .npz format (any other extension).
+        """
+        if path.endswith('.parquet'):
+            self._save_parquet(path)
+        else:
+            with open(path, 'wb') as fp:  # np.savez appends .npz to the paths without the extension
+                np.savez(fp, version=self.VERSION, files=np.array(self.files, dtype=str),
+                         categories=np.array(self.categories, dtype=str), classes=np.array(self.classes, dtype=str),
+                         targets=np.array(self.targets, dtype=str), file_categories=self.file_categories,
+                         file_lines=self.file_lines, file_tokens=self.file_tokens,
+                         **{f'column_{name}': column for name, column in self.columns.items()})
+
+    def _save_parquet(self, path: str) -> None:
+        if pa is None:
+            raise RuntimeError('saving the table in Parquet requires pyarrow')
+
+        def dictionary(codes: np.ndarray, values: list[str]):
+            return pa.DictionaryArray.from_arrays(pa.array(codes, type=pa.int32()), pa.array(values, type=pa.string()))
+
+        file_table = {
+            'version': self.VERSION,
+            'files': self.files,
+            'categories': [self.categories[code] for code in self.file_categories],
+            'lines': self.file_lines.tolist(),
+            'tokens': self.file_tokens.tolist(),
+        }
+        table = pa.table({
+            'file': dictionary(self.columns['file'], self.files),
+            'category': dictionary(self.category, self.categories),
+            'line': self.columns['line'],
+            'start': self.columns['start'],
+            'end': self.columns['end'],
+            'class': dictionary(self.columns['class'], self.classes),
+            'target': dictionary(self.columns['target'], self.targets),
+            'has_target': self.columns['has_target'],
+            'tokens': self.columns['tokens'],
+        }, metadata={'elgold.files': json.dumps(file_table)})
+        pq.write_table(table, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'EntityTable':
+        if path.endswith('.parquet'):
+            return cls._load_parquet(path)
+        with np.load(path, allow_pickle=False) as npz:
+            if int(npz['version']) != cls.VERSION:
+                raise ValueError(f'unsupported version of the entity table {path}')
+            return cls(npz['files'].tolist(), npz['categories'].tolist(), npz['classes'].tolist(),
+                       npz['targets'].tolist(), npz['file_categories'], npz['file_lines'], npz['file_tokens'],
+                       {name: npz[f'column_{name}'] for name in cls.ENTITY_COLUMNS})
+
+    @classmethod
+    def _load_parquet(cls, path: str) -> 'EntityTable':
+        if pq is None:
+            raise RuntimeError('reading the Parquet table requires pyarrow')
+        table = pq.read_table(path).unify_dictionaries()  # the row groups share the dictionaries
+        file_table = json.loads(table.schema.metadata[b'elgold.files'])
+        if file_table['version'] != cls.VERSION:
+            raise ValueError(f'unsupported version of the entity table {path}')
+        categories = {}
+        file_categories = [categories.setdefault(category, len(categories)) for category in file_table['categories']]
+
+        def codes(column: str) -> tuple[np.ndarray, list[str]]:
+            values = table.column(column).combine_chunks()
+            return values.indices.to_numpy(zero_copy_only=False).astype(np.int32), values.dictionary.to_pylist()
+
+        columns = {name: table.column(name).to_numpy() for name in ('line', 'start', 'end', 'has_target', 'tokens')}
+        columns['file'], files = codes('file')
+        columns['class'], classes = codes('class')
+        columns['target'], targets = codes('target')
+        if files != file_table['files']:  # the file codes must match the file table
+            file_codes = {file: code for code, file in enumerate(file_table['files'])}
+            columns['file'] = np.array([file_codes[file] for file in files], dtype=np.int32)[columns['file']]
+        return cls(file_table['files'], list(categories), classes, targets,
+                   np.array(file_categories, dtype=np.int32), np.array(file_table['lines'], dtype=np.int64),
+                   np.array(file_table['tokens'], dtype=np.int64), {name: columns[name] for name in cls.ENTITY_COLUMNS})
+
+    def match_categories(self, categories: Iterable[str]) -> np.ndarray:
+        """
+        Return the index of the first of the categories matching each category of the table (the same rule as
+        the dataset commands use: the category is a substring of the file category) or -1 if none matches.
+        """
+        categories = list(categories)
+        matches = np.full(len(self.categories), -1, dtype=np.int32)
+        for code, file_category in enumerate(self.categories):
+            for i, category in enumerate(categories):
+                if category in file_category:
+                    matches[code] = i
+                    break
+        return matches
+
+    def file_tokens_by_category(self, categories: list[str]) -> list[np.ndarray]:
+        """
+        Group the numbers of tokens of the files by the first matching category.
+        """
+        matches = self.match_categories(categories)[self.file_categories]
+        return [self.file_tokens[matches == i] for i in range(len(categories))]
+
+    def class_counts(self, categories: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Count the entities of each class in the categories. Returns the arrays of the numbers of all entities and
+        the entities with targets, indexed by the category index and the class code.
+        """
+        matches = self.match_categories(categories)[self.category]
+        selected = matches >= 0
+        keys = matches[selected] * len(self.classes) + self.columns['class'][selected]
+        shape = (len(categories), len(self.classes))
+        total = np.bincount(keys, minlength=shape[0] * shape[1]).reshape(shape)
+        target = np.bincount(keys, weights=self.columns['has_target'][selected],
+                             minlength=shape[0] * shape[1]).astype(np.int64).reshape(shape)
+        return total, target
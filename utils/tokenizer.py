@@ -0,0 +1,80 @@
+import re
+import sys
+from typing import NamedTuple
+
+# Entity markup: {{text|class|target}}. The text may contain "|", so the fields are split from the right.
+ENTITY_PATTERN = re.compile(r'{{([^{}]*)}}')
+BRACES_PATTERN = re.compile(r'{{|}}')
+
+
+class Span(NamedTuple):
+    """
+    Entity stored as [start, end) offsets into the plain text of its line. The class and target strings are interned,
+    so all entities of the same class or target share a single string object.
+    """
+    start: int
+    end: int
+    cls: str
+    target: str
+
+
+class MarkupError(ValueError):
+    pass
+
+
+def parse_line(line: str) -> tuple[str, tuple[Span, ...]]:
+    """
+    Split the annotated line into the plain text and the spans of its entities. Raises MarkupError if an entity
+    does not have the text, class and target fields. Unmatched braces are kept in the plain text, use validate_line
+    to find them.
+    """
+    if '{{' not in line:  # fast path for lines without entities
+        return line, ()
+    intern = sys.intern
+    new_tuple = tuple.__new__  # Span(...) calls the Python-level NamedTuple.__new__, which is much slower
+    parts = []
+    spans = []
+    position = 0
+    length = 0
+    for match in ENTITY_PATTERN.finditer(line):
+        start = match.start()
+        parts.append(line[position:start])
+        length += start - position
+        fields = match[1].rsplit('|', 2)
+        if len(fields) != 3:
+            raise MarkupError(f'entity "{match[0]}" at column {start + 1} has {len(fields)} fields, '
+                              f'expected text|class|target')
+        text, cls, target = fields
+        parts.append(text)
+        end = length + len(text)
+        spans.append(new_tuple(Span, (length, end, intern(cls), intern(target))))
+        length = end
+        position = match.end()
+    parts.append(line[position:])
+    return ''.join(parts), tuple(spans)
+
+
+def validate_line(line: str) -> list[tuple[int, str]]:
+    """
+    Find the malformed markup in the annotated line: entities without the text, class and target fields, entities
+    with empty texts or classes and unmatched "{{" or "}}". Returns the list of (column, message) tuples.
+    """
+    if '{{' not in line and '}}' not in line:
+        return []
+    errors = []
+    position = 0
+    for match in ENTITY_PATTERN.finditer(line):
+        for brace in BRACES_PATTERN.finditer(line, position, match.start()):
+            errors.append((brace.start() + 1, f'unmatched "{brace[0]}"'))
+        fields = match[1].rsplit('|', 2)
+        if len(fields) != 3:
+            errors.append((match.start() + 1, f'entity "{match[0]}" has {len(fields)} fields, '
+                                              f'expected text|class|target'))
+        elif not fields[0]:
+            errors.append((match.start() + 1, f'entity "{match[0]}" has empty text'))
+        elif not fields[1]:
+            errors.append((match.start() + 1, f'entity "{match[0]}" has empty class'))
+        position = match.end()
+    for brace in BRACES_PATTERN.finditer(line, position):
+        errors.append((brace.start() + 1, f'unmatched "{brace[0]}"'))
+    return errors
@@ -0,0 +1,220 @@
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from collections.abc import Iterable
+
+from utils.dataset import Line
+
+
+class Transform(ABC):
+    """
+    Token transform of the rewrite pipeline. The tokens are (text, class, target) tuples, where the class and the
+    target of text tokens are None. The transforms may collect statistics of the performed changes in stats.
+
+    The external data used by the transform for the current file (e.g. the resolved Wikipedia targets) is recorded
+    in lookups. The incremental mode saves the lookups of each file in the manifest and processes the file again if
+    any of them changed (see Transform.current).
+    """
+    def __init__(self) -> None:
+        self.stats = Counter()
+        self.lookups = {}
+
+    @abstractmethod
+    def __call__(self, token: tuple) -> tuple:
+        pass
+
+    @abstractmethod
+    def options(self) -> dict:
+        """
+        JSON-serializable options of the transform. The transforms with the same options produce the same output
+        for the same input file and lookups.
+        """
+
+    def current(self, lookups: dict) -> bool:
+        """
+        Return True if the lookups recorded for a file in the previous run are the same as the current data.
+        """
+        return not lookups
+
+    def changes(self, line: Line) -> bool:
+        """
+        Return False if the transform leaves all tokens of the line unchanged (and collects no statistics), so
+        rewrite_line can copy the line. The transforms that cannot tell return True.
+        """
+        return True
+
+
+class FilterClasses(Transform):
+    """
+    Replace entities with the specified classes with their mention texts.
+    """
+    def __init__(self, exclude: Iterable[str]) -> None:
+        super().__init__()
+        self.exclude = set(exclude)
+
+    def __call__(self, token: tuple) -> tuple:
+        text, cls, target = token
+        if cls is not None and cls in self.exclude:
+            return text, None, None
+        return token
+
+    def changes(self, line: Line) -> bool:
+        return any(span.cls in self.exclude for span in line.spans)
+
+    def options(self) -> dict:
+        return {'filter': sorted(self.exclude)}
+
+
+class ReplaceChars(Transform):
+    """
+    Replace and delete characters in the texts and, if exclude_targets is False, in the entity targets. The stats
+    count the replaced and deleted characters.
+    """
+    def __init__(self, search: str, replace: str, delete: str, exclude_targets: bool = True) -> None:
+        super().__init__()
+        self.table = str.maketrans(search, replace, delete)
+        self.pattern = re.compile('[' + re.escape(search + delete) + ']' if search or delete else '(?!)')
+        self.exclude_targets = exclude_targets
+
+    def translate(self, text: str) -> str:
+        found = self.pattern.findall(text)
+        if not found:
+            return text
+        self.stats.update(found)
+        return text.translate(self.table)
+
+    def __call__(self, token: tuple) -> tuple:
+        text, cls, target = token
+        if cls is not None and not self.exclude_targets:
+            target = self.translate(target)
+        return self.translate(text), cls, target
+
+    def changes(self, line: Line) -> bool:
+        if self.pattern.search(line.plain_text):
+            return True
+        return not self.exclude_targets and any(self.pattern.search(span.target) for span in line.spans)
+
+    def options(self) -> dict:
+        return {'replace': sorted(self.table.items()), 'exclude_targets': self.exclude_targets}
+
+
+class FixTargets(Transform):
+    """
+    Fix technical errors in Wikipedia targets using the results of Wikipedia.check_targets. In the interactive mode,
+    the user is asked to confirm each replacement. The resolved targets of the file are recorded in the lookups.
+    """
+    def __init__(self, targets: dict, remove_non_existent: bool = False, normalize: bool = False,
+                 redirect: bool = False, interactive: bool = False) -> None:
+        super().__init__()
+        self.targets = targets
+        self.remove_non_existent = remove_non_existent
+        self.normalize = normalize
+        self.redirect = redirect
+        self.interactive = interactive
+
+    def __call__(self, token: tuple) -> tuple:
+        text, cls, target = token
+        if cls is None or not target:  # text or entity without target
+            return token
+        resolved = self.lookups[target] = self.targets[target]
+        if self.remove_non_existent and not resolved['exists']:
+            if self.interactive:
+                while True:
+                    user_input = input(f'remove non-existing "{target}" [Ynr]: ')
+                    if user_input.lower() == 'y' or user_input.lower() == '':
+                        print(f'removing "{target}"')
+                        target = ''
+                        break
+                    elif user_input.lower() == 'n':
+                        print(f'keeping "{target}"')
+                        break
+                    elif user_input.lower() == 'r':
+                        replacement = input('replace with: ')
+                        print(f'replacing with "{replacement}"')
+                        target = replacement
+                        break
+            else:
+                print(f'removing "{target}')
+                target = ''
+
+        # If the redirect exists we perform redirect replacement and not normalize.
+        # In interactive mode this may lead to creating non-normalized targets, but we ignore it here
+        # for simplicity. You can always run the command again to normalize remaining targets.
+        elif self.redirect and resolved['normalized'] != resolved['redirect']:
+            if self.interactive:
+                while True:
+                    user_input = input(f'replace "{target}" with redirect "'
+                                       + resolved['redirect'] + '" [Ynr]: ')
+                    if user_input.lower() == 'y' or user_input.lower() == '':
+                        print(f'replacing "{target}" with redirect "' + resolved['redirect'] + '"')
+                        target = resolved['redirect']
+                        break
+                    elif user_input.lower() == 'n':
+                        print(f'keeping "{target}"')
+                        break
+                    elif user_input.lower() == 'r':
+                        replacement = input('replace with: ')
+                        print(f'replacing with "{replacement}"')
+                        target = replacement
+                        break
+            else:
+                print(f'replacing "{target}" with redirect "' + resolved['redirect'] + '"')
+                target = resolved['redirect']
+        elif self.normalize and target != resolved['normalized']:
+            if self.interactive:
+                while True:
+                    user_input = input(f'replace "{target}" with "' + resolved['normalized'] + '" [Yn]: ')
+                    if user_input.lower() == 'y' or user_input.lower() == '':
+                        print(f'replacing "{target} with ' + resolved['normalized'])
+                        target = resolved['normalized']
+                        break
+                    elif user_input.lower() == 'n':
+                        print(f'keeping "{target}"')
+                        break
+            else:
+                print(f'replacing "{target}" with ' + resolved['normalized'])
+                target = resolved['normalized']
+        return text, cls, target
+
+    def changes(self, line: Line) -> bool:
+        for span in line.spans:
+            if not span.target:
+                continue
+            target = self.targets.get(span.target)
+            if target is None:  # let __call__ report the unresolved target
+                return True
+            self.lookups[span.target] = target
+            if self.remove_non_existent and not target['exists'] or \
+                    self.redirect and target['normalized'] != target['redirect'] or \
+                    self.normalize and span.target != target['normalized']:
+                return True
+        return False
+
+    def current(self, lookups: dict) -> bool:
+        return all(self.targets.get(target) == resolved for target, resolved in lookups.items())
+
+    def options(self) -> dict:
+        # the resolved targets are compared for each file (see Transform.lookups), the interactive mode is never
+        # incremental
+        return {'fix_targets': {'remove_non_existent': self.remove_non_existent, 'normalize': self.normalize,
+                                'redirect': self.redirect}}
+
+
+def rewrite_line(line: Line, transforms: list[Transform]) -> str:
+    """
+    Apply the transforms in order to every token of the line and render the annotated line. The lines that none of
+    the transforms changes are copied.
+    """
+    if not any(transform.changes(line) for transform in transforms):
+        return line.raw
+    output_line = ''
+    for span_token in line.tokens:
+        token = (span_token.text, span_token.cls, span_token.target)
+        for transform in transforms:
+            token = transform(token)
+        text, cls, target = token
+        if cls is None:
+            output_line += text
+        else:
+            output_line += '{{' + text + '|' + cls + '|' + target + '}}'
+    return output_line
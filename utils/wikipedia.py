@@ -1,22 +1,103 @@
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+from utils.cache import TitleCache, chunks
+from utils.profiling import profiler
+
+
+class OfflineError(Exception):
+    def __init__(self, titles: set) -> None:
+        super().__init__(f'{len(titles)} titles missing from the Wikipedia cache in offline mode')
+        self.titles = titles
 
 
 class Wikipedia:
-    def __init__(self, language: str = 'en') -> None:
-        self.uri = f'https://{language}.wikipedia.org/w/api.php'
+    MAX_TITLES = 50  # the API limit of titles in a single query
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, language: str = 'en', cache: TitleCache | None = None, offline: bool = False,
+                 uri: str | None = None, max_workers: int = 4, retries: int = 5, backoff_factor: float = 0.5,
+                 timeout: float = 60) -> None:
+        if offline and cache is None:
+            raise ValueError('offline mode requires a cache')
+        self.uri = uri if uri is not None else f'https://{language}.wikipedia.org/w/api.php'
+        if cache is not None and cache.uri != self.uri:
+            raise ValueError(f'the cache stores the lookups of {cache.uri}, not of {self.uri}')
+        self.cache = cache
+        self.offline = offline
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = 'elgold-toolset (https://doi.org/10.34808/9wvq-th71)'
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=self.RETRY_STATUSES,
+                      allowed_methods=('GET',), respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _query(self, params: dict) -> dict:
+        """
+        Send the query to the API, follow the continuations and merge the partial results.
+        """
+        query = {'pages': {}, 'normalized': [], 'redirects': []}
+        params = dict(params)
+        while True:
+            start = time.perf_counter()
+            r = self.session.get(self.uri, params=params, timeout=self.timeout)
+            profiler.request(time.perf_counter() - start)  # including the retries
+            r.raise_for_status()
+            response = r.json()
+            if 'query' in response:
+                for page_id, page in response['query'].get('pages', {}).items():
+                    query['pages'].setdefault(page_id, {}).update(page)
+                query['normalized'].extend(response['query'].get('normalized', []))
+                query['redirects'].extend(response['query'].get('redirects', []))
+            if 'continue' not in response:
+                return query
+            params.update(response['continue'])
+
+    def _batched(self, fetch: Callable[[list], dict], titles: set) -> dict:
+        """
+        Split the titles into chunks accepted by the API and fetch them concurrently.
+        """
+        if len(titles) <= self.MAX_TITLES:  # a single request, e.g. the targets of one file (see TargetPrefetcher)
+            return fetch(sorted(titles))
+        results = {}
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for result in executor.map(fetch, chunks(sorted(titles), self.MAX_TITLES)):
+                results.update(result)
+        return results
+
+    def _missing(self, titles: set, cached: dict) -> set:
+        missing = titles - cached.keys()
+        profiler.count(wikipedia_cached_titles=len(titles) - len(missing), wikipedia_fetched_titles=len(missing))
+        if missing and self.offline:
+            raise OfflineError(missing)
+        return missing
 
     def check_targets(self, titles: set) -> dict:
         if not titles:  # no titles = empty result
             return {}
+        targets = self.cache.get_targets(titles) if self.cache is not None else {}
+        missing = self._missing(titles, targets)
+        if missing:
+            fetched = self._batched(self._check_targets, missing)
+            if self.cache is not None:
+                self.cache.put_targets(fetched)
+            targets.update(fetched)
+        return targets
+
+    def _check_targets(self, titles: list) -> dict:
         params = {'format': 'json', 'action': 'query', 'prop': 'info', 'redirects': '1', 'titles': '|'.join(titles)}
-        r = requests.get(self.uri, params=params)
-        response = r.json()
-        query_pages = response['query']['pages'] if 'query' in response else {}
-        pages = {value['title']: int(key) > 0 for key, value in query_pages.items()}
-        query_normalized = response['query']['normalized'] if 'normalized' in response['query'] else {}
-        normalized = {value['from']: value['to'] for value in query_normalized}
-        query_redirects = response['query']['redirects'] if 'redirects' in response['query'] else {}
-        redirects = {value['from']: value['to'] for value in query_redirects}
+        query = self._query(params)
+        pages = {value['title']: int(key) > 0 for key, value in query['pages'].items()}
+        normalized = {value['from']: value['to'] for value in query['normalized']}
+        redirects = {value['from']: value['to'] for value in query['redirects']}
         targets = {}
         for title in titles:
             normalized_title = normalized[title] if title in normalized else title
@@ -24,16 +105,31 @@ class Wikipedia:
             targets[title] = {
                 'normalized': normalized_title,
                 'redirect': final_destination,
-                'exists': pages[final_destination]
+                'exists': pages.get(final_destination, False)  # invalid and interwiki titles have no pages
             }
         return targets
 
     def get_ids(self, titles: set) -> dict:
         if not titles:  # no titles = empty result
             return {}
+        ids = self.cache.get_ids(titles) if self.cache is not None else {}
+        missing = self._missing(titles, ids)
+        if missing:
+            fetched = self._batched(self._get_ids, missing)
+            if self.cache is not None:
+                self.cache.put_ids(fetched)
+            ids.update(fetched)
+        title2id = {normalized: page_id for normalized, page_id in ids.values() if page_id is not None}
+        return title2id
+
+    def _get_ids(self, titles: list) -> dict:
         params = {'format': 'json', 'action': 'query', 'titles': '|'.join(titles)}
-        r = requests.get(self.uri, params=params)
-        response = r.json()
-        query_pages = response['query']['pages'] if 'query' in response else {}
-        title2id = {page['title']: page_id for page_id, page in query_pages.items()}
-        return title2id
\ No newline at end of file
+        query = self._query(params)
+        title2id = {page['title']: page_id for page_id, page in query['pages'].items()}
+        normalized = {value['from']: value['to'] for value in query['normalized']}
+        ids = {}
+        for title in titles:
+            normalized_title = normalized[title] if title in normalized else title
+            # the titles without pages (e.g. interwiki titles) are cached with None, so offline runs do not miss them
+            ids[title] = (normalized_title, title2id.get(normalized_title))
+        return ids
@@ -0,0 +1,241 @@
+import gzip
+import html
+import mmap
+import re
+import struct
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections.abc import Iterable, Iterator
+
+from utils.files import atomic_write
+from utils.profiling import profiler
+
+# Namespaces of the English Wikipedia: canonical name -> id. The titles of other namespaces are not indexed.
+NAMESPACES = {
+    '': 0, 'Talk': 1, 'User': 2, 'User talk': 3, 'Wikipedia': 4, 'Wikipedia talk': 5, 'File': 6, 'File talk': 7,
+    'MediaWiki': 8, 'MediaWiki talk': 9, 'Template': 10, 'Template talk': 11, 'Help': 12, 'Help talk': 13,
+    'Category': 14, 'Category talk': 15, 'Portal': 100, 'Portal talk': 101, 'Draft': 118, 'Draft talk': 119,
+    'Module': 828, 'Module talk': 829,
+}
+NAMESPACE_ALIASES = {'wp': 4, 'wt': 5, 'project': 4, 'project talk': 5, 'image': 6, 'image talk': 7}
+NAMESPACE_IDS = {name.lower(): ns for name, ns in NAMESPACES.items() if name} | NAMESPACE_ALIASES
+NAMESPACE_NAMES = {ns: name for name, ns in NAMESPACES.items()}
+
+# Whitespace that MediaWiki converts to spaces in titles and the invisible direction marks that it removes.
+WHITESPACE_PATTERN = re.compile('[ _\u00a0\u1680\u180e\u2000-\u200a\u2028\u2029\u202f\u205f\u3000]+')
+DIRECTION_MARKS_PATTERN = re.compile('[\u200e\u200f\u202a-\u202e]')
+INVALID_TITLE_PATTERN = re.compile(r'[\x00-\x1f\x7f<>\[\]{}|]|%[0-9A-Fa-f]{2}|~~~|^\.\.?(/|$)|/\.\.?(/|$)')
+MAX_TITLE_BYTES = 255
+
+SQL_ESCAPES = {'0': '\0', 'n': '\n', 'r': '\r', 't': '\t', 'Z': '\x1a'}
+SQL_TOKEN_PATTERN = re.compile(r"\(|\)|'(?:[^'\\]|\\.)*'|[^,()'\s]+")
+SQL_ESCAPE_PATTERN = re.compile(r'\\(.)', re.DOTALL)
+SQL_COLUMN_PATTERN = re.compile(r'^\s*`(\w+)`')
+
+
+def normalize_title(title: str) -> tuple[int, str] | None:
+    """
+    Normalize the title the way MediaWiki does: decode the HTML entities, apply the NFC normalization, convert
+    the underscores and the whitespace to single spaces, drop the fragment and the leading colon, recognize
+    the namespace prefix (case-insensitively) and capitalize the first letters of the namespace and the page name.
+    Returns (namespace id, normalized title) or None if the title is invalid.
+    """
+    title = unicodedata.normalize('NFC', html.unescape(title))
+    title = WHITESPACE_PATTERN.sub(' ', DIRECTION_MARKS_PATTERN.sub('', title)).strip()
+    title = title.split('#', 1)[0].rstrip()
+    if title.startswith(':'):
+        title = title[1:].lstrip()
+    namespace = 0
+    if ':' in title:
+        prefix, name = title.split(':', 1)
+        if prefix.rstrip().lower() in NAMESPACE_IDS:
+            namespace = NAMESPACE_IDS[prefix.rstrip().lower()]
+            title = name.lstrip()
+    if not title or INVALID_TITLE_PATTERN.search(title):
+        return None
+    first = title[0].upper()
+    if len(first) == 1:  # e.g. "ß".upper() is "SS", MediaWiki keeps such letters
+        title = first + title[1:]
+    if namespace != 0:
+        title = f'{NAMESPACE_NAMES[namespace]}:{title}'
+    if len(title.encode('utf-8')) > MAX_TITLE_BYTES:
+        return None
+    return namespace, title
+
+
+def dump_title(namespace: int, title: str) -> str:
+    """
+    Convert the namespace id and the title from the database form (underscores instead of spaces, no namespace
+    prefix) to the normalized title.
+    """
+    title = title.replace('_', ' ')
+    return title if namespace == 0 else f'{NAMESPACE_NAMES[namespace]}:{title}'
+
+
+def iterate_dump(path: str) -> Iterator[dict]:
+    """
+    Yield the rows of the MediaWiki SQL dump (e.g. enwiki-latest-page.sql.gz) as {column: value} dictionaries. The
+    column names are read from the CREATE TABLE statement of the dump. The values are strings or None for NULL.
+    """
+    columns = []
+    in_create = False
+    with (gzip.open if path.endswith('.gz') else open)(path, 'rt', encoding='utf-8', errors='replace') as fp:
+        for line in fp:
+            if line.startswith('CREATE TABLE'):
+                columns = []
+                in_create = True
+            elif in_create:
+                match = SQL_COLUMN_PATTERN.match(line)
+                if match:
+                    columns.append(match[1])
+                elif line.startswith(')'):
+                    in_create = False
+            elif line.startswith('INSERT INTO'):
+                values = line[line.index(' VALUES ') + 8:]
+                row = None
+                for token in SQL_TOKEN_PATTERN.findall(values):
+                    if token == '(':
+                        row = []
+                    elif token == ')':
+                        yield dict(zip(columns, row))
+                    elif token.startswith("'"):
+                        row.append(SQL_ESCAPE_PATTERN.sub(lambda m: SQL_ESCAPES.get(m[1], m[1]), token[1:-1]))
+                    else:
+                        row.append(None if token == 'NULL' else token)
+
+
+class WikipediaDump:
+    """
+    Offline resolver of the Wikipedia titles with the check_targets and get_ids interface of utils.wikipedia.Wikipedia.
+    The titles are looked up in a memory-mapped index built from the page and redirect tables of a Wikipedia dump
+    (see WikipediaDump.build), so no network is used. The index contains the normalized titles sorted by their UTF-8
+    bytes with the columns:
+
+    * the end offsets of the titles (starting with 0),
+    * the page id (0 for the redirect destinations without pages),
+    * the namespace id,
+    * the position of the redirect destination in the index (-1 if the page is not a redirect).
+
+    Like utils.wikipedia.Wikipedia, a single redirect is followed and get_ids returns the ids of the normalized titles
+    without following the redirects. Unlike the API, get_ids omits the titles without pages.
+    """
+    MAGIC = b'ELGW'
+    VERSION = 1
+    HEADER = struct.Struct('=4sHQ')  # magic, version, titles
+
+    def __init__(self, path: str) -> None:
+        with open(path, 'rb') as fp:
+            self.mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.size = self.HEADER.unpack_from(self.mm)
+        if (magic, version) != (self.MAGIC, self.VERSION):
+            raise ValueError(f'{path} is not a Wikipedia title index')
+        buffer = memoryview(self.mm)
+        offset = self.HEADER.size
+        columns = []
+        for code, length in (('Q', self.size + 1), ('I', self.size), ('i', self.size), ('i', self.size)):
+            nbytes = length * array(code).itemsize
+            columns.append(buffer[offset:offset + nbytes].cast(code))
+            offset += nbytes
+        self.title_ends, self.page_ids, self.namespaces, self.redirects = columns
+        self.titles_start = offset
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, i: int) -> bytes:
+        """
+        Return the UTF-8 encoded title at the position i, so bisect can search the index directly.
+        """
+        return self.mm[self.titles_start + self.title_ends[i]:self.titles_start + self.title_ends[i + 1]]
+
+    def find(self, title: str) -> int:
+        """
+        Return the position of the normalized title in the index or -1 if it is not there.
+        """
+        key = title.encode('utf-8')
+        i = bisect_left(self, key)
+        return i if i < self.size and self[i] == key else -1
+
+    def title(self, i: int) -> str:
+        return self[i].decode('utf-8')
+
+    def check_targets(self, titles: set) -> dict:
+        profiler.count(wikipedia_dump_titles=len(titles))
+        targets = {}
+        for title in titles:
+            normalized = normalize_title(title)
+            if normalized is None:  # invalid titles are reported by the API as they are, without pages
+                targets[title] = {'normalized': title, 'redirect': title, 'exists': False}
+                continue
+            normalized_title = normalized[1]
+            final_destination = normalized_title
+            exists = False
+            i = self.find(normalized_title)
+            if i >= 0:
+                if self.redirects[i] >= 0:
+                    i = self.redirects[i]
+                    final_destination = self.title(i)
+                exists = self.page_ids[i] > 0
+            targets[title] = {'normalized': normalized_title, 'redirect': final_destination, 'exists': exists}
+        return targets
+
+    def get_ids(self, titles: set) -> dict:
+        profiler.count(wikipedia_dump_titles=len(titles))
+        title2id = {}
+        for title in titles:
+            normalized = normalize_title(title)
+            if normalized is None:
+                continue
+            i = self.find(normalized[1])
+            if i >= 0 and self.page_ids[i] > 0:
+                title2id[normalized[1]] = str(self.page_ids[i])  # the API returns the ids as strings
+        return title2id
+
+    @classmethod
+    def build(cls, page_dump: str, redirect_dump: str, path: str, namespaces: Iterable[int] = (0,)) -> int:
+        """
+        Build the index from the page and redirect SQL dumps (plain or gzipped) and save it to the path. Only
+        the pages of the namespaces are indexed. Returns the number of indexed titles.
+        """
+        namespaces = set(namespaces) & set(NAMESPACE_NAMES)
+        redirects = {}  # page id -> (namespace, destination title)
+        with profiler.phase('read redirects'):
+            for row in iterate_dump(redirect_dump):
+                namespace = int(row['rd_namespace'])
+                if not row.get('rd_interwiki') and namespace in NAMESPACE_NAMES:
+                    redirects[int(row['rd_from'])] = (namespace, dump_title(namespace, row['rd_title']))
+
+        pages = {}  # title -> (page id, namespace, redirect (namespace, destination title) or None)
+        with profiler.phase('read pages'):
+            for row in iterate_dump(page_dump):
+                namespace = int(row['page_namespace'])
+                if namespace in namespaces:
+                    page_id = int(row['page_id'])
+                    pages[dump_title(namespace, row['page_title'])] = (page_id, namespace, redirects.get(page_id))
+            del redirects
+            for _, _, redirect in list(pages.values()):
+                if redirect is not None and redirect[1] not in pages:  # e.g. broken redirects
+                    pages[redirect[1]] = (0, redirect[0], None)
+            profiler.count(wikipedia_dump_titles=len(pages))
+
+        with profiler.phase('write index'):
+            keys = sorted(pages, key=lambda title: title.encode('utf-8'))
+            positions = {title: i for i, title in enumerate(keys)}
+            title_ends, page_ids, page_namespaces, destinations = array('Q', [0]), array('I'), array('i'), array('i')
+            encoded = [title.encode('utf-8') for title in keys]
+            end = 0
+            for title, key in zip(keys, encoded):
+                page_id, namespace, redirect = pages[title]
+                end += len(key)
+                title_ends.append(end)
+                page_ids.append(page_id)
+                page_namespaces.append(namespace)
+                destinations.append(positions[redirect[1]] if redirect is not None else -1)
+
+            with atomic_write(path) as fp:
+                fp.write(cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(keys)))
+                for column in (title_ends, page_ids, page_namespaces, destinations):
+                    column.tofile(fp)
+                fp.writelines(encoded)
+        return len(keys)
@@ -0,0 +1,105 @@
+import json
+import os
+
+
+class JsonArrayWriter:
+    """
+    Stream the items of a JSON array to the file. The output is the same as json.dump(items, fp). If the writing
+    fails, the incomplete file is removed, so an interrupted command does not leave a truncated but valid array.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fp = open(path, 'w')
+        self.fp.write('[')
+        self.empty = True
+
+    def write(self, item) -> None:
+        if not self.empty:
+            self.fp.write(', ')
+        json.dump(item, self.fp)
+        self.empty = False
+
+    def close(self) -> None:
+        self.fp.write(']')
+        self.fp.close()
+
+    def discard(self) -> None:
+        self.fp.close()
+        os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class JsonLinesWriter:
+    """
+    Stream the items to the file in the JSON lines format. If the writing fails, the incomplete file is removed.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.fp = open(path, 'w')
+
+    def write(self, item) -> None:
+        json.dump(item, self.fp)
+        self.fp.write('\n')
+
+    def close(self) -> None:
+        self.fp.close()
+
+    def discard(self) -> None:
+        self.fp.close()
+        os.unlink(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+class CategoryWriters:
+    """
+    Writers of the output split by the article categories. Each item is written to the "0" file that contains all
+    the data and to the file of its category. The files are created in the target directory when the first item
+    of the category is written.
+    """
+    def __init__(self, target_dir: str, extension: str, writer_class: type) -> None:
+        self.target_dir = target_dir
+        self.extension = extension
+        self.writer_class = writer_class
+        self.writers = {}
+
+    def _writer(self, category: str):
+        if category not in self.writers:
+            self.writers[category] = self.writer_class(os.path.join(self.target_dir, f'{category}{self.extension}'))
+        return self.writers[category]
+
+    def write(self, category: str, item) -> None:
+        self._writer('0').write(item)
+        self._writer(category).write(item)
+
+    def close(self) -> None:
+        for writer in self.writers.values():
+            writer.close()
+
+    def discard(self) -> None:
+        for writer in self.writers.values():
+            writer.discard()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()